@@ -7,40 +7,90 @@ from rlgym.utils.action_parsers import ActionParser
 from rlgym.utils.gamestates import GameState
 
 
+def _make_lookup_table():
+    actions = []
+    # Ground
+    for throttle in (-1, 0, 1):
+        for steer in (-1, 0, 1):
+            for boost in (0, 1):
+                for handbrake in (0, 1):
+                    if boost == 1 and throttle != 1:
+                        continue
+                    actions.append([throttle or boost, steer, 0, steer, 0, 0, boost, handbrake])
+    # Aerial
+    for pitch in (-1, 0, 1):
+        for yaw in (-1, 0, 1):
+            for roll in (-1, 0, 1):
+                for jump in (0, 1):
+                    for boost in (0, 1):
+                        if pitch == roll == jump == 0:  # Duplicate with ground
+                            continue
+                        # Enable handbrake better car control
+                        actions.append([boost, yaw, pitch, yaw, roll, jump, boost, 1])
+    actions = np.array(actions, dtype=np.float32)
+    actions.setflags(write=False)
+    return actions
+
+
+# BUILT ONCE PER PROCESS AND SHARED (READ-ONLY) BY EVERY PARSER
+LOOKUP_TABLE = _make_lookup_table()
+
+# Every entry is -1, 0 or 1, so a row reads as an 8 digit base 3 number
+_KEY_WEIGHTS = 3 ** np.arange(8)
+_REVERSE_LOOKUP = np.full(3 ** 8, -1, dtype=np.int16)
+_REVERSE_LOOKUP[(LOOKUP_TABLE.astype(int) + 1) @ _KEY_WEIGHTS] = np.arange(len(LOOKUP_TABLE))
+_REVERSE_LOOKUP.setflags(write=False)
+
+
+def action_to_index(actions) -> np.ndarray:
+    """
+    Maps controller actions, a single (8,) vector or a (n, 8) batch, back to their index in LOOKUP_TABLE.
+    Values are snapped to the nearest of -1, 0 and 1 first, actions with no matching entry map to -1.
+    """
+    digits = np.clip(np.rint(actions), -1, 1).astype(int) + 1
+    return _REVERSE_LOOKUP[digits @ _KEY_WEIGHTS]
+
+
 class ImmortalAction(ActionParser):
-    def __init__(self):
+    def __init__(self, batched=True):
         super().__init__()
-        self._lookup_table = self._make_lookup_table()
-
-    @staticmethod
-    def _make_lookup_table():
-        actions = []
-        # Ground
-        for throttle in (-1, 0, 1):
-            for steer in (-1, 0, 1):
-                for boost in (0, 1):
-                    for handbrake in (0, 1):
-                        if boost == 1 and throttle != 1:
-                            continue
-                        actions.append([throttle or boost, steer, 0, steer, 0, 0, boost, handbrake])
-        # Aerial
-        for pitch in (-1, 0, 1):
-            for yaw in (-1, 0, 1):
-                for roll in (-1, 0, 1):
-                    for jump in (0, 1):
-                        for boost in (0, 1):
-                            if pitch == roll == jump == 0:  # Duplicate with ground
-                                continue
-                            # Enable handbrake better car control
-                            actions.append([boost, yaw, pitch, yaw, roll, jump, boost, 1])
-        actions = np.array(actions)
-        return actions
+        self._lookup_table = LOOKUP_TABLE
+        self.batched = batched
 
     def get_action_space(self) -> gym.spaces.Space:
         return Discrete(len(self._lookup_table))
 
     def parse_actions(self, actions: Any, state: GameState) -> np.ndarray:
-        #return self._lookup_table[actions.astype(int).squeeze()]
+        if self.batched:
+            return self._parse_actions_batched(actions)
+        return self._parse_actions_loop(actions)
+
+    def _parse_actions_batched(self, actions: Any) -> np.ndarray:
+        if not isinstance(actions, np.ndarray) or actions.dtype == object:
+            try:
+                actions = np.asarray(actions, dtype='float64')
+            except ValueError:  # ragged input, let the loop sort it out
+                return self._parse_actions_loop(actions)
+
+        if actions.ndim <= 1:
+            return self._lookup_table[actions.reshape(-1).astype(int)]
+        if actions.ndim != 2 or actions.shape[1] > 8:
+            return self._parse_actions_loop(actions)
+        if actions.shape[1] < 8:
+            # short rows (padded by rocket-learn when action spaces differ) only ever carry an index
+            return self._lookup_table[actions[:, 0].astype(int)]
+
+        # rows padded with NaN hold their index in the first column, the rest are already expanded
+        padded = np.isnan(actions[:, 7])
+        if not padded.any():
+            return actions
+        parsed_actions = self._lookup_table[actions[:, 0].astype(int)]
+        if padded.all():
+            return parsed_actions
+        # expanded rows have their throttle in the first column, always a valid (and discarded) index
+        return np.where(padded[:, None], parsed_actions, actions)
+
+    def _parse_actions_loop(self, actions: Any) -> np.ndarray:
         parsed_actions = []
         for action in actions:
             #support reconstruction
@@ -59,12 +109,6 @@ class ImmortalAction(ActionParser):
         return np.asarray(parsed_actions)
 
 
-def multidim_intersect(arr1, arr2):
-    arr1_view = arr1.view([('',arr1.dtype)]*arr1.shape[1])
-    arr2_view = arr2.view([('',arr2.dtype)]*arr2.shape[1])
-    intersected = np.setdiff1d(arr1_view, arr2_view)
-    return intersected.view(arr1.dtype).reshape(-1, arr1.shape[1])
-
 SetAction = ImmortalAction
 
 if __name__ == '__main__':
@@ -1,3 +1,6 @@
+from contextlib import contextmanager
+
+from torch import nn
 from torch.nn import Sequential, Linear, LeakyReLU
 
 from rocket_learn.agent.discrete_policy import DiscretePolicy
@@ -27,4 +30,86 @@ def get_actor(split, state_dim, deterministic=False):
                                      Linear(512, 512), LeakyReLU(),
                                      Linear(512, total_output),
                                      SplitLayer(splits=split)
-                                     ), split, deterministic)
\ No newline at end of file
+                                     ), split, deterministic)
+
+
+class SharedTrunk(Sequential):
+    """
+    Hidden layers shared by the actor and the critic. Inside reuse(), calling it again on the same input tensor
+    returns the previous output, so a PPO pass through both heads only runs the trunk once.
+    """
+
+    def __init__(self, *layers):
+        super().__init__(*layers)
+        self._reusing = False
+        self._last = None
+
+    def forward(self, obs):
+        if self._last is not None and self._last[0] is obs:
+            return self._last[1]
+        out = super().forward(obs)
+        if self._reusing:
+            self._last = (obs, out)
+        return out
+
+    @contextmanager
+    def reuse(self):
+        self._reusing = True
+        try:
+            yield
+        finally:
+            self._reusing = False
+            self._last = None
+
+
+class SharedCritic(nn.Module):
+    def __init__(self, trunk: SharedTrunk):
+        super().__init__()
+        self.trunk = trunk
+        self.head = Linear(512, 1)
+
+    def forward(self, obs):
+        return self.head(self.trunk(obs))
+
+
+def get_shared_actor_critic(split, state_dim, deterministic=False):
+    """
+    Actor and critic over one trunk with the hidden layers of get_actor. The actor has the same layers, in the same
+    order, as the one from get_actor, so its parameters can be loaded into that one by position (weights.py,
+    tools/model_maker.py).
+    """
+    trunk = SharedTrunk(Linear(state_dim, 512), LeakyReLU(),
+                        Linear(512, 512), LeakyReLU(),
+                        Linear(512, 512), LeakyReLU(),
+                        Linear(512, 512), LeakyReLU(),
+                        Linear(512, 512), LeakyReLU(),
+                        Linear(512, 512), LeakyReLU())
+    actor = DiscretePolicy(Sequential(trunk,
+                                      Linear(512, sum(split)),
+                                      SplitLayer(splits=split)
+                                      ), split, deterministic)
+    return actor, SharedCritic(trunk)
+
+
+def get_actor_critic(split, state_dim, shared_trunk=False):
+    if shared_trunk:
+        return get_shared_actor_critic(split, state_dim)
+    return get_actor(split, state_dim), get_critic(state_dim)
+
+
+def critic_only_parameters(actor, critic):
+    """
+    The critic's parameters that aren't also the actor's (all of them, unless the trunk is shared).
+    """
+    actor_params = {id(p) for p in actor.parameters()}
+    return [p for p in critic.parameters() if id(p) not in actor_params]
+
+
+def load_by_position(module, state_dict):
+    """
+    Loads a state dict with the same tensors in the same order but other names, e.g. a shared trunk actor into
+    get_actor.
+    """
+    own = module.state_dict()
+    assert [t.shape for t in own.values()] == [t.shape for t in state_dict.values()], "Architectures don't match"
+    module.load_state_dict(dict(zip(own.keys(), state_dict.values())))
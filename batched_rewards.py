@@ -0,0 +1,202 @@
+from abc import ABC, abstractmethod
+from typing import Tuple, Union, Optional
+
+import numpy as np
+from rlgym.utils import RewardFunction
+from rlgym.utils.common_values import BLUE_TEAM, CAR_MAX_SPEED, BALL_MAX_SPEED, ORANGE_GOAL_BACK, BLUE_GOAL_BACK
+from rlgym.utils.gamestates import GameState, PlayerData
+from rlgym.utils.reward_functions.common_rewards import VelocityReward, EventReward, VelocityPlayerToBallReward, \
+    VelocityBallToGoalReward
+
+import telemetry
+from rewards import JumpTouchReward, KickoffReward
+from state_arrays import StateArrays, state_arrays
+
+
+class BatchedRewardFunction(ABC):
+    """
+    A reward term computed for every player of a state at once, combined by BatchedCombinedReward.
+    """
+
+    @abstractmethod
+    def reset(self, initial_state: GameState):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_rewards(self, state: GameState, players: StateArrays) -> np.ndarray:
+        """
+        :return: (n_players,) rewards, in state.players order.
+        """
+        raise NotImplementedError
+
+    def get_final_rewards(self, state: GameState, players: StateArrays) -> np.ndarray:
+        return self.get_rewards(state, players)
+
+
+class BatchedCombinedReward(RewardFunction):
+    """
+    Drop-in for CombinedReward over BatchedRewardFunctions. Every term is computed for all players the first time a
+    state is seen and the weights are applied in a single matrix product, get_reward then just looks up the player.
+    """
+
+    def __init__(
+            self,
+            reward_functions: Tuple[BatchedRewardFunction, ...],
+            reward_weights: Optional[Tuple[float, ...]] = None
+    ):
+        super().__init__()
+        self.reward_functions = reward_functions
+        self.reward_weights = np.array(reward_weights if reward_weights is not None else [1.] * len(reward_functions))
+
+        if len(self.reward_functions) != len(self.reward_weights):
+            raise ValueError(
+                ("Reward functions list length ({0}) and reward weights "
+                 "length ({1}) must be equal").format(len(self.reward_functions), len(self.reward_weights))
+            )
+
+        self._key = None
+        self._car_ids = None
+        self._rows = {}
+        self._rewards = None
+
+    @classmethod
+    def from_zipped(cls, *rewards_and_weights: Union[BatchedRewardFunction, Tuple[BatchedRewardFunction, float]]) \
+            -> "BatchedCombinedReward":
+        rewards = []
+        weights = []
+        for value in rewards_and_weights:
+            if isinstance(value, tuple):
+                r, w = value
+            else:
+                r, w = value, 1.
+            rewards.append(r)
+            weights.append(w)
+        return cls(tuple(rewards), tuple(weights))
+
+    def reset(self, initial_state: GameState):
+        # Episode boundary, ship whatever the previous episode recorded
+        telemetry.flush()
+        for func in self.reward_functions:
+            func.reset(initial_state)
+        self._key = None
+
+    def get_reward(self, player: PlayerData, state: GameState, previous_action: np.ndarray) -> float:
+        return self._get_rewards(state, final=False)[self._rows[player.car_id]]
+
+    def get_final_reward(self, player: PlayerData, state: GameState, previous_action: np.ndarray) -> float:
+        return self._get_rewards(state, final=True)[self._rows[player.car_id]]
+
+    def _get_rewards(self, state: GameState, final: bool) -> list:
+        # Every numpy call has a fixed cost that dominates with 2 players, so the per-step bookkeeping stays in python
+        if self._key is None or self._key[0] is not state or self._key[1] != final:
+            players = state_arrays(state)
+            if final:
+                terms = [func.get_final_rewards(state, players) for func in self.reward_functions]
+            else:
+                terms = [func.get_rewards(state, players) for func in self.reward_functions]
+            self._rewards = (self.reward_weights @ np.array(terms)).tolist()
+            telemetry.episodes().step(sum(self._rewards) / len(self._rewards))
+            if players.car_ids != self._car_ids:
+                self._rows = {car_id: i for i, car_id in enumerate(players.car_ids)}
+                self._car_ids = players.car_ids
+            self._key = (state, final)
+        return self._rewards
+
+
+def _goal_objective(team_num: np.ndarray, own_goal: bool) -> np.ndarray:
+    attack_orange = (team_num == BLUE_TEAM) != own_goal
+    return np.where(attack_orange[:, None], np.array(ORANGE_GOAL_BACK), np.array(BLUE_GOAL_BACK))
+
+
+def _scalar_projection(vec: np.ndarray, dest_vec: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(dest_vec, axis=-1)
+    dot = np.einsum('ij,ij->i', vec, dest_vec)
+    return np.divide(dot, norm, out=np.zeros_like(dot), where=norm != 0)
+
+
+def _component_velocity(vel: np.ndarray, pos_diff: np.ndarray, max_speed: float) -> np.ndarray:
+    norm_pos_diff = pos_diff / np.linalg.norm(pos_diff, axis=-1, keepdims=True)
+    return np.einsum('ij,ij->i', norm_pos_diff, vel / max_speed)
+
+
+class BatchedVelocityReward(VelocityReward, BatchedRewardFunction):
+    def get_rewards(self, state: GameState, players: StateArrays) -> np.ndarray:
+        vel = players.linear_velocity
+        return np.sqrt(np.einsum('ij,ij->i', vel, vel)) * ((1 - 2 * self.negative) / CAR_MAX_SPEED)
+
+
+class BatchedVelocityPlayerToBallReward(VelocityPlayerToBallReward, BatchedRewardFunction):
+    def get_rewards(self, state: GameState, players: StateArrays) -> np.ndarray:
+        vel = players.linear_velocity
+        pos_diff = state.ball.position - players.position
+        if self.use_scalar_projection:
+            return _scalar_projection(vel, pos_diff)
+        return _component_velocity(vel, pos_diff, CAR_MAX_SPEED)
+
+
+class BatchedVelocityBallToGoalReward(VelocityBallToGoalReward, BatchedRewardFunction):
+    def get_rewards(self, state: GameState, players: StateArrays) -> np.ndarray:
+        objective = _goal_objective(players.team_num, self.own_goal)
+        vel = np.broadcast_to(state.ball.linear_velocity, objective.shape)
+        pos_diff = objective - state.ball.position
+        if self.use_scalar_projection:
+            return _scalar_projection(vel, pos_diff)
+        return _component_velocity(vel, pos_diff, BALL_MAX_SPEED)
+
+
+class BatchedKickoffReward(KickoffReward, BatchedRewardFunction):
+    def get_rewards(self, state: GameState, players: StateArrays) -> np.ndarray:
+        if state.ball.position[0] != 0 or state.ball.position[1] != 0:
+            return np.zeros(len(players.car_ids))
+        pos_diff = state.ball.position - players.position
+        norm_pos_diff = pos_diff / np.linalg.norm(pos_diff, axis=-1, keepdims=True)
+        vel_to_ball = np.einsum('ij,ij->i', norm_pos_diff, players.linear_velocity)
+        telemetry.record_many(telemetry.KICKOFF_VELOCITY, vel_to_ball)
+        return vel_to_ball ** 2 / self.div
+
+
+class BatchedJumpTouchReward(JumpTouchReward, BatchedRewardFunction):
+    def get_rewards(self, state: GameState, players: StateArrays) -> np.ndarray:
+        return self.step(state, players.ball_touched, players.on_ground)
+
+
+class BatchedEventReward(EventReward, BatchedRewardFunction):
+    # EventReward's weights (goal, team goal, concede, touch, shot, save, demo) as StateArrays.info columns, the
+    # scores are handled apart since they only change on goals
+    _STAT_COLUMNS = (0, None, None, 7, 2, 1, 3)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stat_weights = np.zeros(8)
+        for weight, column in zip(self.weights, self._STAT_COLUMNS):
+            if column is not None:
+                self._stat_weights[column] = weight
+
+    def reset(self, initial_state: GameState, optional_data=None):
+        players = state_arrays(initial_state)
+        self._car_ids = players.car_ids
+        self._last_stats = players.info[:, :8]
+        self._last_scores = (players.blue_score, players.orange_score)
+
+    def get_rewards(self, state: GameState, players: StateArrays) -> np.ndarray:
+        stats = players.info[:, :8]
+        if players.car_ids != self._car_ids:  # Players are sorted by car_id, this only happens if someone left
+            rows = [self._car_ids.index(car_id) for car_id in players.car_ids]
+            self._last_stats = self._last_stats[rows]
+            self._car_ids = players.car_ids
+
+        diff_stats = np.maximum(stats - self._last_stats, 0)  # We only care about increasing values
+        self._last_stats = stats
+        rewards = diff_stats @ self._stat_weights
+        scorers = np.count_nonzero(diff_stats[:, 0])
+        if scorers:
+            telemetry.record_many(telemetry.GOAL, np.full(scorers, np.linalg.norm(state.ball.linear_velocity)))
+
+        scores = (players.blue_score, players.orange_score)
+        if scores != self._last_scores:
+            gains = [max(new - old, 0) for new, old in zip(scores, self._last_scores)]
+            for i, team in enumerate(players.team_num.tolist()):
+                own = team != BLUE_TEAM
+                rewards[i] += self.weights[1] * gains[own] + self.weights[2] * gains[1 - own]
+            self._last_scores = scores
+        return rewards
@@ -0,0 +1,128 @@
+"""
+Checkpoints written from a background thread, indexed by a manifest and pruned by a retention policy.
+
+save() only copies the state dicts (tensors cloned to the CPU), serialising and writing happens in a thread while
+training goes on. Every finished checkpoint is added to manifest.json in the directory, so finding the latest one or
+a given iteration is a lookup instead of a directory scan. Files are written to a temporary name and renamed, so the
+manifest never points at a partial checkpoint.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+import torch
+
+MANIFEST = "manifest.json"
+
+
+def snapshot(obj):
+    """
+    A copy of a (nested) state dict that training can't modify anymore.
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+
+def read_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"latest": None, "checkpoints": {}}
+
+
+class CheckpointManager:
+    """
+    :param keep_last: most recent checkpoints kept.
+    :param keep_every: also keeps every checkpoint whose iteration is a multiple of it, 0 for none.
+    """
+
+    def __init__(self, directory: str, keep_last=5, keep_every=1000):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = read_manifest(directory)
+        # At most one checkpoint waiting behind the one being written, save() blocks beyond that
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="checkpoints", daemon=True)
+        self._thread.start()
+        atexit.register(self.wait)  # Don't lose a checkpoint still being written when the learner stops
+
+    def save(self, iteration: int, state: dict, **meta):
+        """
+        :param state: what to torch.save, e.g. the actor, critic and optimizer state dicts.
+        :param meta: small JSON values stored in the manifest entry.
+        """
+        if self._error is not None:
+            raise RuntimeError("Writing the previous checkpoint failed") from self._error
+        self._queue.put((iteration, snapshot(state), meta))
+
+    def wait(self):
+        """
+        Blocks until every checkpoint passed to save is written.
+        """
+        self._queue.join()
+
+    def latest(self):
+        """
+        :return: path of the latest checkpoint, None if there is none.
+        """
+        latest = self.manifest["latest"]
+        return self.path(latest) if latest is not None else None
+
+    def path(self, iteration: int):
+        entry = self.manifest["checkpoints"].get(str(iteration))
+        return os.path.join(self.directory, entry["file"]) if entry is not None else None
+
+    def _run(self):
+        while True:
+            iteration, state, meta = self._queue.get()
+            try:
+                self._write(iteration, state, meta)
+            except Exception as e:  # Raised on the next save
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, iteration, state, meta):
+        file = f"checkpoint_{iteration:08d}.pt"
+        path = os.path.join(self.directory, file)
+        start = time.perf_counter()
+        torch.save(state, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+        entries = self.manifest["checkpoints"]
+        entries[str(iteration)] = {"file": file, "time": time.time(), "bytes": os.path.getsize(path),
+                                   "write_seconds": time.perf_counter() - start, **meta}
+        self.manifest["latest"] = max(int(i) for i in entries)
+        self._prune()
+        self._write_manifest()
+
+    def _prune(self):
+        iterations = sorted(int(i) for i in self.manifest["checkpoints"])
+        keep = set(iterations[-self.keep_last:])
+        if self.keep_every:
+            keep.update(i for i in iterations if i % self.keep_every == 0)
+        for iteration in iterations:
+            if iteration not in keep:
+                entry = self.manifest["checkpoints"].pop(str(iteration))
+                try:
+                    os.remove(os.path.join(self.directory, entry["file"]))
+                except FileNotFoundError:
+                    pass
+
+    def _write_manifest(self):
+        tmp_file = os.path.join(self.directory, MANIFEST + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_file, os.path.join(self.directory, MANIFEST))
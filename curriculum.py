@@ -0,0 +1,161 @@
+"""
+Runtime-adjustable weights for the setters of ImmortalStateSetter.
+
+The learner publishes weights to Redis through CurriculumScheduler, workers poll them between episodes through
+RedisCurriculumSource, so changing the curriculum doesn't need a restart of the fleet. Local training (no Redis) uses
+SharedCurriculumScheduler and its shared memory source instead.
+"""
+import json
+import time
+
+import numpy as np
+
+CURRICULUM_WEIGHTS = "curriculum-weights"
+
+
+def normalize_weights(weights) -> np.ndarray:
+    weights = np.array(weights, dtype=float)
+    if np.any(weights < 0) or not np.isfinite(weights).all() or weights.sum() <= 0:
+        raise ValueError(f"Setter weights must be non-negative with a positive sum, got {weights}")
+    return weights / weights.sum()
+
+
+def publish_weights(redis, weights):
+    # Versioned by time so workers also pick up weights from a restarted learner or set by hand
+    version = time.time_ns()
+    redis.set(CURRICULUM_WEIGHTS, json.dumps({"version": version, "weights": normalize_weights(weights).tolist()}))
+    return version
+
+
+class RedisCurriculumSource:
+    """
+    Worker side. poll() is called on every reset but only hits Redis every poll_interval seconds.
+    """
+
+    def __init__(self, redis, poll_interval=30.):
+        self.redis = redis
+        self.poll_interval = poll_interval
+        self.version = None
+        self._last_poll = -np.inf
+
+    def poll(self):
+        """
+        :return: the new weights if the learner published a version we haven't seen yet, otherwise None.
+        """
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return None
+        self._last_poll = now
+
+        raw = self.redis.get(CURRICULUM_WEIGHTS)
+        if raw is None:
+            return None
+        published = json.loads(raw)
+        if published["version"] == self.version:
+            return None
+        self.version = published["version"]
+        return np.array(published["weights"])
+
+
+class CurriculumScheduler:
+    """
+    Learner side. Publishes base_weights and, when adaptive, shifts weight towards the setters whose episodes get
+    the lowest reward per step.
+
+    The adapted weights are a mix of the base weights and a softmax over the negated z-scores of the (exponentially
+    averaged) reward per step of each setter, each setter keeps at least min_share of its base weight.
+    """
+
+    def __init__(self, redis, base_weights, adaptive=False, mix=0.5, temperature=1., min_share=0.25, smoothing=0.9):
+        self.redis = redis
+        self.base_weights = normalize_weights(base_weights)
+        self.adaptive = adaptive
+        self.mix = mix
+        self.temperature = temperature
+        self.min_share = min_share
+        self.smoothing = smoothing
+
+        self.weights = self.base_weights
+        self._reward_per_step = np.full(len(self.base_weights), np.nan)
+
+    def publish(self, weights=None):
+        if weights is not None:
+            self.weights = normalize_weights(weights)
+        self._publish(self.weights)
+
+    def _publish(self, weights):
+        publish_weights(self.redis, weights)
+
+    def update(self, rewards, lengths):
+        """
+        :param rewards: per setter total reward over the last iteration (nan or 0 episodes for unseen setters).
+        :param lengths: per setter total episode steps over the last iteration.
+        """
+        if not self.adaptive:
+            return
+        rewards = np.asarray(rewards, dtype=float)
+        lengths = np.asarray(lengths, dtype=float)
+        seen = lengths > 0
+        if not seen.any():
+            return
+
+        current = np.divide(rewards, lengths, out=np.full(len(lengths), np.nan), where=seen)
+        old = self._reward_per_step
+        self._reward_per_step = np.where(
+            seen,
+            np.where(np.isnan(old), current, self.smoothing * old + (1 - self.smoothing) * current),
+            old)
+
+        known = ~np.isnan(self._reward_per_step)
+        if known.sum() < 2:
+            return
+        values = self._reward_per_step[known]
+        z = (values - values.mean()) / (values.std() + 1e-8)
+        logits = -z / self.temperature
+        focus = np.zeros(len(self.base_weights))
+        focus[known] = np.exp(logits - logits.max())
+        focus[known] *= self.base_weights[known].sum() / focus[known].sum()  # Unseen setters keep their base share
+
+        focus[~known] = self.base_weights[~known]
+        weights = (1 - self.mix) * self.base_weights + self.mix * focus
+        self.publish(np.maximum(weights, self.min_share * self.base_weights))
+
+    def get_metrics(self, names) -> dict:
+        return {f"curriculum/{name}": w for name, w in zip(names, self.weights)}
+
+
+class SharedCurriculumSource:
+    """
+    Worker side of SharedCurriculumScheduler, a poll() reads two shared values.
+    """
+
+    def __init__(self, weights, version):
+        self.weights = weights
+        self.shared_version = version
+        self.version = 0
+
+    def poll(self):
+        if self.shared_version.value == self.version:
+            return None
+        with self.shared_version.get_lock():
+            self.version = self.shared_version.value
+            return np.array(self.weights[:])
+
+
+class SharedCurriculumScheduler(CurriculumScheduler):
+    """
+    CurriculumScheduler for worker processes started by the learner, publishes to shared memory instead of Redis.
+    """
+
+    def __init__(self, base_weights, ctx, **kwargs):
+        self._weights = ctx.Array("d", len(base_weights), lock=False)
+        self._version = ctx.Value("q", 0)
+        super().__init__(None, base_weights, **kwargs)
+
+    def _publish(self, weights):
+        with self._version.get_lock():
+            self._weights[:] = weights
+            self._version.value += 1
+
+    def source(self) -> SharedCurriculumSource:
+        return SharedCurriculumSource(self._weights, self._version)
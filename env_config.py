@@ -0,0 +1,88 @@
+"""
+Everything the learner and the workers must agree on: observation, reward, action, terminal, state setter and match
+factories, and shared constants. Kept free of learner dependencies (wandb, rocket-learn's PPO) so workers start quickly.
+"""
+from rlgym.utils.reward_functions.common_rewards import VelocityReward
+from rlgym.utils.terminal_conditions.common_conditions import TimeoutCondition, NoTouchTimeoutCondition, \
+    GoalScoredCondition
+
+from actionparser import ImmortalAction
+from batched_rewards import BatchedCombinedReward, BatchedVelocityReward, BatchedKickoffReward, \
+    BatchedJumpTouchReward, BatchedEventReward, BatchedVelocityPlayerToBallReward, BatchedVelocityBallToGoalReward
+from obs import BatchedAdvancedObs
+from rewards import WallTouchReward, TrackedCombinedReward, TrackedEventReward, JumpTouchReward, KickoffReward
+from state_arrays import ArrayMatch
+from terminals import TrackedTerminalCondition
+
+WORKER_COUNTER = "worker-counter"
+
+FRAME_SKIP = 6  # Number of ticks to repeat an action
+
+TEAM_SIZE = 1
+
+# ROCKET-LEARN EXPECTS A SET OF DISTRIBUTIONS FOR EACH ACTION FROM THE NETWORK, NOT
+# THE ACTIONS THEMSELVES. SEE network_setup.readme.txt FOR MORE INFORMATION
+SPLIT = (126,)
+
+# TOTAL SIZE OF THE INPUT DATA
+STATE_DIM = 107
+
+
+# ENSURE OBSERVATION, REWARD, AND ACTION CHOICES ARE THE SAME IN THE WORKER
+def obs():
+    return BatchedAdvancedObs()
+
+
+def rew(team_size=1):
+    # PER-PLAYER IN 1V1, WITH 2 PLAYERS NUMPY'S PER-CALL COST MAKES THE BATCHED TERMS SLOWER (tools/bench_rewards.py)
+    if team_size == 1:
+        return TrackedCombinedReward.from_zipped(
+            (VelocityReward(), 0.007),
+            (KickoffReward(), 0.5),
+            (JumpTouchReward(), 4.0),
+            (TrackedEventReward(team_goal=1200, demo=500, concede=-1200), 0.01),
+        )
+    return BatchedCombinedReward.from_zipped(
+        #(BatchedVelocityPlayerToBallReward(), 0.004),
+        (BatchedVelocityReward(), 0.007),
+        #(BatchedVelocityBallToGoalReward(), 0.02),
+        (BatchedKickoffReward(), 0.5),
+        (BatchedJumpTouchReward(), 4.0),
+        #(WallTouchReward(min_height=250), 2.0),
+        (BatchedEventReward(team_goal=1200,
+                            #save=200,
+                            demo=500,
+                            concede=-1200), 0.01),
+    )
+
+
+def act():
+    return ImmortalAction()
+
+
+def terminals():
+    fps = 120 / FRAME_SKIP
+    # WRAPPED SO THE EPISODE STATS KNOW WHICH ONE ENDED THE EPISODE
+    return [TrackedTerminalCondition(TimeoutCondition(round(fps * 30))),
+            TrackedTerminalCondition(NoTouchTimeoutCondition(round(fps * 20))),
+            TrackedTerminalCondition(GoalScoredCondition())]
+
+
+def state_setter(**kwargs):
+    from state import ImmortalStateSetter  # Opens the replay states
+    return ImmortalStateSetter(**kwargs)
+
+
+def match(game_speed=100, curriculum_source=None):
+    # STATES ARE DECODED WITH THEIR StateArrays, SHARED BY THE OBS, REWARDS AND TERMINALS
+    return ArrayMatch(
+        game_speed=game_speed,
+        self_play=True,
+        team_size=TEAM_SIZE,
+        state_setter=state_setter(weights_source=curriculum_source),
+        obs_builder=obs(),
+        action_parser=act(),
+        terminal_conditions=terminals(),
+        reward_function=rew(TEAM_SIZE),
+        tick_skip=FRAME_SKIP,
+    )
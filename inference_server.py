@@ -0,0 +1,306 @@
+"""
+One process per host holding the pretrained opponents (Necto, Nexto) and the latest actor, serving every worker
+on the host over a Unix socket. Requests arriving within batch_timeout of each other are run as one batch.
+
+Start it before the workers: python -m inference_server <socket_path> <ip> <password>
+and launch the workers with --inference_server <socket_path>.
+"""
+import argparse
+import copy
+import os
+import pickle
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import cloudpickle
+import torch
+from torch.distributions import Categorical
+
+_HEADER = struct.Struct("!I")
+
+
+def _send(sock: socket.socket, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while n:
+        received = sock.recv_into(view, n)
+        if received == 0:
+            raise ConnectionError("Inference server connection closed")
+        view = view[received:]
+        n -= received
+    return buf
+
+
+def _recv(sock: socket.socket):
+    size, = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return pickle.loads(_recv_exact(sock, size))
+
+
+# Model arguments can be tensors or (nested) tuples of tensors, all batch-first
+
+def _signature(obj):
+    if isinstance(obj, torch.Tensor):
+        return tuple(obj.shape[1:]), obj.dtype
+    if isinstance(obj, (tuple, list)):
+        return tuple(_signature(o) for o in obj)
+    return repr(obj)
+
+
+def _batch_size(obj) -> int:
+    if isinstance(obj, torch.Tensor):
+        return len(obj)
+    for o in obj:
+        if isinstance(o, (torch.Tensor, tuple, list)):
+            return _batch_size(o)
+    raise ValueError("Model arguments need at least one tensor")
+
+
+def _cat(items: list):
+    first = items[0]
+    if isinstance(first, torch.Tensor):
+        return torch.cat(items)
+    if isinstance(first, (tuple, list)):
+        return type(first)(_cat([item[i] for item in items]) for i in range(len(first)))
+    return first
+
+
+def _split(output, sizes, total):
+    # Splits every batch-first tensor of the output back into the requests it came from
+    if isinstance(output, torch.Tensor) and output.dim() > 0 and output.shape[0] == total:
+        return list(torch.split(output, sizes))
+    if isinstance(output, (tuple, list)):
+        parts = [_split(o, sizes, total) for o in output]
+        return [type(output)(p[i] for p in parts) for i in range(len(sizes))]
+    return [output] * len(sizes)
+
+
+class InferenceServer:
+    def __init__(self, socket_path: str, models: dict, max_batch=256, batch_timeout=0.002):
+        """
+        :param models: name -> callable taking batch-first tensors.
+        """
+        self.socket_path = socket_path
+        self.models = models
+        self.max_batch = max_batch
+        self.batch_timeout = batch_timeout
+        self._requests = queue.Queue()
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        threading.Thread(target=self._run_batches, name="batches", daemon=True).start()
+        print("Inference server listening on", self.socket_path, "serving", ", ".join(self.models))
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=self._read, args=(conn,), daemon=True).start()
+
+    def _read(self, conn: socket.socket):
+        # Clients wait for the reply before sending again, so there is never more than one request per connection
+        with conn:
+            while True:
+                try:
+                    name, args = _recv(conn)
+                except ConnectionError:
+                    return
+                self._requests.put((conn, name, args))
+
+    def _run_batches(self):
+        while True:
+            pending = [self._requests.get()]
+            deadline = time.monotonic() + self.batch_timeout
+            while len(pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for request in pending:
+                groups.setdefault((request[1], _signature(request[2])), []).append(request)
+            for (name, _), requests in groups.items():
+                self._run(name, requests)
+
+    def _run(self, name, requests):
+        sizes = [_batch_size(args) for _, _, args in requests]
+        batched = _cat([args for _, _, args in requests])
+        try:
+            with torch.no_grad():
+                results = _split(self.models[name](*batched), sizes, sum(sizes))
+        except Exception as e:  # Don't take the server down, the workers raise it instead
+            results = [e] * len(requests)
+        for (conn, _, _), result in zip(requests, results):
+            try:
+                _send(conn, result)
+            except OSError:
+                pass  # Worker went away
+
+
+class RemoteModel:
+    """
+    Client for one model of the server, called like the model itself. Every thread gets its own connection.
+    """
+
+    def __init__(self, socket_path: str, name: str):
+        self.socket_path = socket_path
+        self.name = name
+        self._local = threading.local()
+
+    def _socket(self) -> socket.socket:
+        if not hasattr(self._local, "sock"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return self._local.sock
+
+    def __call__(self, *args):
+        sock = self._socket()
+        _send(sock, (self.name, args))
+        result = _recv(sock)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def __getstate__(self):
+        return {"socket_path": self.socket_path, "name": self.name}
+
+    def __setstate__(self, state):
+        self.__init__(state["socket_path"], state["name"])
+
+
+class RemoteActor:
+    """
+    Stands in for an InferenceBatcher in multi_worker.BatchedRolloutWorker, the forward pass of the current actor
+    happens in the server (batched with every other worker of the host) instead of the worker.
+
+    Every request carries the version the worker tags its rollouts with, the server runs that version or refuses.
+    """
+
+    def __init__(self, socket_path: str):
+        self.remote = RemoteModel(socket_path, "actor")
+        self.policy = None
+
+    def set_policy(self, policy):
+        self.policy = policy  # Only for shape and deterministic, the server runs the version of each request
+
+    def __call__(self, obs, version=None) -> Categorical:
+        version = int(version) if version is not None else None  # None before the worker pulled one
+        return Categorical(logits=self.remote(torch.as_tensor(obs, dtype=torch.float32), version))
+
+
+@contextmanager
+def _intercept_jit_load(replacement):
+    # The pretrained agents torch.jit.load their model in __init__, they get replacement(args, kwargs, load) instead.
+    # Swaps a global, agents must be built one at a time (see pretrained.lazy_agent)
+    load = torch.jit.load
+    torch.jit.load = lambda *args, **kwargs: replacement(args, kwargs, load)
+    try:
+        yield
+    finally:
+        torch.jit.load = load
+
+
+def remote_loading(socket_path: str, name: str):
+    """
+    Context for building a pretrained agent whose model lives in the server, without loading it in this process.
+    """
+    return _intercept_jit_load(lambda args, kwargs, load: RemoteModel(socket_path, name))
+
+
+def load_pretrained_model(agent_class, **kwargs):
+    """
+    :return: the TorchScript model a pretrained agent loads.
+    """
+    loaded = []
+
+    def keep(args, kwargs, load):
+        loaded.append(load(*args, **kwargs))
+        return loaded[-1]
+
+    with _intercept_jit_load(keep):
+        agent_class(**kwargs)
+    return loaded[0]
+
+
+class LatestActor:
+    """
+    The learner's latest actor and the keep_versions - 1 versions before it, so workers that haven't pulled the new
+    version yet are still answered by the one they tag their rollouts with. A new version is loaded the first time
+    a worker asks for it (rocket-learn counts the latest versions down from -1, only equality is meaningful).
+    """
+
+    def __init__(self, redis, keep_versions=4):
+        self.redis = redis
+        self.keep_versions = keep_versions
+        self.actors = OrderedDict()  # version -> actor, oldest first
+
+    def __call__(self, obs, version=None):
+        if not self.actors or (version is not None and version not in self.actors):
+            self._load()
+        if version is None:
+            version = next(reversed(self.actors))
+        if version not in self.actors:
+            raise KeyError(f"Actor version {version} is not one of the {len(self.actors)} the server has "
+                           f"({', '.join(map(str, self.actors))})")
+        return self.actors[version].get_action_distribution(obs).logits
+
+    def _load(self):
+        from rocket_learn.rollout_generator.redis_rollout_generator import MODEL_LATEST, VERSION_LATEST
+        if self.actors and int(self.redis.get(VERSION_LATEST)) in self.actors:
+            return  # A worker still on a version we dropped, no need to download the model
+        # One transaction, the learner publishes the model and bumps the version together
+        pipe = self.redis.pipeline()
+        pipe.get(VERSION_LATEST)
+        pipe.get(MODEL_LATEST)
+        version, model = pipe.execute()
+        version = int(version)
+        if version not in self.actors:
+            # A copy, the WeightReceiver writes the next versions into the same two actors
+            self.actors[version] = copy.deepcopy(cloudpickle.loads(model))
+            while len(self.actors) > self.keep_versions:
+                self.actors.popitem(last=False)
+
+
+def main():
+    from redis import Redis
+    from rocket_learn.agent.pretrained_agents.necto.necto_v1 import NectoV1
+    from rocket_learn.agent.pretrained_agents.nexto.nexto import Nexto
+    from weights import WeightReceiver, set_receiver
+
+    parser = argparse.ArgumentParser(description="Serve the pretrained opponents and the latest actor on this host")
+    parser.add_argument("socket_path")
+    parser.add_argument("ip", help="learner ip, for the latest actor")
+    parser.add_argument("password")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="torch threads")
+    parser.add_argument("--batch_timeout", type=float, default=2, help="milliseconds to wait for more requests")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    redis = Redis(host=args.ip, password=args.password)
+    set_receiver(WeightReceiver(redis))
+    models = {
+        "necto": load_pretrained_model(NectoV1, model_string="necto-model-30Y.pt", n_players=2),
+        "nexto": load_pretrained_model(Nexto, model_string="nexto-model.pt", n_players=2),
+        "actor": LatestActor(redis),
+    }
+    torch.set_num_threads(args.threads)  # The agents set it to 1 when they load
+    InferenceServer(args.socket_path, models, batch_timeout=args.batch_timeout / 1000).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
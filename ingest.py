@@ -0,0 +1,204 @@
+"""
+Rollout ingestion that keeps running while PPO optimises.
+
+A pool of threads pulls and decodes rollouts (rocket-learn's generate_rollouts, which also keeps track of versions,
+ratings and rebuilds rewards/observations when the workers didn't send them) and copies every experience buffer into
+an ExperienceRing, a preallocated set of fixed size slots in shared memory. PPO reads the buffers straight out of
+the slots. Slots are handed back once the iteration that read them is over, see ExperienceRing.release.
+
+Rollouts collected while PPO optimises were generated by the version before the one PPO will train next, so they
+are one version older than they would have been. Anything read more than max_lag iterations after it was ingested
+is dropped as stale.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from rocket_learn.experience_buffer import ExperienceBuffer
+
+
+class ExperienceRing:
+    """
+    n_slots slots of slot_steps steps each. A buffer longer than a slot spans several, joined (copied) when read.
+    Every slot and queue lives in shared memory, so the ring can be filled by other processes as well.
+
+    :param slot_steps: ideally the longest episode, so every buffer is read without a copy.
+    """
+
+    def __init__(self, n_slots, slot_steps, obs_shape, action_shape, action_dtype=np.int64, max_lag=1, ctx=None):
+        ctx = ctx if ctx is not None else multiprocessing.get_context()
+        self.n_slots = n_slots
+        self.slot_steps = slot_steps
+        self.max_lag = max_lag
+        self._layout = [
+            ("observations", tuple(obs_shape), np.dtype(np.float32).str),
+            ("actions", tuple(action_shape), np.dtype(action_dtype).str),
+            ("rewards", (), np.dtype(np.float32).str),
+            ("dones", (), np.dtype(np.bool_).str),
+            ("log_probs", (), np.dtype(np.float32).str),
+            ("lengths", None, np.dtype(np.int32).str),  # Per slot
+            ("iterations", None, np.dtype(np.int64).str),
+            ("ingested_at", None, np.dtype(np.float64).str),
+        ]
+        self._shm = SharedMemory(create=True, size=self._size())
+        self._owner = True
+        self._free = ctx.Queue()
+        self._ready = ctx.Queue()
+        self._iteration = ctx.Value("q", 0)
+        self._ingested_steps = ctx.Value("q", 0)
+        self._consumed_steps = ctx.Value("q", 0)
+        self._stale_drops = ctx.Value("q", 0)
+        self._attach()
+        for slot in range(n_slots):
+            self._free.put(slot)
+
+    def _size(self):
+        size = 0
+        for _, shape, dtype in self._layout:
+            rows = self.n_slots if shape is None else self.n_slots * self.slot_steps
+            size += -(-rows * int(np.prod(shape or (), dtype=np.int64)) * np.dtype(dtype).itemsize // 64) * 64
+        return size
+
+    def _attach(self):
+        self.columns = {}
+        offset = 0
+        for name, shape, dtype in self._layout:
+            full_shape = (self.n_slots,) if shape is None else (self.n_slots, self.slot_steps) + shape
+            array = np.ndarray(full_shape, dtype=dtype, buffer=self._shm.buf, offset=offset)
+            self.columns[name] = array
+            offset += -(-array.nbytes // 64) * 64
+        self._held = []
+        self._ages = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["columns"], state["_held"], state["_ages"]
+        state["_shm"] = self._shm.name
+        state["_owner"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = SharedMemory(name=self._shm)
+        self._attach()
+
+    def put(self, buffer):
+        """
+        Copies an experience buffer into free slots, waiting for slots to be released if there are none.
+        """
+        length = len(buffer.rewards)
+        if length == 0:
+            return
+        n = -(-length // self.slot_steps)
+        slots = tuple(self._free.get() for _ in range(n))
+        for i, slot in enumerate(slots):
+            start = i * self.slot_steps
+            end = min(start + self.slot_steps, length)
+            for name in ("observations", "actions", "rewards", "dones", "log_probs"):
+                self.columns[name][slot, :end - start] = getattr(buffer, name)[start:end]
+            self.columns["lengths"][slot] = end - start
+            self.columns["iterations"][slot] = self._iteration.value
+            self.columns["ingested_at"][slot] = time.time()
+        with self._ingested_steps.get_lock():
+            self._ingested_steps.value += length
+        self._ready.put(slots)  # All of the slots of a buffer at once, so several writers don't interleave
+
+    def get(self, timeout=None):
+        """
+        :return: the next experience buffer, None if it was stale. Raises queue.Empty after timeout seconds.
+        """
+        slots = self._ready.get(timeout=timeout)
+        if self.columns["iterations"][slots[0]] < self._iteration.value - self.max_lag:
+            with self._stale_drops.get_lock():
+                self._stale_drops.value += 1
+            self._release(slots)
+            return None
+
+        self._ages.append(time.time() - self.columns["ingested_at"][slots[0]])
+        lengths = [self.columns["lengths"][slot] for slot in slots]
+        # Views while there are slots to spare, past half the ring they're copied so the writers can't run out
+        copy = len(slots) > 1 or len(self._held) >= self.n_slots // 2
+        buffer = ExperienceBuffer()
+        for name in ("observations", "actions", "rewards", "dones", "log_probs"):
+            parts = [self.columns[name][slot, :length] for slot, length in zip(slots, lengths)]
+            setattr(buffer, name, np.concatenate(parts) if copy else parts[0])
+        if copy:
+            self._release(slots)
+        else:
+            self._held.extend(slots)
+        with self._consumed_steps.get_lock():
+            self._consumed_steps.value += sum(lengths)
+        return buffer
+
+    def release(self):
+        """
+        Hands the slots of every buffer read so far back to the writers and starts a new iteration, call it once
+        the buffers aren't used anymore.
+        """
+        self._release(self._held)
+        self._held = []
+        with self._iteration.get_lock():
+            self._iteration.value += 1
+
+    def _release(self, slots):
+        for slot in slots:
+            self._free.put(slot)
+
+    def get_stats(self) -> dict:
+        return {
+            "ingest/ingested_steps": self._ingested_steps.value,
+            "ingest/consumed_steps": self._consumed_steps.value,
+            "ingest/stale_drops": self._stale_drops.value,
+            "ingest/ready_buffers": self._ready.qsize(),
+        }
+
+    def pop_age_stats(self) -> dict:
+        """
+        How long the buffers read since the last call waited in the ring.
+        """
+        ages, self._ages = self._ages, []
+        if not ages:
+            return {}
+        return {"ingest/rollout_age_mean_seconds": float(np.mean(ages)),
+                "ingest/rollout_age_max_seconds": float(np.max(ages))}
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class RolloutIngestor:
+    """
+    n_threads threads, each running its own source() generator of experience buffers into ring. Iterating it
+    yields the buffers PPO should train on.
+    """
+
+    def __init__(self, source, ring: ExperienceRing, n_threads=4):
+        self.ring = ring
+        self.error = None
+        self.threads = [threading.Thread(target=self._run, args=(source,), name=f"ingest-{i}", daemon=True)
+                        for i in range(n_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self, source):
+        try:
+            for buffer in source():
+                self.ring.put(buffer)
+        except Exception as e:  # Raised again on the training thread
+            self.error = e
+
+    def __iter__(self):
+        while True:
+            try:
+                buffer = self.ring.get(timeout=1)
+            except queue.Empty:
+                if self.error is not None:
+                    raise RuntimeError("Rollout ingestion failed") from self.error
+                continue
+            if buffer is not None:
+                yield buffer
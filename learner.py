@@ -1,62 +1,20 @@
+import argparse
 import os
-import sys
 
 import numpy as np
 import torch.jit
 from redis import Redis
-from rlgym.utils.reward_functions import CombinedReward
-from rlgym.utils.reward_functions.common_rewards import VelocityReward, VelocityPlayerToBallReward, \
-    VelocityBallToGoalReward, EventReward
 
 import wandb
-from actionparser import ImmortalAction
-from agent import get_critic, get_actor
-from obs import ExpandAdvancedObs
-from rewards import JumpTouchReward, WallTouchReward, KickoffReward
+from agent import get_actor_critic, critic_only_parameters
+from checkpoints import CheckpointManager
+from curriculum import CurriculumScheduler
+from env_config import WORKER_COUNTER, FRAME_SKIP, SPLIT, STATE_DIM, obs, rew, act
+from ppo import StreamingPPO, make_optimizer
+from profiler import IterationProfiler
+from rollout_format import install as install_rollout_format
+from rollout_generator import ImmortalRolloutGenerator, LocalRolloutGenerator
 from rocket_learn.agent.actor_critic_agent import ActorCriticAgent
-from rocket_learn.ppo import PPO
-from rocket_learn.rollout_generator.redis_rollout_generator import RedisRolloutGenerator
-
-WORKER_COUNTER = "worker-counter"
-
-
-# ENSURE OBSERVATION, REWARD, AND ACTION CHOICES ARE THE SAME IN THE WORKER
-def obs():
-    return ExpandAdvancedObs()
-
-
-def rew():
-    return CombinedReward.from_zipped(
-        #(VelocityPlayerToBallReward(), 0.004),
-        (VelocityReward(), 0.007),
-        #(VelocityBallToGoalReward(), 0.02),
-        (KickoffReward(), 0.5),
-        (JumpTouchReward(), 4.0),
-        #(WallTouchReward(min_height=250), 2.0),
-        (EventReward(team_goal=1200,
-                     #save=200,
-                     demo=500,
-                     concede=-1200), 0.01),
-    )
-
-
-def act():
-    return ImmortalAction()
-
-
-def get_latest_checkpoint():
-    subdir = 'checkpoint_save_directory'
-
-    all_subdirs = [os.path.join(subdir, d) for d in os.listdir(subdir) if os.path.isdir(os.path.join(subdir, d))]
-    latest_subdir = max(all_subdirs, key=os.path.getmtime)
-    all_subdirs = [os.path.join(latest_subdir, d) for d in os.listdir(latest_subdir) if
-                   os.path.isdir(os.path.join(latest_subdir, d))]
-    latest_subdir = (max(all_subdirs, key=os.path.getmtime))
-    full_dir = os.path.join(latest_subdir, 'checkpoint.pt')
-    print(full_dir)
-
-    return full_dir
-
 
 if __name__ == "__main__":
     """
@@ -66,30 +24,40 @@ if __name__ == "__main__":
     
     """
 
-    frame_skip = 6  # Number of ticks to repeat an action
+    frame_skip = FRAME_SKIP
     half_life_seconds = 15  # Easier to conceptualize, after this many seconds the reward discount is 0.5
     run_name = "Second"
     run_id = "2emtr6mw"
-    #file = None
-    # file = get_latest_checkpoint()
-    file = "checkpoint_save_directory/Immortal_1652412752.390929/Immortal_12200/checkpoint.pt"
 
     fps = 120 / frame_skip
     gamma = np.exp(np.log(0.5) / (fps * half_life_seconds))
 
     # LINK TO THE REDIS SERVER YOU SHOULD HAVE RUNNING (USE THE SAME PASSWORD YOU SET IN THE REDIS
     # CONFIG)
-    _, ip, password, clear = sys.argv
-    clear = clear.lower()
-
-    if clear == 'true':
-        print('clearing DB')
-        clear = True
-    else:
-        print('not clearing DB')
-        clear = False
-    redis = Redis(host=ip, password=password)
-    redis.delete(WORKER_COUNTER)  # Reset to 0
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ip", nargs="?")
+    parser.add_argument("password", nargs="?")
+    parser.add_argument("clear", nargs="?", default="false")
+    # SINGLE MACHINE TRAINING WITHOUT REDIS: STARTS THIS MANY WORKER PROCESSES (AND GAMES) ON THIS MACHINE
+    parser.add_argument("--local", type=int, default=0)
+    # CONTINUE FROM THE LATEST CHECKPOINT OF THIS RUN, OR FROM A GIVEN FILE (E.G. AN OLD checkpoint.pt)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--checkpoint", default=None)
+    args = parser.parse_args()
+    if not args.local and args.password is None:
+        parser.error("the redis ip and password are required without --local")
+    ip, password, clear = args.ip, args.password, args.clear.lower()
+
+    redis = None
+    if not args.local:
+        if clear == 'true':
+            print('clearing DB')
+            clear = True
+        else:
+            print('not clearing DB')
+            clear = False
+        redis = Redis(host=ip, password=password)
+        redis.delete(WORKER_COUNTER)  # Reset to 0
 
     config = dict(
         seed=125,
@@ -99,9 +67,28 @@ if __name__ == "__main__":
         n_steps=2_000_000,
         batch_size=300_000,
         minibatch_size=150_000,
+        # SAMPLES PER FORWARD/BACKWARD, GRADIENTS ARE ACCUMULATED OVER THE MINIBATCH. BOUNDS THE LEARNER'S MEMORY
+        micro_batch_size=16_384,
+        autocast=None,  # "bfloat16" OR "float16" FOR MIXED PRECISION FORWARD PASSES
+        fused_adam=True,
+        # ONE TRUNK FOR THE ACTOR AND CRITIC, HALVES THE UPDATE COST. CHECKPOINTS ONLY LOAD INTO THE SAME ARCHITECTURE
+        shared_trunk=False,
+        # TORCH PROFILER TRACE OF THIS MANY ITERATIONS, WRITTEN TO profiler_traces/
+        profile_trace_iterations=0,
         epochs=32,
         gamma=gamma,
-        iterations_per_save=5
+        iterations_per_save=5,
+        # CHECKPOINTS KEPT: THE LAST checkpoints_keep_last AND EVERY checkpoints_keep_every ITERATIONS
+        checkpoints_keep_last=5,
+        checkpoints_keep_every=1000,
+        # replay, random, kickoff, hoops, walls, goalie. PUBLISHED TO THE WORKERS, NO RESTART NEEDED
+        setter_weights=[0.70, 0.01, 0.15, 0.05, 0.05, 0.04],
+        adaptive_curriculum=False,
+        weights_dtype="float32",  # RAW ACTOR BROADCAST TO THE WORKERS, float16 HALVES IT, None SENDS PICKLES
+        # ROLLOUTS DECODED BY THIS MANY THREADS WHILE PPO OPTIMISES, 0 DECODES THEM ON THE TRAINING THREAD.
+        # THE RING TAKES ingest_slots * 600 STEPS * ~450 BYTES OF SHARED MEMORY (/dev/shm)
+        ingest_threads=4,
+        ingest_slots=4096,
     )
 
     # ROCKET-LEARN USES WANDB WHICH REQUIRES A LOGIN TO USE. YOU CAN SET AN ENVIRONMENTAL VARIABLE
@@ -111,38 +98,67 @@ if __name__ == "__main__":
                         settings=wandb.Settings(_disable_stats=True))
     torch.manual_seed(logger.config.seed)
 
-    # THE ROLLOUT GENERATOR CAPTURES INCOMING DATA THROUGH REDIS AND PASSES IT TO THE LEARNER.
-    # -save_every SPECIFIES HOW OFTEN OLD VERSIONS ARE SAVED TO REDIS. THESE ARE USED FOR TRUESKILL
-    # COMPARISON AND TRAINING AGAINST PREVIOUS VERSIONS
-    rollout_gen = RedisRolloutGenerator(redis, obs, rew, act,
-                                        logger=logger,
-                                        save_every=logger.config.iterations_per_save*3,
-                                        max_age=1,
-                                        #min_sigma=2,
-                                        clear=clear)
+    # SEE env_config FOR THE NETWORK INPUT AND OUTPUT SIZES
+    split = SPLIT
+    state_dim = STATE_DIM
 
-    # ROCKET-LEARN EXPECTS A SET OF DISTRIBUTIONS FOR EACH ACTION FROM THE NETWORK, NOT
-    # THE ACTIONS THEMSELVES. SEE network_setup.readme.txt FOR MORE INFORMATION
-    split = (126,)
+    actor, critic = get_actor_critic(split, state_dim, shared_trunk=logger.config.shared_trunk)
 
-    # TOTAL SIZE OF THE INPUT DATA
-    state_dim = 107
-
-    critic = get_critic(state_dim)
-
-    actor = get_actor(split, state_dim)
-
-    optim = torch.optim.Adam([
+    # WITH A SHARED TRUNK THE TRUNK LEARNS AT THE ACTOR'S RATE
+    optim = make_optimizer([
         {"params": actor.parameters(), "lr": logger.config.actor_lr},
-        {"params": critic.parameters(), "lr": logger.config.critic_lr}
-    ])
+        {"params": critic_only_parameters(actor, critic), "lr": logger.config.critic_lr}
+    ], fused=logger.config.fused_adam)
 
     # PPO REQUIRES AN ACTOR/CRITIC AGENT
     agent = ActorCriticAgent(actor=actor, critic=critic, optimizer=optim)
 
-    alg = PPO(
+    if args.local:
+        # THE WORKER PROCESSES WRITE THEIR ROLLOUTS INTO SHARED MEMORY AND READ THE LATEST ACTOR FROM SHARED MEMORY.
+        # SELF-PLAY OF THE LATEST VERSION ONLY, NO PAST VERSIONS, PRETRAINED OPPONENTS OR TRUESKILL
+        rollout_gen = LocalRolloutGenerator(actor, args.local,
+                                            logger=logger,
+                                            curriculum_weights=logger.config.setter_weights,
+                                            adaptive_curriculum=logger.config.adaptive_curriculum,
+                                            ingest_slots=logger.config.ingest_slots)
+    else:
+        # THE ROLLOUT GENERATOR CAPTURES INCOMING DATA THROUGH REDIS AND PASSES IT TO THE LEARNER.
+        # -save_every SPECIFIES HOW OFTEN OLD VERSIONS ARE SAVED TO REDIS. THESE ARE USED FOR TRUESKILL
+        # COMPARISON AND TRAINING AGAINST PREVIOUS VERSIONS
+        curriculum = CurriculumScheduler(redis, logger.config.setter_weights,
+                                         adaptive=logger.config.adaptive_curriculum)
+
+        # DECODES THE COLUMNAR ROLLOUTS OF WORKERS STARTED WITH --rollout_codec, OTHERS ARE READ AS BEFORE
+        install_rollout_format()
+
+        rollout_gen = ImmortalRolloutGenerator(redis, obs, rew, act,
+                                               logger=logger,
+                                               curriculum=curriculum,
+                                               weights_dtype=logger.config.weights_dtype,
+                                               ingest_threads=logger.config.ingest_threads,
+                                               ingest_slots=logger.config.ingest_slots,
+                                               save_every=logger.config.iterations_per_save*3,
+                                               max_age=1,
+                                               #min_sigma=2,
+                                               clear=clear)
+
+    # PHASE TIMINGS, INGEST RATES, QUEUE DEPTH AND MEMORY LOGGED EVERY ITERATION
+    profiler = IterationProfiler(redis, rollout_gen.ring, rollout_gen.stale_rollouts,
+                                 trace_iterations=logger.config.profile_trace_iterations)
+    rollout_gen.profiler = profiler
+
+    # WRITTEN IN THE BACKGROUND TO checkpoint_save_directory/<run_name>, INDEXED BY ITS manifest.json
+    checkpoints = CheckpointManager(os.path.join("checkpoint_save_directory", run_name),
+                                    keep_last=logger.config.checkpoints_keep_last,
+                                    keep_every=logger.config.checkpoints_keep_every)
+
+    alg = StreamingPPO(
         rollout_gen,
         agent,
+        micro_batch_size=logger.config.micro_batch_size,
+        autocast=logger.config.autocast,
+        profiler=profiler,
+        checkpoints=checkpoints,
         ent_coef=logger.config.ent_coef,
         n_steps=logger.config.n_steps,
         batch_size=logger.config.batch_size,
@@ -154,13 +170,17 @@ if __name__ == "__main__":
     )
 
     # BEGIN TRAINING. IT WILL CONTINUE UNTIL MANUALLY STOPPED
-    # -iterations_per_save SPECIFIES HOW OFTEN CHECKPOINTS ARE SAVED
-    # -save_dir SPECIFIES WHERE
+    # -iterations_per_save SPECIFIES HOW OFTEN CHECKPOINTS ARE SAVED, BY THE CHECKPOINT MANAGER (NO save_dir)
 
+    file = args.checkpoint
+    if args.resume and file is None:
+        file = checkpoints.latest()
+        if file is None:
+            print("no checkpoint to resume from, starting fresh")
     if file:
         print(f'loading from {file}')
         alg.load(file, continue_iterations=True)
         alg.agent.optimizer.param_groups[0]["lr"] = logger.config.actor_lr
         alg.agent.optimizer.param_groups[1]["lr"] = logger.config.critic_lr
 
-    alg.run(iterations_per_save=logger.config.iterations_per_save, save_dir="checkpoint_save_directory")
+    alg.run(iterations_per_save=logger.config.iterations_per_save)
@@ -0,0 +1,79 @@
+"""
+Worker processes started by the learner for single host training, no Redis involved. See
+rollout_generator.LocalRolloutGenerator.
+
+Every process plays self-play episodes of the current actor in its own game, with the match of env_config. The
+actor comes from the learner's SharedActor (checked between episodes) and the curriculum weights from a
+SharedCurriculumSource. Every player's trajectory is written straight into the learner's ExperienceRing, and the
+telemetry goes through a queue.
+"""
+import os
+
+import numpy as np
+import torch
+from rocket_learn.experience_buffer import ExperienceBuffer
+
+import env_config
+from agent import get_actor
+from telemetry import QueueTelemetrySink, set_sink
+
+
+def run_episode(env, actor):
+    """
+    One episode of an rlgym Gym with actor playing every car, one forward pass for all of them per step.
+
+    :return: an ExperienceBuffer per player.
+    """
+    observations, actions, rewards, log_probs = [], [], [], []
+    obs = env.reset()
+    done = False
+    while not done:
+        obs = np.concatenate(obs).astype(np.float32)  # (n_players, obs_size)
+        with torch.no_grad():
+            dist = actor.get_action_distribution(obs)
+            action = dist.sample()
+            log_prob = dist.log_prob(action).sum(-1)
+        action = action.numpy()
+        next_obs, reward, done, _ = env.step(action)
+        observations.append(obs)
+        actions.append(action)
+        rewards.append(reward)
+        log_probs.append(log_prob.numpy())
+        obs = next_obs
+
+    # (steps, n_players, ...) to one buffer per player
+    observations, actions = np.stack(observations), np.stack(actions)
+    rewards, log_probs = np.array(rewards, dtype=np.float32), np.stack(log_probs)
+    dones = np.zeros(len(rewards), dtype=bool)
+    dones[-1] = True
+    buffers = []
+    for player in range(observations.shape[1]):
+        buffer = ExperienceBuffer()
+        buffer.observations = observations[:, player]
+        buffer.actions = actions[:, player]
+        buffer.rewards = rewards[:, player]
+        buffer.dones = dones
+        buffer.log_probs = log_probs[:, player]
+        buffers.append(buffer)
+    return buffers
+
+
+def run_worker(index, shared_actor, ring, curriculum_source, telemetry_queue, stop, game_speed=100):
+    """
+    Target of the worker processes, plays until stop is set.
+    """
+    from rlgym.gym import Gym  # Windows only, keeps the learner importable elsewhere
+
+    torch.set_num_threads(1)
+    set_sink(QueueTelemetrySink(telemetry_queue))  # Flushed by the reward function between episodes
+    env = Gym(env_config.match(game_speed=game_speed, curriculum_source=curriculum_source),
+              pipe_id=os.getpid() * 100 + index, use_injector=True)
+    actor = get_actor(env_config.SPLIT, env_config.STATE_DIM)
+    version = 0
+    try:
+        while not stop.is_set():
+            version = shared_actor.load(actor, version)
+            for buffer in run_episode(env, actor):
+                ring.put(buffer)
+    finally:
+        env.close()
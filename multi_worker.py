@@ -0,0 +1,230 @@
+"""
+Several matches in one worker process, sharing one batched forward pass of the current actor.
+
+Every match runs a regular RedisRolloutWorker in its own thread, the threads spend most of their time waiting on
+the game so the GIL isn't a problem. Their current_agent is a proxy that queues observations in a shared
+InferenceBatcher, which runs the actor once for all of the matches that asked within batch_timeout.
+"""
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+from torch.distributions import Categorical
+
+import rocket_learn.rollout_generator.redis_rollout_generator as redis_rollout_generator
+from rocket_learn.agent.discrete_policy import DiscretePolicy
+from rocket_learn.rollout_generator.redis_rollout_generator import RedisRolloutWorker, MODEL_LATEST, VERSION_LATEST
+
+
+class _Request:
+    __slots__ = ("obs", "result")
+
+    def __init__(self, obs):
+        self.obs = obs
+        self.result = None
+
+
+class InferenceBatcher:
+    """
+    Collects get_action_distribution calls from several threads. The call that completes a batch of max_batch
+    requests, or whose batch_timeout (in seconds) runs out first, runs the actor for everything queued. An exception
+    of the actor is raised in every call of the batch.
+    """
+
+    def __init__(self, policy: DiscretePolicy, max_batch: int, batch_timeout=0.005):
+        self.policy = policy
+        self.max_batch = max_batch
+        self.batch_timeout = batch_timeout
+        self._pending = []
+        self._cond = threading.Condition()
+
+        self.batches = 0
+        self.requests = 0
+
+    def set_policy(self, policy: DiscretePolicy):
+        with self._cond:
+            self.policy = policy
+
+    def leave(self):
+        """
+        Called when one of the max_batch callers stops, so the others don't wait for it every step.
+        """
+        with self._cond:
+            self.max_batch = max(self.max_batch - 1, 1)
+            self._cond.notify_all()
+
+    def __call__(self, obs, version=None) -> Categorical:
+        # Every request runs the policy of the last set_policy, version is for batchers running it elsewhere
+        request = _Request(obs)
+        with self._cond:
+            self._pending.append(request)
+            deadline = time.monotonic() + self.batch_timeout
+            while request.result is None:
+                remaining = deadline - time.monotonic()
+                if len(self._pending) >= self.max_batch or remaining <= 0:
+                    self._run()
+                    break
+                self._cond.wait(remaining)
+        if isinstance(request.result, Exception):
+            raise request.result
+        return request.result
+
+    def _run(self):
+        # Called with the lock held
+        pending, self._pending = self._pending, []
+        sizes = [len(r.obs) for r in pending]
+        try:
+            obs = np.concatenate([np.asarray(r.obs, dtype=np.float32) for r in pending])
+            with torch.no_grad():
+                logits = self.policy.get_action_distribution(obs).logits
+        except Exception as e:  # Raised by every request of the batch
+            for request in pending:
+                request.result = e
+            self._cond.notify_all()
+            return
+        start = 0
+        for request, size in zip(pending, sizes):
+            request.result = Categorical(logits=logits[start:start + size])
+            start += size
+        self.batches += 1
+        self.requests += len(pending)
+        self._cond.notify_all()
+
+
+class BatchedPolicy(DiscretePolicy):
+    """
+    Stands in for the current actor in a worker, everything but the forward pass is the regular DiscretePolicy.
+    """
+
+    def __init__(self, batcher: InferenceBatcher):
+        super().__init__(None, batcher.policy.shape, batcher.policy.deterministic)
+        self.batcher = batcher
+        self.version = None  # Of the worker, which tags its rollouts with it
+
+    def get_action_distribution(self, obs):
+        return self.batcher(obs, self.version)
+
+
+class _VersionedRedis:
+    """
+    A worker's Redis client that reads MODEL_LATEST in one transaction with VERSION_LATEST, keeping the version of
+    the last model it read as model_version.
+    """
+
+    def __init__(self, redis):
+        self._redis = redis
+        self.model_version = None
+
+    def get(self, name):
+        if name != MODEL_LATEST:
+            return self._redis.get(name)
+        pipe = self._redis.pipeline()
+        pipe.get(VERSION_LATEST)
+        pipe.get(MODEL_LATEST)
+        version, model = pipe.execute()
+        self.model_version = int(version) if version is not None else None
+        return model
+
+    def __getattr__(self, name):
+        return getattr(self._redis, name)
+
+
+class BatchedRolloutWorker(RedisRolloutWorker):
+    """
+    RedisRolloutWorker whose current_agent goes through a shared InferenceBatcher, new versions pulled by any of
+    the workers replace the batched actor for all of them.
+    """
+
+    def __init__(self, redis, *args, batcher: InferenceBatcher, **kwargs):
+        self._batcher = batcher
+        self._proxy = None
+        self._versioned_redis = _VersionedRedis(redis)
+        super().__init__(self._versioned_redis, *args, **kwargs)
+
+    @property
+    def current_agent(self):
+        return self._proxy
+
+    @current_agent.setter
+    def current_agent(self, agent):
+        self._batcher.set_policy(agent)
+        if self._proxy is None:
+            self._proxy = BatchedPolicy(self._batcher)
+        self._proxy.deterministic = agent.deterministic
+        # Sent with every request, a batcher in another process runs the version of the model just pulled
+        self._proxy.version = self._versioned_redis.model_version
+        if self._proxy.version is None:
+            raise RuntimeError("The latest model was set without reading its version from MODEL_LATEST")
+
+
+@contextmanager
+def _pipe_id(pipe_id: int):
+    # rocket-learn names the plugin pipe after os.getpid(), which would be the same for every match of this process
+    gym_class = redis_rollout_generator.Gym
+
+    def make_gym(*args, **kwargs):
+        kwargs["pipe_id"] = pipe_id
+        return gym_class(*args, **kwargs)
+
+    redis_rollout_generator.Gym = make_gym
+    try:
+        yield
+    finally:
+        redis_rollout_generator.Gym = gym_class
+
+
+class MultiMatchWorker:
+    """
+    Runs n_matches BatchedRolloutWorkers, make_match(i) builds the Match of the i-th one and the remaining arguments
+    are passed to every RedisRolloutWorker. batcher replaces the InferenceBatcher, e.g. with an
+    inference_server.RemoteActor.
+    """
+
+    def __init__(self, redis, name, make_match, n_matches, batch_timeout=0.005, batcher=None, **worker_kwargs):
+        # The policy is set by the first worker, with the latest model from redis
+        self.batcher = batcher if batcher is not None else InferenceBatcher(None, n_matches, batch_timeout)
+        self.workers = []
+        for i in range(n_matches):
+            with _pipe_id(os.getpid() * 100 + i):
+                self.workers.append(BatchedRolloutWorker(redis, f"{name}-{i}", make_match(i),
+                                                         batcher=self.batcher, **worker_kwargs))
+
+    def run(self):
+        """
+        Runs every match until they all return. The first exception of a match stops the others (their games are
+        closed) and is raised here.
+        """
+        results = queue.Queue()
+
+        def run_match(worker):
+            try:
+                worker.run()
+                results.put(None)
+            except BaseException as e:
+                results.put(e)
+            finally:
+                if isinstance(self.batcher, InferenceBatcher):
+                    self.batcher.leave()
+
+        threads = [threading.Thread(target=run_match, args=(w,), name=f"match-{i}", daemon=True)
+                   for i, w in enumerate(self.workers)]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            error = results.get()
+            if error is not None:
+                self.close()
+                raise error
+
+    def close(self):
+        for worker in self.workers:
+            env = getattr(worker, "env", None)
+            if env is not None:
+                try:
+                    env.close()
+                except Exception:
+                    pass  # Already gone, or in the middle of the step of a match thread
@@ -1,12 +1,117 @@
+from functools import lru_cache
 from typing import Any
 
 import numpy
+from rlgym.utils import common_values
 from rlgym.utils.gamestates import PlayerData, GameState
 from rlgym.utils.obs_builders.advanced_obs import AdvancedObs
 
+from state_arrays import state_arrays
+
 
 # ROCKET-LEARN ALWAYS EXPECTS A BATCH DIMENSION IN THE BUILT OBSERVATION
 class ExpandAdvancedObs(AdvancedObs):
     def build_obs(self, player: PlayerData, state: GameState, previous_action: numpy.ndarray) -> Any:
         obs = super(ExpandAdvancedObs, self).build_obs(player, state, previous_action)
-        return numpy.expand_dims(obs, 0)
\ No newline at end of file
+        return numpy.expand_dims(obs, 0)
+
+
+@lru_cache(maxsize=16)
+def _others_order(teams: tuple) -> numpy.ndarray:
+    # Same order AdvancedObs appends the other cars in: allies first, then enemies, by position in state.players
+    n = len(teams)
+    order = []
+    for i in range(n):
+        allies = [j for j in range(n) if j != i and teams[j] == teams[i]]
+        enemies = [j for j in range(n) if teams[j] != teams[i]]
+        order.append(allies + enemies)
+    return numpy.array(order, dtype=int).reshape(n, n - 1)
+
+
+class BatchedAdvancedObs(AdvancedObs):
+    """
+    Same features as ExpandAdvancedObs, but the observations of every player are built together the first time a
+    state is seen, into one (n_players, obs_size) float32 buffer. build_obs then hands out (1, obs_size) row views.
+
+    The buffer is allocated once per step since rocket-learn keeps references to the observations for the whole
+    episode, set reuse_buffer if the caller copies them out before the next step.
+    """
+    BALL_SIZE = 9
+    ACTION_SIZE = 8
+    PADS_SIZE = 34
+    CAR_SIZE = 25
+    OTHER_SIZE = CAR_SIZE + 6
+    _BALL_SCALE = 1 / numpy.repeat([AdvancedObs.POS_STD, AdvancedObs.POS_STD, AdvancedObs.ANG_STD], 3)
+    _CAR_SCALE = 1 / numpy.repeat([AdvancedObs.POS_STD, AdvancedObs.POS_STD, AdvancedObs.POS_STD, 1, 1,
+                                   AdvancedObs.POS_STD, AdvancedObs.ANG_STD, 1], [3, 3, 3, 3, 3, 3, 3, 4])
+    _POS_VEL = [6, 7, 8, 15, 16, 17]  # Scaled position and linear velocity within a car's features
+
+    def __init__(self, reuse_buffer=False):
+        super().__init__()
+        self.reuse_buffer = reuse_buffer
+        self._state = None
+        self._rows = {}
+        self._buffer = None
+
+    def reset(self, initial_state: GameState):
+        self._state = None
+
+    def build_obs(self, player: PlayerData, state: GameState, previous_action: numpy.ndarray) -> Any:
+        if state is not self._state:
+            self._build_all(state)
+            self._state = state
+        row = self._rows[player.car_id]
+        obs = self._buffer[row:row + 1]
+        obs[0, self.BALL_SIZE:self.BALL_SIZE + self.ACTION_SIZE] = previous_action
+        return obs
+
+    def _build_all(self, state: GameState):
+        players = state.players
+        n = len(players)
+        size = self.BALL_SIZE + self.ACTION_SIZE + self.PADS_SIZE + self.CAR_SIZE + self.OTHER_SIZE * (n - 1)
+        if self.reuse_buffer and self._buffer is not None and self._buffer.shape == (n, size):
+            buffer = self._buffer
+        else:
+            buffer = numpy.empty((n, size), dtype=numpy.float32)
+
+        # Index 0 is the blue perspective and 1 the orange (inverted) one
+        arrays = state_arrays(state)
+        physics = arrays.cars[..., [0, 1, 2, 7, 8, 9, 10, 11, 12]]
+        rotation = arrays.rotation[..., [0, 2]].swapaxes(-1, -2).reshape(2, n, 6)  # Forward and up
+        info = arrays.info[:, [9, 6, 8, 5]]  # Boost, on ground, has flip, demoed
+        teams = tuple(arrays.team_num.tolist())
+        perspective = numpy.array([t == common_values.ORANGE_TEAM for t in teams], dtype=int)
+        ball = arrays.ball.reshape(2, 1, 9)
+
+        # Unscaled _add_player_to_obs for every car from both perspectives
+        car_obs = numpy.concatenate([
+            ball[..., :6] - physics[..., :6],
+            physics[..., :3],
+            rotation,
+            physics[..., 3:],
+            numpy.broadcast_to(info, (2, n, 4)),
+        ], axis=-1)
+        car_obs *= self._CAR_SCALE
+
+        own = numpy.arange(n)
+        viewer = perspective[:, None]
+        order = _others_order(teams)
+        others = car_obs[viewer, order]
+        me = car_obs[perspective, own]
+
+        c = 0
+        buffer[:, c:c + self.BALL_SIZE] = (ball[:, 0] * self._BALL_SCALE)[perspective]
+        c += self.BALL_SIZE
+        buffer[:, c:c + self.ACTION_SIZE] = 0  # Filled in per player by build_obs
+        c += self.ACTION_SIZE
+        buffer[:, c:c + self.PADS_SIZE] = arrays.boost_pads[perspective]
+        c += self.PADS_SIZE
+        buffer[:, c:c + self.CAR_SIZE] = me
+        c += self.CAR_SIZE
+        buffer[:, c:] = numpy.concatenate([
+            others,
+            others[..., self._POS_VEL] - me[:, None, self._POS_VEL],
+        ], axis=-1).reshape(n, -1)
+
+        self._buffer = buffer
+        self._rows = {car_id: i for i, car_id in enumerate(arrays.car_ids)}
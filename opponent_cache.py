@@ -0,0 +1,234 @@
+"""
+Cache for the past versions of the actor that workers play against.
+
+Models are kept unpickled in memory up to max_bytes (by the size of their pickle, least recently used first out),
+optionally written to cache_dir so a restarted worker doesn't download them again, and the most recent versions
+are prefetched in a background thread so an episode doesn't wait on a multi-megabyte Redis read.
+
+A version is only an index into OPPONENT_MODELS, which starts over when the learner is restarted with clear. The
+learner stores a new OPPONENT_EPOCH token then (see new_epoch), and the cache keeps its files in a directory per
+token and forgets the models in memory when the token changes.
+"""
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+import cloudpickle
+import numpy as np
+
+OPPONENT_MODELS = "opponent-models"
+OPPONENT_EPOCH = "opponent-models-epoch"
+
+
+def match_quality(mu, sigma, other_mu, other_sigma, beta=25 / 6):
+    """
+    TrueSkill's 1v1 match quality (draw probability), trueskill.quality_1vs1 with the default environment.
+    """
+    variance = 2 * beta ** 2 + np.square(sigma) + np.square(other_sigma)
+    return np.sqrt(2 * beta ** 2 / variance) * np.exp(-np.square(np.subtract(mu, other_mu)) / (2 * variance))
+
+
+def new_epoch(redis, clear: bool):
+    """
+    Called by the learner on start: a new token if OPPONENT_MODELS was cleared, otherwise only if there is none yet.
+    """
+    redis.set(OPPONENT_EPOCH, uuid.uuid4().hex, nx=not clear)
+
+
+class OpponentCache:
+    def __init__(self, redis, max_bytes=256 * 2 ** 20, cache_dir=None, max_disk_bytes=2 * 2 ** 30):
+        self.redis = redis
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._epoch = None
+        self._models = OrderedDict()  # version -> (model, size), of self._epoch
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._prefetch_thread = None
+        self._stop = threading.Event()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.redis.llen(OPPONENT_MODELS)
+
+    def get(self, version: int):
+        self._sync_epoch()
+        with self._lock:
+            if version in self._models:
+                self._models.move_to_end(version)
+                self.hits += 1
+                return self._models[version][0]
+            self.misses += 1
+        return self._load(version)
+
+    def get_bytes(self, version: int) -> bytes:
+        """
+        The pickled model, from disk if it was cached there and Redis otherwise.
+        """
+        return self._fetch(version)[1]
+
+    def cached_versions(self) -> list:
+        epoch = self._sync_epoch()
+        with self._lock:
+            in_memory = set(self._models)
+        on_disk = set()
+        directory = self._directory(epoch)
+        if directory is not None and os.path.isdir(directory):
+            on_disk = {int(f[:-4]) for f in os.listdir(directory) if f.endswith(".pkl")}
+        return sorted(in_memory | on_disk)
+
+    def prefetch(self, versions):
+        for version in versions:
+            if self._stop.is_set():
+                return
+            with self._lock:
+                if version in self._models:
+                    continue
+            try:
+                self._load(version)
+            except KeyError:
+                pass
+
+    def likely_versions(self, k: int) -> list:
+        """
+        The k versions most likely to be picked as past opponents. Workers sample them by TrueSkill match quality
+        against the latest rating (the last of QUALITIES).
+
+        :return: least likely first.
+        """
+        from rocket_learn.rollout_generator.redis_rollout_generator import QUALITIES, _unserialize
+        ratings = [_unserialize(q) for q in self.redis.lrange(QUALITIES, 0, -1)]
+        if not ratings:
+            return []
+        mu, sigma = np.array([(r.mu, r.sigma) if hasattr(r, "mu") else tuple(r)[:2] for r in ratings], dtype=float).T
+        probs = match_quality(mu[-1], sigma[-1], mu, sigma)
+        return [int(v) for v in np.argsort(probs, kind="stable")[-k:]]
+
+    def start_prefetch(self, k=4, interval=60.):
+        """
+        Keeps the k versions most likely to be played loaded from a daemon thread, checking every interval seconds.
+        """
+
+        def loop():
+            while not self._stop.is_set():
+                self.prefetch(self.likely_versions(k))  # Most likely last, so it's evicted last
+                self._stop.wait(interval)
+
+        self._prefetch_thread = threading.Thread(target=loop, name="opponent-prefetch", daemon=True)
+        self._prefetch_thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _sync_epoch(self):
+        epoch = self.redis.get(OPPONENT_EPOCH)
+        epoch = epoch.decode() if epoch is not None else None
+        with self._lock:
+            if epoch != self._epoch:  # The learner started over, the versions we have are other models
+                self._epoch = epoch
+                self._models.clear()
+                self._bytes = 0
+        return epoch
+
+    def _fetch(self, version: int):
+        """
+        :return: the epoch the model belongs to and its pickle.
+        """
+        epoch = self._sync_epoch()
+        file = self._file(epoch, version)
+        if file is not None:
+            try:
+                with open(file, "rb") as f:
+                    return epoch, f.read()
+            except FileNotFoundError:
+                pass
+        # Both in one transaction, so the model is cached under the epoch it belongs to
+        pipe = self.redis.pipeline()
+        pipe.get(OPPONENT_EPOCH)
+        pipe.lindex(OPPONENT_MODELS, version)
+        epoch, buf = pipe.execute()
+        if buf is None:
+            raise KeyError(f"No opponent model with version {version}")
+        epoch = epoch.decode() if epoch is not None else None
+        file = self._file(epoch, version)
+        if file is not None:
+            self._write(file, buf)
+        return epoch, buf
+
+    def _load(self, version: int):
+        epoch, buf = self._fetch(version)
+        model = cloudpickle.loads(buf)
+        with self._lock:
+            if epoch != self._epoch:  # Changed while loading, don't mix it with the models of the new one
+                return model
+            if version not in self._models:
+                self._models[version] = (model, len(buf))
+                self._bytes += len(buf)
+            # Always keep the model that was just asked for, even when it's bigger than max_bytes on its own
+            while self._bytes > self.max_bytes and len(self._models) > 1:
+                _, (_, size) = self._models.popitem(last=False)
+                self._bytes -= size
+            return self._models[version][0]
+
+    def _directory(self, epoch):
+        # No disk cache without an epoch (learner from before it was stored), a file couldn't be told apart from
+        # the same version of another run
+        if self.cache_dir is None or epoch is None:
+            return None
+        return os.path.join(self.cache_dir, epoch)
+
+    def _file(self, epoch, version: int):
+        directory = self._directory(epoch)
+        return os.path.join(directory, f"{version}.pkl") if directory is not None else None
+
+    def _write(self, file: str, buf: bytes):
+        directory = os.path.dirname(file)
+        tmp_file = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(tmp_file, "wb") as f:
+                f.write(buf)
+            os.replace(tmp_file, file)
+        except FileNotFoundError:  # Removed by a worker of the host that already moved on to a new epoch
+            return
+
+        # Files of other epochs are of no use anymore
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir() and entry.path != directory:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+        # Oldest files out first once over max_disk_bytes, other workers on the host may be pruning as well
+        files = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def install(cache: OpponentCache):
+    """
+    Makes RedisRolloutWorker fetch past versions through the cache, instead of its lru_cache keyed on the client.
+    """
+    import rocket_learn.rollout_generator.redis_rollout_generator as redis_rollout_generator
+    redis_rollout_generator._get_past_model = lambda redis, version: cache.get(version)
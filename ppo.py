@@ -0,0 +1,245 @@
+"""
+PPO update that streams every minibatch through the networks in micro-batches, accumulating the gradients, so the
+activations held at once are bounded by micro_batch_size rather than minibatch_size. The whole batch stays on the
+CPU and only the micro-batch being evaluated is moved to the networks' device.
+
+One optimizer step per minibatch_size samples, batch_size samples per epoch, as configured in the learner. Optionally
+with bfloat16/float16 autocast on the forward passes (float16 on CUDA only, with a gradient scaler) and a fused
+Adam, see make_optimizer.
+"""
+import inspect
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+from torch.distributions import Categorical
+from torch.nn.utils import clip_grad_norm_
+
+from agent import critic_only_parameters
+from rocket_learn.ppo import PPO
+
+AUTOCAST_DTYPES = {None: None, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
+
+def make_optimizer(param_groups, fused=True):
+    """
+    Adam, fused (one kernel for every parameter) where this torch and device support it, multi-tensor otherwise.
+    Prints the implementation that was built, torch<1.12 has neither and falls back to the default Adam.
+    """
+    if fused:
+        supported = inspect.signature(torch.optim.Adam).parameters
+        for variant in ("fused", "foreach"):
+            if variant not in supported:
+                print(f"Adam {variant}=True isn't available in torch {torch.__version__}")
+                continue
+            try:
+                optim = torch.optim.Adam(param_groups, **{variant: True})
+            except RuntimeError as e:  # Not for these parameters, e.g. fused on the CPU
+                print(f"Adam {variant}=True isn't available for these parameters: {e}")
+                continue
+            print(f"Using Adam {variant}=True")
+            return optim
+    print("Using the default Adam")
+    return torch.optim.Adam(param_groups)
+
+
+class StreamingPPO(PPO):
+    """
+    :param micro_batch_size: samples per forward/backward pass, defaults to minibatch_size.
+    :param autocast: None, "bfloat16" or "float16".
+    :param profiler: profiler.IterationProfiler timing the phases of every iteration.
+    :param checkpoints: checkpoints.CheckpointManager writing the checkpoints in the background, every
+     iterations_per_save iterations of run. rocket-learn's synchronous save to save_dir if None.
+    """
+
+    def __init__(self, rollout_generator, agent, micro_batch_size=None, autocast=None, profiler=None,
+                 checkpoints=None, **kwargs):
+        super().__init__(rollout_generator, agent, **kwargs)
+        self.micro_batch_size = micro_batch_size
+        self.profiler = profiler
+        self.checkpoints = checkpoints
+        self.autocast_dtype = AUTOCAST_DTYPES[autocast]
+        # Same defaults as rocket-learn's PPO
+        self._n_epochs = kwargs.get("epochs", 10)
+        self._batch_size = kwargs.get("batch_size", 512)
+        self._minibatch_size = kwargs.get("minibatch_size") or self._batch_size
+        self._gamma = kwargs.get("gamma", 0.99)
+        self._gae_lambda = kwargs.get("gae_lambda", 0.95)
+        self._clip_range = kwargs.get("clip_range", 0.2)
+        self._ent_coef = kwargs.get("ent_coef", 0.01)
+        self._vf_coef = kwargs.get("vf_coef", 1)
+        self._max_grad_norm = kwargs.get("max_grad_norm", 0.5)
+        self._logger = kwargs.get("logger")
+        self.epoch_samples_per_second = []
+        self._iterations_per_save = None
+
+    def _phase(self, name: str):
+        return self.profiler.phase(name) if self.profiler is not None else nullcontext()
+
+    def run(self, iterations_per_save=10, save_dir=None, *args, **kwargs):
+        self._iterations_per_save = iterations_per_save
+        if self.checkpoints is not None:
+            # Saved by calculate instead, rocket-learn would also save <project>_latest every iteration and create an
+            # empty run directory
+            save_dir = None
+        return super().run(iterations_per_save, save_dir, *args, **kwargs)
+
+    def save(self, save_location, current_step, *args, **kwargs):
+        with self._phase("checkpoint"):
+            if self.checkpoints is None:
+                return super().save(save_location, current_step, *args, **kwargs)
+            # Same keys as rocket-learn's checkpoints, so PPO.load reads either
+            self.checkpoints.save(current_step, {
+                "epoch": current_step,
+                "total_steps": self.total_steps,
+                "actor_state_dict": self.agent.actor.state_dict(),
+                "critic_state_dict": self.agent.critic.state_dict(),
+                "optimizer_state_dict": self.agent.optimizer.state_dict(),
+            }, total_steps=self.total_steps)
+
+    def _autocast(self, device: torch.device):
+        if self.autocast_dtype is None:
+            return nullcontext()
+        return torch.autocast(device_type=device.type, dtype=self.autocast_dtype)
+
+    def _evaluate(self, obs, actions, device):
+        """
+        :return: log probs and entropies of actions, and values, all float32.
+        """
+        trunk = getattr(self.agent.critic, "trunk", None)  # agent.SharedCritic runs the trunk once for both
+        with trunk.reuse() if trunk is not None else nullcontext(), self._autocast(device):
+            logits = self.agent.actor.get_action_distribution(obs).logits
+            values = self.agent.critic(obs)
+        dist = Categorical(logits=logits.float())
+        return dist.log_prob(actions).sum(-1), dist.entropy().sum(-1), values.float().squeeze(-1)
+
+    def _predict_values(self, obs: torch.Tensor, device) -> np.ndarray:
+        micro = self.micro_batch_size or self._minibatch_size
+        values = []
+        with torch.no_grad():
+            for start in range(0, len(obs), micro):
+                with self._autocast(device):
+                    values.append(self.agent.critic(obs[start:start + micro].to(device)).float().squeeze(-1).cpu())
+        return torch.cat(values).numpy()
+
+    def _gae(self, rewards, dones, values, last):
+        next_values = np.append(values[1:], 0).astype(np.float32)
+        # Buffers that ended without a terminal (cut off by the worker) bootstrap from their last value
+        next_values[last] = np.where(dones[last], 0, values[last])
+        non_terminal = 1. - dones.astype(np.float32)
+        deltas = rewards + self._gamma * next_values * non_terminal - values
+        # No decay past the last step of a buffer, the next step belongs to another episode
+        decay = (self._gamma * self._gae_lambda * non_terminal * ~last).tolist()
+        reversed_advantages = []
+        gae = 0.
+        for delta, d in zip(deltas[::-1].tolist(), decay[::-1]):
+            gae = delta + d * gae
+            reversed_advantages.append(gae)
+        advantages = np.array(reversed_advantages[::-1], dtype=np.float32)
+        return advantages, advantages + values
+
+    def _optimise(self, obs, actions, old_log_probs, advantages, returns, device, totals):
+        n = len(returns)
+        optimizer = self.agent.optimizer
+        critic_params = critic_only_parameters(self.agent.actor, self.agent.critic)
+        scaler = torch.cuda.amp.GradScaler() if self.autocast_dtype == torch.float16 and device.type == "cuda" \
+            else None
+        batch_size = min(self._batch_size, n)
+        minibatch_size = min(self._minibatch_size, batch_size)
+        micro_batch_size = min(self.micro_batch_size or minibatch_size, minibatch_size)
+        self.epoch_samples_per_second = []
+        if device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(device)
+
+        for epoch in range(self._n_epochs):
+            start_time = time.perf_counter()
+            indices = torch.randperm(n)[:batch_size]
+            for mb_start in range(0, batch_size, minibatch_size):
+                minibatch = indices[mb_start:mb_start + minibatch_size]
+                for micro_start in range(0, len(minibatch), micro_batch_size):
+                    idx = minibatch[micro_start:micro_start + micro_batch_size]
+                    adv = advantages[idx].to(device)
+                    old_log_prob = old_log_probs[idx].to(device)
+                    log_prob, entropy, value = self._evaluate(obs[idx].to(device, non_blocking=True),
+                                                              actions[idx].to(device), device)
+
+                    log_ratio = log_prob - old_log_prob
+                    ratio = torch.exp(log_ratio)
+                    clipped = torch.clamp(ratio, 1 - self._clip_range, 1 + self._clip_range)
+                    policy_loss = -torch.min(ratio * adv, clipped * adv).mean()
+                    value_loss = torch.nn.functional.mse_loss(value, returns[idx].to(device))
+                    entropy_loss = -entropy.mean()
+                    loss = policy_loss + self._ent_coef * entropy_loss + self._vf_coef * value_loss
+                    # Weighted so the accumulated gradient is the minibatch mean
+                    loss = loss * (len(idx) / len(minibatch))
+                    (scaler.scale(loss) if scaler is not None else loss).backward()
+
+                    with torch.no_grad():
+                        weight = len(idx) / batch_size / self._n_epochs
+                        totals["ppo/policy_loss"] += policy_loss.item() * weight
+                        totals["ppo/value_loss"] += value_loss.item() * weight
+                        totals["ppo/entropy"] += -entropy_loss.item() * weight
+                        totals["ppo/mean_kl"] += ((ratio - 1) - log_ratio).mean().item() * weight
+                        totals["ppo/clip_fraction"] += ((ratio - 1).abs() > self._clip_range).float().mean().item() \
+                            * weight
+
+                if scaler is not None:
+                    scaler.unscale_(optimizer)
+                clip_grad_norm_(self.agent.actor.parameters(), self._max_grad_norm)
+                clip_grad_norm_(critic_params, self._max_grad_norm)
+                if scaler is not None:
+                    scaler.step(optimizer)
+                    scaler.update()
+                else:
+                    optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+            self.epoch_samples_per_second.append(batch_size / (time.perf_counter() - start_time))
+
+    def calculate(self, buffers, iteration):
+        device = next(self.agent.actor.parameters()).device
+        columns = defaultdict(list)
+        if self.profiler is not None:
+            buffers = self.profiler.timed("collect", buffers)
+        for buffer in buffers:
+            if len(buffer.rewards) == 0:
+                continue
+            columns["obs"].append(np.asarray(buffer.observations, dtype=np.float32))
+            columns["actions"].append(np.asarray(buffer.actions).reshape(len(buffer.rewards), -1))
+            columns["log_probs"].append(np.asarray(buffer.log_probs, dtype=np.float32).reshape(-1))
+            columns["rewards"].append(np.asarray(buffer.rewards, dtype=np.float32))
+            columns["dones"].append(np.asarray(buffer.dones, dtype=bool))
+        ends = np.cumsum([len(r) for r in columns["rewards"]])
+        obs = torch.from_numpy(np.concatenate(columns["obs"]))
+        actions = torch.from_numpy(np.concatenate(columns["actions"]).astype(np.int64))
+        old_log_probs = torch.from_numpy(np.concatenate(columns["log_probs"]))
+        rewards = np.concatenate(columns["rewards"])
+        dones = np.concatenate(columns["dones"])
+        del columns
+
+        n = len(rewards)
+        last = np.zeros(n, dtype=bool)
+        last[ends - 1] = True
+        with self._phase("gae"):
+            values = self._predict_values(obs, device)
+            advantages, returns = self._gae(rewards, dones, values, last)
+            advantages = torch.from_numpy((advantages - advantages.mean()) / (advantages.std() + 1e-8))
+            returns = torch.from_numpy(returns)
+
+        totals = defaultdict(float)
+        with self._phase("optimise"):
+            self._optimise(obs, actions, old_log_probs, advantages, returns, device, totals)
+
+        totals["ppo/explained_variance"] = 1 - np.var(returns.numpy() - values) / (np.var(returns.numpy()) + 1e-8)
+        totals["ppo/samples_per_second"] = float(np.mean(self.epoch_samples_per_second))
+        totals["ppo/min_epoch_samples_per_second"] = float(np.min(self.epoch_samples_per_second))
+        if device.type == "cuda":
+            totals["ppo/peak_memory_mb"] = torch.cuda.max_memory_allocated(device) / 2 ** 20
+        if self.profiler is not None:
+            totals.update(self.profiler.report(n))
+        if self._logger is not None:
+            # Committed with the rest of the iteration's stats
+            self._logger.log(dict(totals), commit=False)
+        if self.checkpoints is not None and self._iterations_per_save and iteration % self._iterations_per_save == 0:
+            self.save(self.checkpoints.directory, iteration)
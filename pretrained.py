@@ -0,0 +1,38 @@
+"""
+Pretrained opponents that load their model the first time they are picked instead of when the worker starts.
+"""
+import threading
+from contextlib import nullcontext
+
+# One for every agent: loading contexts like inference_server.remote_loading swap the global torch.jit.load, so two
+# agents built at once would load each other's model or leave it swapped
+_building = threading.Lock()
+
+
+def lazy_agent(agent_class, loading=None, **kwargs):
+    """
+    :param agent_class: pretrained agent class, e.g. Nexto.
+    :param loading: optional factory of the context manager the agent is built in, called on every attempt, e.g.
+     lambda: inference_server.remote_loading(socket_path, "nexto").
+    :return: an agent_class that only runs agent_class.__init__(**kwargs) on its first act.
+    """
+    class Lazy(agent_class):
+        def __init__(self):  # Nothing loaded yet, see act
+            self._loaded = False
+
+        def act(self, *args, **act_kwargs):
+            if not self._loaded:
+                with _building:  # Several match threads can pick it at once
+                    if not self._loaded:
+                        with loading() if loading is not None else nullcontext():
+                            agent_class.__init__(self, **kwargs)
+                        self._loaded = True
+            return agent_class.act(self, *args, **act_kwargs)
+
+        def __repr__(self):
+            return f"{agent_class.__name__}({'loaded' if self._loaded else 'not loaded'})"
+
+    # Keeps the agent's name in rocket-learn's logs and the opponent stats
+    Lazy.__name__ = agent_class.__name__
+    Lazy.__qualname__ = agent_class.__qualname__
+    return Lazy()
@@ -0,0 +1,132 @@
+"""
+Where a learner iteration goes. The PPO and the rollout generator time their phases through one IterationProfiler:
+waiting for rollouts (collect), values and advantages (gae), the optimisation epochs (optimise), publishing the new
+actor and opponent versions (publish) and checkpoints (checkpoint). Once per iteration it reports them with the
+ingest rates, the Redis rollout queue, rollout age in the ingest ring, stale drops (rollouts rocket-learn dropped for
+max_age and buffers the ring dropped for max_lag) and peak memory.
+
+Phases that run after the report (e.g. a checkpoint saved at the end of an iteration) show up in the next one.
+
+With trace_iterations, a torch.profiler trace of that many iterations (after the first one, which warms up) is
+written to trace_dir, with the phases as labelled ranges.
+"""
+import os
+import resource
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import torch
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return float("nan")  # Not on Linux
+
+
+class IterationProfiler:
+    def __init__(self, redis=None, ring=None, stale_rollouts=None, trace_iterations=0, trace_dir="profiler_traces"):
+        """
+        :param redis: to report the rollout queue length.
+        :param ring: ingest.ExperienceRing, to report the ingest rates, rollout age and stale drops.
+        :param stale_rollouts: rollout_generator.StaleRolloutCounter, to report the rollouts dropped for max_age.
+        """
+        self.redis = redis
+        self.ring = ring
+        self.stale_rollouts = stale_rollouts
+        self._last_stale_rollouts = 0
+        self.trace_iterations = trace_iterations
+        self.trace_dir = trace_dir
+        self.phases = defaultdict(float)
+        self._last_report = time.perf_counter()
+        self._last_ring_stats = ring.get_stats() if ring is not None else {}
+        self._iterations = 0
+        self._trace = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            if self._trace is not None:
+                with torch.profiler.record_function(name):
+                    yield
+            else:
+                yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def timed(self, name: str, iterator):
+        """
+        Yields from iterator, counting the time spent waiting on it as phase name.
+        """
+        iterator = iter(iterator)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def report(self, samples: int) -> dict:
+        """
+        Called once per iteration, with the number of samples PPO trained on.
+
+        :return: the stats to log for the iteration since the previous report.
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last_report
+        self._last_report = now
+
+        stats = {f"profile/{name}_seconds": seconds for name, seconds in self.phases.items()}
+        stats["profile/iteration_seconds"] = elapsed
+        stats["profile/other_seconds"] = max(elapsed - sum(self.phases.values()), 0)
+        stats["profile/samples_per_second_consumed"] = samples / elapsed
+        self.phases.clear()
+
+        if self.redis is not None:
+            from rocket_learn.rollout_generator.redis_rollout_generator import ROLLOUTS
+            stats["profile/redis_queued_rollouts"] = self.redis.llen(ROLLOUTS)
+        if self.stale_rollouts is not None:
+            dropped = self.stale_rollouts.dropped
+            stats["profile/stale_rollouts_per_iteration"] = dropped - self._last_stale_rollouts
+            self._last_stale_rollouts = dropped
+        if self.ring is not None:
+            ring_stats = self.ring.get_stats()
+            for key in ("ingest/ingested_steps", "ingest/stale_drops"):
+                stats[key + "_per_iteration"] = ring_stats[key] - self._last_ring_stats.get(key, 0)
+            stats["profile/samples_per_second_ingested"] = stats["ingest/ingested_steps_per_iteration"] / elapsed
+            stats.update(self.ring.pop_age_stats())
+            self._last_ring_stats = ring_stats
+
+        stats["profile/rss_mb"] = _rss_mb()
+        stats["profile/peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+        if torch.cuda.is_available():
+            stats["profile/peak_cuda_mb"] = torch.cuda.max_memory_allocated() / 2 ** 20
+            torch.cuda.reset_peak_memory_stats()
+
+        self._step_trace()
+        return stats
+
+    def _step_trace(self):
+        # Iteration 0 warms up, then trace_iterations are traced
+        self._iterations += 1
+        if not self.trace_iterations:
+            return
+        if self._iterations == 1:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._trace = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+            self._trace.__enter__()
+        elif self._iterations == self.trace_iterations + 1:
+            self._trace.__exit__(None, None, None)
+            os.makedirs(self.trace_dir, exist_ok=True)
+            file = os.path.join(self.trace_dir, f"learner_{int(time.time())}.json")
+            self._trace.export_chrome_trace(file)
+            print(f"Profiler trace of {self.trace_iterations} iterations written to {file}")
+            self._trace = None
+            self.trace_iterations = 0
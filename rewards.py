@@ -4,34 +4,59 @@ from rlgym.utils.common_values import CAR_MAX_SPEED
 from rlgym.utils import RewardFunction
 from rlgym.utils import common_values
 from rlgym.utils.gamestates import GameState, PlayerData
+from rlgym.utils.reward_functions import CombinedReward
+from rlgym.utils.reward_functions.common_rewards import EventReward
+
+import telemetry
+from state_arrays import state_arrays
 
 ball_max_height = common_values.CEILING_Z / 2 - common_values.BALL_RADIUS
 reward_max_height = common_values.CEILING_Z / 2
 
 class JumpTouchReward(RewardFunction):
-    def __init__(self, min_height=common_values.BALL_RADIUS, exp=1):
+    def __init__(self, min_height=common_values.BALL_RADIUS, exp=1, cooldown=149):
         self.min_height = min_height
         self.exp = exp
         self.div = ball_max_height ** self.exp
-        self.ticks_until_next_reward = 0
+        self.cooldown = cooldown  # In steps, per player
+        self._cooldowns = np.zeros(0, dtype=int)
+        self._rows = {}
+        self._state = None
+        self._rewards = None
 
     def reset(self, initial_state: GameState):
-        self.ticks_until_next_reward = 0
+        self._rows = {p.car_id: i for i, p in enumerate(initial_state.players)}
+        self._cooldowns = np.zeros(len(self._rows), dtype=int)
+        self._state = None
 
     def get_reward(
         self, player: PlayerData, state: GameState, previous_action: np.ndarray
     ) -> float:
-        if player.ball_touched \
-                and not player.on_ground \
-                and state.ball.position[2] >= self.min_height \
-                and self.ticks_until_next_reward <= 0:
-            self.ticks_until_next_reward = 149
-            reward = (((min(state.ball.position[2], reward_max_height) - common_values.BALL_RADIUS) ** self.exp) / self.div)
-            if reward > .05:
-                print(f"Aerial hit! % from 50% of ceiling: {round(reward*100,2)}%")
-            return reward
-        self.ticks_until_next_reward -= 1
-        return 0
+        if state is not self._state:
+            arrays = state_arrays(state)
+            self._rewards = self.step(state, arrays.ball_touched, arrays.on_ground)
+            self._state = state
+        return float(self._rewards[self._rows[player.car_id]])
+
+    def step(self, state: GameState, ball_touched: np.ndarray, on_ground: np.ndarray) -> np.ndarray:
+        """
+        Rewards for every player (state.players order) and cooldown update, once per step.
+        """
+        if len(self._cooldowns) != len(state.players):
+            self.reset(state)
+        self._cooldowns -= 1
+        ball_height = state.ball.position[2]
+        if not ball_touched.any() or ball_height < self.min_height:  # Most steps, skips the masks
+            return np.zeros(len(ball_touched))
+        hits = ball_touched & ~on_ground & (self._cooldowns < 0)
+        if not hits.any():
+            return np.zeros(len(hits))
+
+        self._cooldowns[hits] = self.cooldown
+        reward = (((min(ball_height, reward_max_height) - common_values.BALL_RADIUS) ** self.exp) / self.div)
+        if reward > .05:
+            telemetry.record_many(telemetry.AERIAL_HIT, np.full(np.count_nonzero(hits), reward))
+        return np.where(hits, reward, 0.)
 
 class WallTouchReward(RewardFunction):
     def __init__(self, min_height=common_values.BALL_RADIUS, exp=1):
@@ -47,7 +72,7 @@ class WallTouchReward(RewardFunction):
     ) -> float:
         if player.ball_touched and player.on_ground and state.ball.position[2] >= self.min_height:
             reward = (((state.ball.position[2] + common_values.BALL_RADIUS) ** self.exp) / self.div)
-            print(f"Wall hit! % from ceiling: {round(reward*100,2)}%")
+            telemetry.record(telemetry.WALL_HIT, reward)
             return reward
 
         return 0
@@ -75,10 +100,56 @@ class KickoffReward(RewardFunction):
             norm_pos_diff = pos_diff / np.linalg.norm(pos_diff)
             vel_to_ball = float(np.dot(norm_pos_diff, vel))
             vtb_exp = (vel_to_ball ** 2 / self.div) #* .5
+            telemetry.record(telemetry.KICKOFF_VELOCITY, vel_to_ball)
             #print(f"KICKOFF: VTB: {vel_to_ball} Reward: {vtb_exp}")
             reward += vtb_exp
             #if player.boost_amount > 0:
                 #boost_reward = (previous_action[6] > 0) * .5
                 #print(f"KICKOFF: BOOSTY REWARD: {boost_reward}")
                 #reward += boost_reward
-        return reward
\ No newline at end of file
+        return reward
+
+
+class TrackedEventReward(EventReward):
+    """
+    EventReward that records the goals in the telemetry, like BatchedEventReward.
+    """
+
+    def get_reward(self, player: PlayerData, state: GameState, previous_action: np.ndarray, optional_data=None):
+        scored = player.match_goals > self.last_registered_values[player.car_id][0]
+        reward = super().get_reward(player, state, previous_action, optional_data)
+        if scored:
+            telemetry.record(telemetry.GOAL, float(np.linalg.norm(state.ball.linear_velocity)))
+        return reward
+
+
+class TrackedCombinedReward(CombinedReward):
+    """
+    CombinedReward with the telemetry bookkeeping of BatchedCombinedReward: flushed on reset and one episode step per
+    state with the mean reward of the players.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._state = None
+
+    def reset(self, initial_state: GameState):
+        # Episode boundary, ship whatever the previous episode recorded
+        telemetry.flush()
+        super().reset(initial_state)
+        self._state = None
+
+    def get_reward(self, player: PlayerData, state: GameState, previous_action: np.ndarray) -> float:
+        return self._track(state, super().get_reward(player, state, previous_action))
+
+    def get_final_reward(self, player: PlayerData, state: GameState, previous_action: np.ndarray) -> float:
+        return self._track(state, super().get_final_reward(player, state, previous_action))
+
+    def _track(self, state: GameState, reward: float) -> float:
+        episode = telemetry.episodes()
+        if state is not self._state:
+            self._state = state
+            episode.step(reward / len(state.players))
+        else:
+            episode.reward += reward / len(state.players)
+        return reward
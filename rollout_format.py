@@ -0,0 +1,185 @@
+"""
+Columnar wire format for the rollouts workers push to the learner.
+
+A rollout message (whatever rocket-learn passes to _serialize: nested tuples and lists of NumPy arrays plus some
+small metadata) is split into a pickled skeleton and its arrays. Every array becomes one contiguous column of a single
+body, and so does every list of same shaped arrays (the per step observations), stacked. Columns are narrowed on the
+way out: float64 to float32, integer arrays that fit (action indices, there are only 126 actions) to uint8, and with
+fp16_obs the observation columns (last dimension obs_size) to float16.
+
+The body is optionally compressed with lz4 or zstd (pip install lz4 / zstandard, only needed where they're used).
+Decoding returns read-only views into the received (or decompressed) buffer, so float32 columns are never copied.
+Narrowed columns are cast back to their original dtype, except float64 ones which stay float32.
+"""
+import io
+import pickle
+import struct
+
+import numpy as np
+
+from env_config import STATE_DIM
+
+MAGIC = b"IMR1"
+_HEADER = struct.Struct("!4sI")
+_ALIGN = 64
+
+CODECS = ("none", "lz4", "zstd")
+
+
+class _Column:
+    # Placeholder left in the skeleton for an array (or stacked list of arrays) moved to the body
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __reduce__(self):
+        return _Column, (self.index,)
+
+
+def _compress(codec: str, data: bytearray, level: int):
+    if codec == "lz4":
+        import lz4.frame
+        return lz4.frame.compress(data, compression_level=level)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return data
+
+
+def _decompress(codec: str, data):
+    if codec == "lz4":
+        import lz4.frame
+        return lz4.frame.decompress(data)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def _narrow(array: np.ndarray, fp16_obs: bool, obs_size: int) -> np.ndarray:
+    if array.dtype.kind == "f":
+        if fp16_obs and array.ndim >= 1 and array.shape[-1] == obs_size:
+            return array.astype(np.float16)
+        if array.dtype == np.float64:
+            return array.astype(np.float32)
+    elif array.dtype.kind in "iu" and array.dtype.itemsize > 1 and array.size \
+            and array.min() >= 0 and array.max() <= 255:
+        return array.astype(np.uint8)
+    return array
+
+
+class RolloutEncoder:
+    """
+    :param codec: "none", "lz4" or "zstd".
+    :param fp16_obs: store the observation columns as float16, halving the biggest part of a rollout.
+    :param obs_size: last dimension of the observation columns.
+    """
+
+    def __init__(self, codec="none", fp16_obs=False, level=None, obs_size=STATE_DIM):
+        assert codec in CODECS, f"Unknown codec {codec}, expected one of {CODECS}"
+        self.codec = codec
+        self.fp16_obs = fp16_obs
+        self.level = level if level is not None else (0 if codec == "lz4" else 3)
+        self.obs_size = obs_size
+
+    def __call__(self, message) -> bytes:
+        columns = []
+        skeleton = self._extract(message, columns)
+
+        arrays = []
+        specs = []
+        offset = 0
+        for original, stacked in columns:
+            array = _narrow(np.ascontiguousarray(original), self.fp16_obs, self.obs_size)
+            # Decoded as float32 rather than widened back, the learner trains in float32 anyway
+            decoded_dtype = np.float32 if original.dtype == np.float64 else original.dtype
+            specs.append((array.dtype.str, array.shape, offset, np.dtype(decoded_dtype).str, stacked))
+            arrays.append(array)
+            offset += -(-array.nbytes // _ALIGN) * _ALIGN
+
+        body = bytearray(offset)
+        for array, (_, _, start, _, _) in zip(arrays, specs):
+            body[start:start + array.nbytes] = array.tobytes()
+        header = pickle.dumps((skeleton, specs, self.codec), protocol=pickle.HIGHEST_PROTOCOL)
+
+        out = io.BytesIO()
+        out.write(_HEADER.pack(MAGIC, len(header)))
+        out.write(header)
+        out.write(_compress(self.codec, body, self.level))
+        return out.getvalue()
+
+    def _extract(self, obj, columns):
+        if isinstance(obj, np.ndarray) and obj.dtype != object:
+            columns.append((obj, False))
+            return _Column(len(columns) - 1)
+        if isinstance(obj, (list, tuple)):
+            first = obj[0] if obj else None
+            if isinstance(first, np.ndarray) and first.dtype != object and len(obj) > 1 \
+                    and all(isinstance(o, np.ndarray) and o.shape == first.shape and o.dtype == first.dtype
+                            for o in obj):
+                columns.append((np.stack(obj), True))
+                return _Column(len(columns) - 1)
+            items = [self._extract(o, columns) for o in obj]
+            return tuple(items) if isinstance(obj, tuple) else items
+        if isinstance(obj, dict):
+            return {k: self._extract(v, columns) for k, v in obj.items()}
+        return obj
+
+
+def is_columnar(data) -> bool:
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def decode(data):
+    """
+    :return: the message given to RolloutEncoder, with arrays that are (mostly read-only) views into data.
+    """
+    view = memoryview(data)
+    magic, header_size = _HEADER.unpack_from(view)
+    assert magic == MAGIC, "Not a columnar rollout"
+    skeleton, specs, codec = pickle.loads(view[_HEADER.size:_HEADER.size + header_size])
+    body = _decompress(codec, view[_HEADER.size + header_size:])
+
+    columns = []
+    for dtype, shape, offset, original_dtype, stacked in specs:
+        array = np.frombuffer(body, dtype=dtype, count=int(np.prod(shape, dtype=np.int64)), offset=offset)
+        array = array.reshape(shape)
+        if dtype != original_dtype:
+            array = array.astype(original_dtype)
+        columns.append(list(array) if stacked else array)
+    return _fill(skeleton, columns)
+
+
+def _fill(obj, columns):
+    if isinstance(obj, _Column):
+        return columns[obj.index]
+    if isinstance(obj, (list, tuple)):
+        items = [_fill(o, columns) for o in obj]
+        return tuple(items) if isinstance(obj, tuple) else items
+    if isinstance(obj, dict):
+        return {k: _fill(v, columns) for k, v in obj.items()}
+    return obj
+
+
+def install(encoder: RolloutEncoder = None):
+    """
+    Makes rocket-learn encode the rollouts it sends with encoder (on the workers), and decode columnar rollouts on
+    the learner. Messages in the old format are still decoded the old way, so workers can be updated one at a time.
+    """
+    import rocket_learn.rollout_generator.redis_rollout_generator as redis_rollout_generator
+    serialize = redis_rollout_generator._serialize
+    unserialize = redis_rollout_generator._unserialize
+
+    if encoder is not None:
+        redis_rollout_generator._serialize = lambda obj: encoder(obj) if _is_rollout(obj) else serialize(obj)
+    redis_rollout_generator._unserialize = lambda data: decode(data) if is_columnar(data) else unserialize(data)
+
+
+def _is_rollout(obj) -> bool:
+    # Only the rollouts carry arrays, everything else rocket-learn serializes (results, versions) keeps its format
+    if isinstance(obj, np.ndarray):
+        return True
+    if isinstance(obj, (list, tuple)):
+        return any(_is_rollout(o) for o in obj)
+    return False
@@ -0,0 +1,326 @@
+import queue
+import threading
+from contextlib import nullcontext
+
+import cloudpickle
+import numpy as np
+import torch.multiprocessing
+import wandb
+from rocket_learn.rollout_generator.base_rollout_generator import BaseRolloutGenerator
+import rocket_learn.rollout_generator.redis_rollout_generator as redis_rollout_generator
+from rocket_learn.rollout_generator.redis_rollout_generator import RedisRolloutGenerator, MODEL_LATEST
+
+import rollout_format
+from curriculum import CurriculumScheduler, SharedCurriculumScheduler
+from env_config import SPLIT, STATE_DIM
+from ingest import ExperienceRing, RolloutIngestor
+from local_worker import run_worker
+from opponent_cache import new_epoch
+from state import ImmortalStateSetter
+from telemetry import read_telemetry, drain_telemetry
+from weights import ActorHandle, SharedActor, publish_weights
+
+
+def setter_stats(episodes: dict, names):
+    """
+    Aggregates the episodes read by read_telemetry per state setter.
+
+    :return: stats to log, and the total reward and steps of each setter (in names order, for the curriculum).
+    """
+    rewards = np.zeros(len(names))
+    lengths = np.zeros(len(names))
+    counts = np.zeros(len(names))
+    terminals = {}
+    for (setter, terminal), (count, steps, reward) in episodes.items():
+        if not 0 <= setter < len(names):
+            continue  # Episodes started before the first reset of ImmortalStateSetter
+        rewards[setter] += reward
+        lengths[setter] += steps
+        counts[setter] += count
+        terminals[(setter, terminal)] = count
+
+    stats = {}
+    total_steps = max(lengths.sum(), 1)
+    for i, name in enumerate(names):
+        stats[f"setters/{name}_episodes"] = counts[i]
+        stats[f"setters/{name}_step_share"] = lengths[i] / total_steps
+        if counts[i] > 0:
+            stats[f"setters/{name}_mean_length"] = lengths[i] / counts[i]
+            stats[f"setters/{name}_mean_reward"] = rewards[i] / counts[i]
+    for (setter, terminal), count in terminals.items():
+        stats[f"setters/{names[setter]}_ended_by_{terminal}"] = count / counts[setter]
+    return stats, rewards, lengths
+
+
+# The BookkeepingLock the thread is advancing a generator under, released while the thread decodes rollouts
+_bookkeeping = threading.local()
+
+
+def _unlocked(func):
+    def wrapper(*args, **kwargs):
+        lock = getattr(_bookkeeping, "lock", None)
+        if lock is None:
+            return func(*args, **kwargs)
+        _bookkeeping.lock = None
+        lock.release()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            lock.acquire()
+            _bookkeeping.lock = lock
+
+    wrapper.unlocked = True
+    return wrapper
+
+
+class BookkeepingLock:
+    """
+    Lets several threads run their own RedisRolloutGenerator.generate_rollouts. Advancing a generator holds the lock,
+    so the Redis pops, the TrueSkill rating reads and writes and the contributors/tot_bytes counts are serialised.
+    The lock is only released while the rollouts are decoded (columnar payloads and rocket-learn's decode_buffers),
+    which is most of the time spent. Everything else rocket-learn unpickles, like the ratings, stays under it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Installed once for every generator, the wrappers release whichever lock the calling thread holds
+        if not getattr(rollout_format.decode, "unlocked", False):
+            rollout_format.decode = _unlocked(rollout_format.decode)
+        decode_buffers = getattr(redis_rollout_generator, "decode_buffers", None)
+        if decode_buffers is not None and not getattr(decode_buffers, "unlocked", False):
+            redis_rollout_generator.decode_buffers = _unlocked(decode_buffers)
+
+    def advance(self, generator):
+        with self._lock:
+            _bookkeeping.lock = self._lock
+            try:
+                return next(generator)
+            finally:
+                _bookkeeping.lock = None
+
+
+def _has_latest_version(message) -> bool:
+    # Rollout messages are (rollout data, versions, ...), the latest versions are negative
+    if not isinstance(message, tuple) or len(message) < 2 or not isinstance(message[1], (list, tuple)):
+        return False
+    return any(isinstance(v, (int, np.integer)) and v < 0 for v in message[1])
+
+
+# The StaleRolloutCounter of the generator the thread runs
+_counting = threading.local()
+
+
+class StaleRolloutCounter:
+    """
+    Counts the rollouts rocket-learn's generate_rollouts drops as older than max_age: rollouts of the latest versions
+    popped from Redis that yielded nothing by the time the next one is popped (evaluation matches of past versions
+    never yield). Every generate_rollouts is wrapped with count, in the thread that runs it.
+    """
+
+    def __init__(self):
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Installed once for every counter, the hook counts for the counter of the calling thread
+        unserialize = redis_rollout_generator._unserialize
+        if not getattr(unserialize, "counting", False):
+            def counting(data):
+                message = unserialize(data)
+                counter = getattr(_counting, "counter", None)
+                if counter is not None and _has_latest_version(message):
+                    counter._popped()
+                return message
+
+            counting.counting = True
+            redis_rollout_generator._unserialize = counting
+
+    def _popped(self):
+        if getattr(self._local, "pending", False):
+            with self._lock:
+                self.dropped += 1
+        self._local.pending = True
+
+    def count(self, rollouts):
+        _counting.counter = self
+        for buffer in rollouts:
+            self._local.pending = False
+            yield buffer
+
+
+class _LatestModelRedis:
+    """
+    The learner's Redis client, except that setting MODEL_LATEST sets model instead.
+    """
+
+    def __init__(self, redis, model: bytes):
+        self._redis = redis
+        self._model = model
+        self.replaced = False
+
+    def set(self, name, value, *args, **kwargs):
+        if name == MODEL_LATEST:
+            value = self._model
+            self.replaced = True
+        return self._redis.set(name, value, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._redis, name)
+
+
+class ImmortalRolloutGenerator(RedisRolloutGenerator):
+    """
+    RedisRolloutGenerator that also collects what the workers flushed through telemetry.py and logs it once per
+    iteration, next to the PPO stats, and publishes the setter weights of an optional CurriculumScheduler (adapted
+    from the per setter episode stats).
+
+    With a weights_dtype the latest actor is also broadcast as a raw buffer, see weights.py.
+
+    With ingest_threads, rollouts are pulled and decoded by that many threads into an ExperienceRing of
+    ingest_slots slots while PPO optimises, see ingest.py. The bookkeeping of the threads is serialised by a
+    BookkeepingLock.
+
+    The rollouts dropped for max_age are counted by stale_rollouts, a StaleRolloutCounter.
+    """
+
+    def __init__(self, redis, *args, logger=None, curriculum: CurriculumScheduler = None, weights_dtype=None,
+                 ingest_threads=0, ingest_slots=4096, ingest_slot_steps=600, max_lag=1, clear=True, **kwargs):
+        super().__init__(redis, *args, logger=logger, clear=clear, **kwargs)
+        new_epoch(redis, clear)  # The versions of the workers' opponent caches start over with a cleared DB
+        self._redis = redis
+        self._logger = logger
+        self.curriculum = curriculum
+        self.weights_dtype = weights_dtype
+        self.ingest_threads = ingest_threads
+        self.profiler = None  # Set by the learner, see profiler.py
+        self.ring = None
+        self.stale_rollouts = StaleRolloutCounter()
+        self._bookkeeping = None
+        if ingest_threads:
+            self._bookkeeping = BookkeepingLock()
+            self.ring = ExperienceRing(ingest_slots, ingest_slot_steps, (STATE_DIM,), (len(SPLIT),), max_lag=max_lag)
+        if curriculum is not None:
+            curriculum.publish()
+
+    def generate_rollouts(self):
+        if self.ring is None:
+            yield from self.stale_rollouts.count(super().generate_rollouts())
+            return
+        yield from RolloutIngestor(self._locked_rollouts, self.ring, self.ingest_threads)
+
+    def _locked_rollouts(self):
+        rollouts = self.stale_rollouts.count(super().generate_rollouts())
+        while True:
+            try:
+                buffer = self._bookkeeping.advance(rollouts)
+            except StopIteration:
+                return
+            yield buffer
+
+    def update_parameters(self, new_params):
+        with self.profiler.phase("publish") if self.profiler is not None else nullcontext():
+            self._update_parameters(new_params)
+
+    def _update_parameters(self, new_params):
+        if self.weights_dtype is None:
+            super().update_parameters(new_params)
+        else:
+            # rocket-learn's update_parameters with the handle as the latest model, set where it would set the
+            # pickled actor (before bumping the version). Opponent snapshots stay full pickles
+            version = publish_weights(self._redis, new_params, self.weights_dtype)
+            handle = cloudpickle.dumps(ActorHandle(version, new_params.shape, STATE_DIM))
+            self.redis = redis = _LatestModelRedis(self._redis, handle)
+            try:
+                super().update_parameters(new_params)
+            finally:
+                self.redis = self._redis
+            if not redis.replaced:
+                raise RuntimeError("rocket-learn's update_parameters didn't set MODEL_LATEST")
+        if self.ring is not None:
+            self.ring.release()  # PPO is done with the buffers of the last iteration
+
+        log_iteration_stats(self._logger, *read_telemetry(self._redis), ring=self.ring, curriculum=self.curriculum)
+
+
+def log_iteration_stats(logger, stats, hists, episodes, ring=None, curriculum: CurriculumScheduler = None):
+    """
+    Logs the telemetry the workers flushed (as read by read_telemetry) with the ingest ring and per setter stats,
+    and adapts the curriculum to the setter stats.
+    """
+    if ring is not None:
+        stats.update(ring.get_stats())
+    episode_stats, rewards, lengths = setter_stats(episodes, ImmortalStateSetter.SETTER_NAMES)
+    stats.update(episode_stats)
+    if curriculum is not None:
+        curriculum.update(rewards, lengths)
+        stats.update(curriculum.get_metrics(ImmortalStateSetter.SETTER_NAMES))
+
+    if logger is None:
+        return
+    for name, (counts, edges) in hists.items():
+        stats[name] = wandb.Histogram(np_histogram=(counts, edges))
+    # PPO commits the step with its own stats
+    logger.log(stats, commit=False)
+
+
+class LocalRolloutGenerator(BaseRolloutGenerator):
+    """
+    Single host training without Redis: starts n_workers local_worker processes, which play self-play episodes of
+    the latest actor and write their rollouts straight into an ExperienceRing in shared memory. New actors are
+    shared through a SharedActor, the setter weights through a SharedCurriculumScheduler and the telemetry through a
+    queue, nothing is pickled per rollout or per version.
+
+    There are no past versions, pretrained opponents or evaluation matches in this mode.
+
+    :param actor: the learner's actor, copied to the workers as their first version.
+    """
+
+    def __init__(self, actor, n_workers, logger=None, curriculum_weights=None, adaptive_curriculum=False,
+                 ingest_slots=4096, ingest_slot_steps=600, max_lag=1, game_speed=100):
+        ctx = torch.multiprocessing.get_context("spawn")
+        self._logger = logger
+        self.profiler = None  # Set by the learner, see profiler.py
+        self.stale_rollouts = None  # Every rollout is of the latest version, nothing is dropped for its age
+        self.curriculum = None
+        curriculum_source = None
+        if curriculum_weights is not None:
+            self.curriculum = SharedCurriculumScheduler(curriculum_weights, ctx, adaptive=adaptive_curriculum)
+            self.curriculum.publish()
+            curriculum_source = self.curriculum.source()
+        self.ring = ExperienceRing(ingest_slots, ingest_slot_steps, (STATE_DIM,), (len(SPLIT),), max_lag=max_lag,
+                                   ctx=ctx)
+        self.shared_actor = SharedActor(actor, ctx)
+        self.telemetry = ctx.Queue()
+        self.stop = ctx.Event()
+        self.processes = [ctx.Process(target=run_worker, name=f"local-worker-{i}", daemon=True,
+                                      args=(i, self.shared_actor, self.ring, curriculum_source, self.telemetry,
+                                            self.stop, game_speed))
+                          for i in range(n_workers)]
+        for process in self.processes:
+            process.start()
+
+    def generate_rollouts(self):
+        while True:
+            try:
+                buffer = self.ring.get(timeout=1)
+            except queue.Empty:
+                for process in self.processes:
+                    if process.exitcode is not None:
+                        raise RuntimeError(f"{process.name} exited with code {process.exitcode}")
+                continue
+            if buffer is not None:
+                yield buffer
+
+    def update_parameters(self, new_params):
+        with self.profiler.phase("publish") if self.profiler is not None else nullcontext():
+            self.shared_actor.publish(new_params)
+            self.ring.release()  # PPO is done with the buffers of the last iteration
+            log_iteration_stats(self._logger, *drain_telemetry(self.telemetry), ring=self.ring,
+                                curriculum=self.curriculum)
+
+    def close(self):
+        self.stop.set()
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()  # Waiting on ring slots
+        self.ring.close()
@@ -1,9 +1,11 @@
+import os
+
 import numpy as np
 from rlgym_tools.extra_state_setters.goalie_state import GoaliePracticeState
 
 from rlgym.utils import StateSetter
 from rlgym.utils.common_values import CAR_MAX_SPEED, SIDE_WALL_X, BACK_WALL_Y, CEILING_Z, BALL_RADIUS, CAR_MAX_ANG_VEL, \
-    BALL_MAX_SPEED
+    BALL_MAX_SPEED, ORANGE_GOAL_CENTER
 from rlgym.utils.math import rand_vec3
 from rlgym.utils.state_setters import DefaultState, StateWrapper
 from rlgym_tools.extra_state_setters.augment_setter import AugmentSetter
@@ -11,6 +13,9 @@ from rlgym_tools.extra_state_setters.hoops_setter import HoopsLikeSetter
 from rlgym_tools.extra_state_setters.replay_setter import ReplaySetter
 from rlgym_tools.extra_state_setters.wall_state import WallPracticeState
 
+import telemetry
+from curriculum import normalize_weights
+
 LIM_X = SIDE_WALL_X - 1152 / 2 - BALL_RADIUS * 2 ** 0.5
 LIM_Y = BACK_WALL_Y - 1152 / 2 - BALL_RADIUS * 2 ** 0.5
 LIM_Z = CEILING_Z - BALL_RADIUS
@@ -31,11 +36,89 @@ GOAL_LINE = 5100
 YAW_MAX = np.pi
 
 
+def _rand_vec3(rng: np.random.Generator, max_norm: np.ndarray) -> np.ndarray:
+    # rlgym.utils.math.rand_vec3 for a whole array of max norms
+    vec = rng.random(max_norm.shape + (3,)) - 0.5
+    vec /= np.linalg.norm(vec, axis=-1, keepdims=True)
+    return vec * (rng.random(max_norm.shape) * max_norm)[..., None]
+
+
 class BetterRandom(StateSetter):  # Random state with some triangular distributions
-    def __init__(self):
+    """
+    Samples pool_size states at once with vectorized numpy and hands one out per reset, the pool is refilled when it
+    runs out. seed makes the sequence of states reproducible per worker, pool_size=0 samples every reset on its own
+    from the global numpy random state.
+    """
+
+    def __init__(self, pool_size=4096, seed=None):
         super().__init__()
+        self.pool_size = pool_size
+        self.rng = np.random.default_rng(seed)
+        self._pool = None
+        self._next = 0
 
     def reset(self, state_wrapper: StateWrapper):
+        if self.pool_size <= 0:
+            self._reset_single(state_wrapper)
+            return
+
+        n_cars = len(state_wrapper.cars)
+        if self._pool is None or self._next >= self.pool_size or self._pool["car_pos"].shape[1] != n_cars:
+            self._pool = self._sample_pool(self.pool_size, n_cars)
+            self._next = 0
+        pool = self._pool
+        i = self._next
+        self._next += 1
+
+        state_wrapper.ball.set_pos(*pool["ball_pos"][i])
+        state_wrapper.ball.set_lin_vel(*pool["ball_vel"][i])
+        state_wrapper.ball.set_ang_vel(*pool["ball_ang_vel"][i])
+        for c, car in enumerate(state_wrapper.cars):
+            car.set_pos(*pool["car_pos"][i, c])
+            car.set_lin_vel(*pool["car_vel"][i, c])
+            car.set_rot(*pool["car_rot"][i, c])
+            car.set_ang_vel(*pool["car_ang_vel"][i, c])
+            car.boost = pool["car_boost"][i, c]
+
+    def _random_positions(self, shape) -> np.ndarray:
+        return np.stack([
+            self.rng.uniform(-LIM_X, LIM_X, shape),
+            self.rng.uniform(-LIM_Y, LIM_Y, shape),
+            self.rng.triangular(BALL_RADIUS, BALL_RADIUS, LIM_Z, shape),
+        ], axis=-1)
+
+    def _sample_pool(self, n: int, n_cars: int) -> dict:
+        rng = self.rng
+        ball_pos = self._random_positions((n,))
+
+        # 99.9% chance of below ball max speed
+        ball_speed = rng.exponential(-BALL_MAX_SPEED / np.log(1 - 0.999), n)
+        ball_vel = _rand_vec3(rng, np.minimum(ball_speed, BALL_MAX_SPEED))
+        ball_ang_vel = _rand_vec3(rng, rng.triangular(0, 0, CAR_MAX_ANG_VEL + 0.5, n))
+
+        # On average 1 second at max speed away from ball, fall back on fully random when out of bounds
+        shape = (n, n_cars)
+        car_pos = ball_pos[:, None] + _rand_vec3(rng, rng.exponential(BALL_MAX_SPEED, shape))
+        valid = (np.abs(car_pos[..., 0]) < LIM_X) & (np.abs(car_pos[..., 1]) < LIM_Y) \
+            & (0 < car_pos[..., 2]) & (car_pos[..., 2] < LIM_Z)
+        car_pos[~valid] = self._random_positions((np.count_nonzero(~valid),))
+
+        return dict(
+            ball_pos=ball_pos,
+            ball_vel=ball_vel,
+            ball_ang_vel=ball_ang_vel,
+            car_pos=car_pos,
+            car_vel=_rand_vec3(rng, rng.triangular(0, 0, CAR_MAX_SPEED, shape)),
+            car_rot=np.stack([
+                rng.triangular(-PITCH_LIM, 0, PITCH_LIM, shape),
+                rng.uniform(-YAW_LIM, YAW_LIM, shape),
+                rng.triangular(-ROLL_LIM, 0, ROLL_LIM, shape),
+            ], axis=-1),
+            car_ang_vel=_rand_vec3(rng, rng.triangular(0, 0, CAR_MAX_ANG_VEL, shape)),
+            car_boost=rng.uniform(0, 1, shape),
+        )
+
+    def _reset_single(self, state_wrapper: StateWrapper):
         state_wrapper.ball.set_pos(
             x=np.random.uniform(-LIM_X, LIM_X),
             y=np.random.uniform(-LIM_Y, LIM_Y),
@@ -80,9 +163,83 @@ class BetterRandom(StateSetter):  # Random state with some triangular distributi
             car.boost = np.random.uniform(0, 1)
 
 
+class MmapReplaySetter(ReplaySetter):
+    """
+    ReplaySetter that memory maps the state file instead of loading it, so every worker on a host shares the same
+    pages, and samples through a small sidecar index (<file>.index.npz) that buckets the states by ball height and
+    distance to the nearest goal.
+
+    bucket_weights gives the relative probability of picking each bucket (see BUCKET_NAMES), None samples states
+    uniformly like ReplaySetter.
+    """
+    HEIGHT_EDGES = (BALL_RADIUS + 20, 600)  # On the ground, low in the air, high in the air
+    NEAR_GOAL = 3000
+    BUCKET_NAMES = ("ground", "ground_near_goal", "low_air", "low_air_near_goal", "high_air", "high_air_near_goal")
+    INDEX_CHUNK = 1 << 16  # States read per pass when building the index
+
+    def __init__(self, file: str, bucket_weights=None):
+        StateSetter.__init__(self)  # ReplaySetter.__init__ would load the whole array
+        self.states = np.load(file, mmap_mode='r')
+        self.order, self.offsets = self._load_index(file)
+        self.counts = np.diff(self.offsets)
+        self.set_bucket_weights(bucket_weights)
+
+    @classmethod
+    def bucketize(cls, states: np.ndarray) -> np.ndarray:
+        ball = states[:, :3]
+        height = np.searchsorted(cls.HEIGHT_EDGES, ball[:, 2])
+        goal_dist = np.linalg.norm(np.abs(ball) - ORANGE_GOAL_CENTER, axis=-1)
+        return (height * 2 + (goal_dist < cls.NEAR_GOAL)).astype(np.int8)
+
+    def _load_index(self, file: str):
+        # Rebuilt when the state file changes, the stamp is its size and modification time
+        index_file = file + ".index.npz"
+        stat = os.stat(file)
+        stamp = np.array([stat.st_size, stat.st_mtime_ns])
+        if os.path.exists(index_file):
+            with np.load(index_file) as index:
+                if np.array_equal(index["stamp"], stamp):
+                    return index["order"], index["offsets"]
+
+        buckets = np.concatenate([self.bucketize(self.states[i:i + self.INDEX_CHUNK])
+                                  for i in range(0, len(self.states), self.INDEX_CHUNK)])
+        order = np.argsort(buckets, kind="stable").astype(np.int32)
+        offsets = np.searchsorted(buckets[order], np.arange(len(self.BUCKET_NAMES) + 1))
+
+        # Workers may race on the first start, whoever replaces last wins with the same content
+        tmp_file = f"{index_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_file, stamp=stamp, order=order, offsets=offsets)
+        os.replace(tmp_file, index_file)
+        return order, offsets
+
+    def set_bucket_weights(self, bucket_weights=None):
+        if bucket_weights is None:
+            weights = self.counts.astype(float)
+        else:
+            weights = np.array(bucket_weights, dtype=float) * (self.counts > 0)  # Empty buckets can't be picked
+        assert len(weights) == len(self.BUCKET_NAMES) and weights.sum() > 0, "Invalid bucket weights"
+        self.bucket_probs = weights / weights.sum()
+
+    def generate_probabilities(self):
+        # Per state probabilities implied by the bucket weights, only for inspection
+        probs = np.zeros(len(self.states))
+        for b, (start, end) in enumerate(zip(self.offsets[:-1], self.offsets[1:])):
+            if end > start:
+                probs[self.order[start:end]] = self.bucket_probs[b] / (end - start)
+        return probs
+
+    def reset(self, state_wrapper: StateWrapper):
+        b = np.random.choice(len(self.bucket_probs), p=self.bucket_probs)
+        i = self.order[self.offsets[b] + np.random.randint(self.counts[b])]
+        data = np.array(self.states[i])  # Copy the row out of the mapping
+        assert len(data) == len(state_wrapper.cars) * 13 + 9, "Data given does not match current game mode"
+        self._set_ball(state_wrapper, data)
+        self._set_cars(state_wrapper, data)
 
 
 class ImmortalStateSetter(StateSetter):
+    SETTER_NAMES = ("replay", "random", "kickoff", "hoops", "walls", "goalie")
+
     def __init__(
             self,
             *,
@@ -91,23 +248,36 @@ class ImmortalStateSetter(StateSetter):
             kickoff_prob=0.15,
             hoops_prob=0.05,
             walls_prob=0.05,
-            goalie_prob=0.04
+            goalie_prob=0.04,
+            seed=None,
+            weights_source=None
     ):  # add goalie_prob/shooting/dribbling?
-
+        """
+        :param weights_source: optional curriculum.RedisCurriculumSource (or SharedCurriculumSource), polled between
+         episodes for new weights.
+        """
         super().__init__()
 
         self.setters = [
-            AugmentSetter(ReplaySetter("ssl_1v1.npy")),
-            BetterRandom(),
+            AugmentSetter(MmapReplaySetter("ssl_1v1.npy")),
+            BetterRandom(seed=seed),
             DefaultState(),
             HoopsLikeSetter(),
             WallPracticeState(),
             GoaliePracticeState(first_defender_in_goal=False, allow_enemy_interference=True),
         ]
-        self.probs = np.array([replay_prob, random_prob, kickoff_prob, hoops_prob, walls_prob, goalie_prob])
+        self.weights_source = weights_source
+        self.set_weights([replay_prob, random_prob, kickoff_prob, hoops_prob, walls_prob, goalie_prob])
 
-        assert self.probs.sum() == 1, "Probabilities must sum to 1"
+    def set_weights(self, weights):
+        assert len(weights) == len(self.setters), "Need one weight per setter"
+        self.probs = normalize_weights(weights)
 
     def reset(self, state_wrapper: StateWrapper):
+        if self.weights_source is not None:
+            weights = self.weights_source.poll()
+            if weights is not None:
+                self.set_weights(weights)
         i = np.random.choice(len(self.setters), p=self.probs)
-        self.setters[i].reset(state_wrapper)
\ No newline at end of file
+        telemetry.episodes().begin(i)
+        self.setters[i].reset(state_wrapper)
@@ -0,0 +1,180 @@
+"""
+Struct-of-arrays view of a GameState: every player's physics from both perspectives in (n_players, 3) arrays, the
+rotation matrices of every car computed in one batched pass, the ball and the match stats, in state.players order.
+
+ArrayMatch parses the states the game sends into ArrayGameStates, which build their arrays once, straight from the
+raw float buffer, and fill every car's rotation matrix cache so rewards calling car_data.forward() and friends don't
+construct it again. Observation builders, rewards and terminal conditions get the arrays with state_arrays(state),
+which falls back to gathering them from the player objects (once per state) for any other GameState.
+"""
+from functools import cached_property
+from typing import List
+
+import numpy as np
+from rlgym.envs import Match
+from rlgym.utils.gamestates import GameState
+
+_START = 3 + GameState.BOOST_PADS_LENGTH
+_PLAYERS_START = _START + GameState.BALL_STATE_LENGTH
+_CAR = GameState.PLAYER_CAR_STATE_LENGTH
+
+# rlgym.utils.math.quat_to_rot_mtx only uses products of quaternion components, so the rotation matrix (and the
+# squared norm) is linear in the flattened outer product q q^T. Columns: forward, left, up, each x, y, z, then norm
+_W, _X, _Y, _Z = range(4)
+_ROT_TERMS = np.zeros((16, 10))
+for _col, _terms in enumerate((
+        ((_Y, _Y, -2), (_Z, _Z, -2)), ((_X, _Y, 2), (_Z, _W, 2)), ((_X, _Z, 2), (_Y, _W, -2)),  # forward
+        ((_X, _Y, 2), (_Z, _W, -2)), ((_X, _X, -2), (_Z, _Z, -2)), ((_Y, _Z, 2), (_X, _W, 2)),  # left
+        ((_X, _Z, 2), (_Y, _W, 2)), ((_Y, _Z, 2), (_X, _W, -2)), ((_X, _X, -2), (_Y, _Y, -2)),  # up
+        ((_W, _W, 1), (_X, _X, 1), (_Y, _Y, 1), (_Z, _Z, 1)))):  # norm
+    for _i, _j, _k in _terms:
+        _ROT_TERMS[_i * 4 + _j, _col] += _k
+_ROT_OFFSET = np.eye(3).T.reshape(9)
+
+
+def rotation_matrices(quaternions: np.ndarray) -> np.ndarray:
+    """
+    (..., 4) quaternions to (..., 3, 3) rotation matrices, same as quat_to_rot_mtx (zeros for a zero quaternion).
+    """
+    q = quaternions.reshape(-1, 4)
+    n = len(q)
+    terms = (q[:, :, None] * q[:, None, :]).reshape(n, 16) @ _ROT_TERMS
+    norm = terms[:, 9:]
+    valid = norm != 0
+    columns = np.divide(terms[:, :9], norm, out=np.zeros((n, 9)), where=valid) + _ROT_OFFSET * valid
+    return columns.reshape(quaternions.shape[:-1] + (3, 3)).swapaxes(-1, -2)  # Columns to matrix columns
+
+
+class StateArrays:
+    """
+    :param cars: (2, n_players, 13) position, quaternion, linear and angular velocity, [0] from the blue perspective
+     and [1] inverted.
+    :param ball: (2, 9) position, linear and angular velocity, normal and inverted.
+    :param boost_pads: (2, 34) normal and inverted.
+    :param info: (n_players, 10) match goals, saves, shots, demolishes, boost pickups, is demoed, on ground, ball
+     touched, has flip, boost amount.
+    """
+
+    def __init__(self, car_ids: List[int], team_num: np.ndarray, cars: np.ndarray, ball: np.ndarray,
+                 boost_pads: np.ndarray, info: np.ndarray, blue_score: int, orange_score: int):
+        self.car_ids = car_ids
+        self.team_num = team_num
+        self.cars = cars
+        self.ball = ball
+        self.boost_pads = boost_pads
+        self.info = info
+        self.blue_score = blue_score
+        self.orange_score = orange_score
+
+        self.position = cars[0, :, 0:3]
+        self.quaternion = cars[0, :, 3:7]
+        self.linear_velocity = cars[0, :, 7:10]
+        self.angular_velocity = cars[0, :, 10:13]
+        self.inverted_position = cars[1, :, 0:3]
+        self.inverted_linear_velocity = cars[1, :, 7:10]
+        self.ball_position = ball[0, 0:3]
+        self.ball_linear_velocity = ball[0, 3:6]
+        self.ball_angular_velocity = ball[0, 6:9]
+
+        flags = (info[:, 5:9] > 0).T
+        self.is_demoed, self.on_ground, self.ball_touched, self.has_flip = flags
+        self.boost_amount = info[:, 9]
+
+    @classmethod
+    def from_floats(cls, state_floats) -> "StateArrays":
+        """
+        From the float buffer the RLGym plugin sends, the one GameState.decode reads.
+        """
+        floats = np.asarray(state_floats, dtype=float)
+        boost_pads = floats[3:_START]
+        # GameState.decode reads the inverted ball half a ball packet in
+        ball = floats[_START:_PLAYERS_START].reshape(2, 9)
+        players = floats[_PLAYERS_START:].reshape(-1, GameState.PLAYER_INFO_LENGTH)
+        players = players[np.argsort(players[:, 0], kind="stable")]  # GameState sorts them by car_id
+        return cls(
+            car_ids=players[:, 0].astype(int).tolist(),
+            team_num=players[:, 1].astype(int),
+            cars=np.ascontiguousarray(players[:, 2:2 + 2 * _CAR].reshape(-1, 2, _CAR).swapaxes(0, 1)),
+            ball=ball,
+            boost_pads=np.stack([boost_pads, boost_pads[::-1]]),
+            info=players[:, 2 + 2 * _CAR:],
+            blue_score=int(floats[1]),
+            orange_score=int(floats[2]),
+        )
+
+    @classmethod
+    def from_state(cls, state: GameState) -> "StateArrays":
+        """
+        Gathered from the player objects, for GameStates that weren't decoded by ArrayGameState.
+        """
+        players = state.players
+        cars = [p.car_data for p in players] + [p.inverted_car_data for p in players]
+        balls = (state.ball, state.inverted_ball)
+        return cls(
+            car_ids=[p.car_id for p in players],
+            team_num=np.array([p.team_num for p in players], dtype=int),
+            cars=np.array([np.concatenate([c.position, c.quaternion, c.linear_velocity, c.angular_velocity])
+                           for c in cars], dtype=float).reshape(2, len(players), _CAR),
+            ball=np.array([np.concatenate([b.position, b.linear_velocity, b.angular_velocity]) for b in balls],
+                          dtype=float),
+            boost_pads=np.stack([state.boost_pads, state.inverted_boost_pads]).astype(float),
+            info=np.array([(p.match_goals, p.match_saves, p.match_shots, p.match_demolishes, p.boost_pickups,
+                            p.is_demoed, p.on_ground, p.ball_touched, p.has_flip, p.boost_amount)
+                           for p in players], dtype=float).reshape(-1, 10),
+            blue_score=state.blue_score,
+            orange_score=state.orange_score,
+        )
+
+    @cached_property
+    def rotation(self) -> np.ndarray:
+        """
+        (2, n_players, 3, 3) rotation matrices, columns forward, left and up, like PhysicsObject.rotation_mtx.
+        """
+        return rotation_matrices(self.cars[..., 3:7])
+
+    @property
+    def forward(self) -> np.ndarray:
+        return self.rotation[0, :, :, 0]
+
+    @property
+    def up(self) -> np.ndarray:
+        return self.rotation[0, :, :, 2]
+
+
+class ArrayGameState(GameState):
+    """
+    A GameState that also decodes its StateArrays, see state_arrays.
+    """
+
+    def __init__(self, state_floats: List[float] = None):
+        self.arrays = None
+        super().__init__(state_floats)
+
+    def decode(self, state_floats: List[float]):
+        super().decode(state_floats)
+        self.arrays = StateArrays.from_floats(state_floats)
+        # One batched pass instead of a quat_to_rot_mtx per car and perspective
+        rotation = self.arrays.rotation
+        for i, player in enumerate(self.players):
+            for perspective, car in enumerate((player.car_data, player.inverted_car_data)):
+                car._rotation_mtx = rotation[perspective, i]
+                car._has_computed_rot_mtx = True
+
+
+class ArrayMatch(Match):
+    """
+    Match whose states are ArrayGameStates.
+    """
+
+    def parse_state(self, state_str: List[float]) -> GameState:
+        return ArrayGameState(state_str)
+
+
+def state_arrays(state: GameState) -> StateArrays:
+    """
+    The StateArrays of state, built the first time they are asked for.
+    """
+    arrays = getattr(state, "arrays", None)
+    if arrays is None:
+        arrays = state.arrays = StateArrays.from_state(state)
+    return arrays
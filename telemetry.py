@@ -0,0 +1,259 @@
+"""
+Cheap event recording for the simulation hot path.
+
+Rewards record events into a preallocated, per process ring buffer. Workers flush it once per episode to Redis (or a
+queue, for local training) as summed counters and fixed-bin histograms, and the learner reads and clears those once
+per iteration.
+
+Episodes are tracked the same way: the state setter that started them, their length and reward, and the terminal
+condition that ended them.
+"""
+import threading
+from queue import Empty
+
+import numpy as np
+
+TELEMETRY_COUNTERS = "telemetry-counters"
+TELEMETRY_HISTOGRAMS = "telemetry-histograms"
+
+AERIAL_HIT, WALL_HIT, KICKOFF_VELOCITY, GOAL = range(4)
+EVENT_NAMES = ("aerial_hit", "wall_hit", "kickoff_velocity", "goal")
+
+# Fixed edges so histograms from every worker can simply be summed
+HISTOGRAM_EDGES = (
+    np.linspace(0, 1, 11),  # share of the reward, 50% of the ceiling for aerials, the ceiling for wall hits
+    np.linspace(0, 1, 11),
+    np.linspace(-2300, 2300, 24),  # velocity towards the ball
+    np.linspace(0, 6000, 13),  # ball speed
+)
+
+
+class EventRing:
+    """
+    Ring of (event, value) records. There is a single writer (the simulation loop) and reads happen on the same
+    thread between episodes, so no locking is needed. When the ring fills up before it is drained the oldest
+    records are overwritten and counted as dropped.
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.events = np.zeros(capacity, dtype=np.int8)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.written = 0
+        self.drained = 0
+
+    def record(self, event: int, value: float = 0.):
+        i = self.written % self.capacity
+        self.events[i] = event
+        self.values[i] = value
+        self.written += 1
+
+    def record_many(self, event: int, values: np.ndarray):
+        idx = (self.written + np.arange(len(values))) % self.capacity
+        self.events[idx] = event
+        self.values[idx] = values
+        self.written += len(values)
+
+    def drain(self):
+        """
+        :return: events and values recorded since the last drain, and how many records were overwritten.
+        """
+        n = self.written - self.drained
+        dropped = max(0, n - self.capacity)
+        idx = np.arange(self.written - n + dropped, self.written) % self.capacity
+        self.drained = self.written
+        return self.events[idx], self.values[idx], dropped
+
+
+class EpisodeTracker:
+    """
+    Follows the current episode. begin is called by the state setter, step once per state by the reward and end by
+    the terminal condition that fired.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._start(-1)
+
+    def _start(self, setter: int):
+        self.setter = setter
+        self.terminal = "none"
+        self.steps = 0
+        self.reward = 0.
+
+    def begin(self, setter: int):
+        if self.steps:
+            self.records.append((self.setter, self.terminal, self.steps, self.reward))
+        self._start(setter)
+
+    def step(self, reward: float):
+        self.steps += 1
+        self.reward += reward
+
+    def end(self, terminal: str):
+        self.terminal = terminal
+
+    def drain(self) -> list:
+        records = self.records
+        self.records = []
+        return records
+
+
+def summarize(events: np.ndarray, values: np.ndarray):
+    """
+    :return: counters ({"<event>:count": n, "<event>:sum": total}) and histograms ({"<event>:<bin>": n}).
+    """
+    counters = {}
+    histograms = {}
+    for event, name in enumerate(EVENT_NAMES):
+        event_values = values[events == event]
+        if len(event_values) == 0:
+            continue
+        counters[f"{name}:count"] = len(event_values)
+        counters[f"{name}:sum"] = float(event_values.sum())
+        edges = HISTOGRAM_EDGES[event]
+        counts, _ = np.histogram(np.clip(event_values, edges[0], edges[-1]), bins=edges)
+        for b in np.flatnonzero(counts):
+            histograms[f"{name}:{b}"] = int(counts[b])
+    return counters, histograms
+
+
+def summarize_episodes(records: list) -> dict:
+    """
+    :return: counters ({"episode:<setter>:<terminal>:<count|steps|reward>": value}).
+    """
+    counters = {}
+    for setter, terminal, steps, reward in records:
+        prefix = f"episode:{setter}:{terminal}"
+        for field, value in (("count", 1), ("steps", steps), ("reward", reward)):
+            counters[f"{prefix}:{field}"] = counters.get(f"{prefix}:{field}", 0) + value
+    return counters
+
+
+class RedisTelemetrySink:
+    def __init__(self, redis):
+        self.redis = redis
+
+    def write(self, counters: dict, histograms: dict, dropped: int):
+        pipe = self.redis.pipeline(transaction=False)
+        for field, value in counters.items():
+            pipe.hincrbyfloat(TELEMETRY_COUNTERS, field, value)
+        for field, value in histograms.items():
+            pipe.hincrby(TELEMETRY_HISTOGRAMS, field, value)
+        if dropped:
+            pipe.hincrby(TELEMETRY_COUNTERS, "dropped", dropped)
+        pipe.execute()
+
+
+class QueueTelemetrySink:
+    """
+    For worker processes of the learner's host (local training), read back with drain_telemetry.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def write(self, counters: dict, histograms: dict, dropped: int):
+        self.queue.put((counters, histograms, dropped))
+
+
+def read_telemetry(redis):
+    """
+    Reads and clears everything the workers flushed since the last call.
+
+    :return: scalar stats ({"telemetry/<event>_count": n, "telemetry/<event>_mean": mean, ...}), histograms
+             ({"telemetry/<event>": (counts, edges)}) and episodes ({(setter, terminal): (count, steps, reward)}).
+    """
+    pipe = redis.pipeline(transaction=True)
+    pipe.hgetall(TELEMETRY_COUNTERS)
+    pipe.hgetall(TELEMETRY_HISTOGRAMS)
+    pipe.delete(TELEMETRY_COUNTERS, TELEMETRY_HISTOGRAMS)
+    counters, histograms, _ = pipe.execute()
+    counters = {k.decode(): float(v) for k, v in counters.items()}
+    histograms = {k.decode(): int(v) for k, v in histograms.items()}
+    return _telemetry_stats(counters, histograms)
+
+
+def drain_telemetry(queue):
+    """
+    read_telemetry for a QueueTelemetrySink's queue.
+    """
+    counters = {}
+    histograms = {}
+    while True:
+        try:
+            flushed_counters, flushed_histograms, dropped = queue.get_nowait()
+        except Empty:
+            break
+        for field, value in flushed_counters.items():
+            counters[field] = counters.get(field, 0.) + value
+        for field, value in flushed_histograms.items():
+            histograms[field] = histograms.get(field, 0) + value
+        counters["dropped"] = counters.get("dropped", 0.) + dropped
+    return _telemetry_stats(counters, histograms)
+
+
+def _telemetry_stats(counters: dict, histograms: dict):
+    stats = {"telemetry/dropped": counters.get("dropped", 0.)}
+    hists = {}
+    for event, name in enumerate(EVENT_NAMES):
+        count = counters.get(f"{name}:count", 0.)
+        stats[f"telemetry/{name}_count"] = count
+        if count > 0:
+            stats[f"telemetry/{name}_mean"] = counters[f"{name}:sum"] / count
+            edges = HISTOGRAM_EDGES[event]
+            counts = np.array([histograms.get(f"{name}:{b}", 0) for b in range(len(edges) - 1)])
+            hists[f"telemetry/{name}"] = (counts, edges)
+
+    episodes = {}
+    for field, value in counters.items():
+        if field.startswith("episode:"):
+            _, setter, terminal, kind = field.split(":")
+            episodes.setdefault((int(setter), terminal), {})[kind] = value
+    episodes = {k: (v.get("count", 0.), v.get("steps", 0.), v.get("reward", 0.)) for k, v in episodes.items()}
+    return stats, hists, episodes
+
+
+# ONE RING AND TRACKER PER THREAD (EVERY MATCH OF A MULTI-MATCH WORKER HAS ITS OWN), THE WORKER SETS THE SINK
+_local = threading.local()
+_sink = None
+
+
+def _current():
+    if not hasattr(_local, "ring"):
+        _local.ring = EventRing()
+        _local.episodes = EpisodeTracker()
+    return _local
+
+
+def episodes() -> EpisodeTracker:
+    return _current().episodes
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink
+
+
+def record(event: int, value: float = 0.):
+    _current().ring.record(event, value)
+
+
+def record_many(event: int, values: np.ndarray):
+    _current().ring.record_many(event, values)
+
+
+def flush():
+    """
+    Ships everything recorded since the last flush to the sink, if there is one. Called between episodes.
+    """
+    if _sink is None:
+        return
+    current = _current()
+    events, values, dropped = current.ring.drain()
+    records = current.episodes.drain()
+    if len(events) == 0 and not dropped and not records:
+        return
+    counters, histograms = summarize(events, values)
+    counters.update(summarize_episodes(records))
+    _sink.write(counters, histograms, dropped)
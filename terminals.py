@@ -0,0 +1,24 @@
+from rlgym.utils import TerminalCondition
+from rlgym.utils.gamestates import GameState
+
+import telemetry
+
+
+class TrackedTerminalCondition(TerminalCondition):
+    """
+    Wraps a terminal condition to record in the episode telemetry that it was the one ending the episode.
+    """
+
+    def __init__(self, condition: TerminalCondition, name: str = None):
+        super().__init__()
+        self.condition = condition
+        self.name = name or type(condition).__name__
+
+    def reset(self, initial_state: GameState):
+        self.condition.reset(initial_state)
+
+    def is_terminal(self, current_state: GameState) -> bool:
+        done = self.condition.is_terminal(current_state)
+        if done:
+            telemetry.episodes().end(self.name)
+        return done
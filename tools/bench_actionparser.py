@@ -0,0 +1,49 @@
+"""
+Micro-benchmark of ImmortalAction.parse_actions, batched path vs the per-row loop.
+
+Run from the repo root: python -m tools.bench_actionparser
+"""
+import timeit
+
+import numpy as np
+
+from actionparser import ImmortalAction
+
+
+def _padded(indices, width=8):
+    actions = np.full((len(indices), width), np.nan)
+    actions[:, 0] = indices
+    return actions
+
+
+def make_cases(n_agents, rng):
+    n_actions = ImmortalAction().get_action_space().n
+    indices = rng.integers(0, n_actions, n_agents).astype('float64')
+    expanded = ImmortalAction()._lookup_table[rng.integers(0, n_actions, n_agents)].astype('float64')
+
+    mixed = _padded(indices)
+    mixed[::2] = expanded[::2]  # e.g. Nexto/Necto opponents next to our own index policy
+
+    return {
+        "indices (n, 1)": indices[:, None],
+        "expanded (n, 8)": expanded,
+        "padded (n, 8)": _padded(indices),
+        "mixed (n, 8)": mixed,
+    }
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    batched = ImmortalAction(batched=True)
+    loop = ImmortalAction(batched=False)
+    number = 20_000
+
+    for n_agents in (2, 6, 64):
+        for name, actions in make_cases(n_agents, rng).items():
+            expected = loop.parse_actions(np.copy(actions), None)
+            assert np.array_equal(batched.parse_actions(np.copy(actions), None), expected), name
+
+            t_loop = timeit.timeit(lambda: loop.parse_actions(actions, None), number=number)
+            t_batched = timeit.timeit(lambda: batched.parse_actions(actions, None), number=number)
+            print(f"n={n_agents:<3} {name:<16} loop {t_loop / number * 1e6:8.2f}us  "
+                  f"batched {t_batched / number * 1e6:8.2f}us  x{t_loop / t_batched:.1f}")
@@ -0,0 +1,91 @@
+"""
+Compares the separate actor and critic networks with the shared trunk variant (agent.get_shared_actor_critic):
+parameter and Adam state memory, activation memory saved for backward per micro-batch, and StreamingPPO update
+throughput on a synthetic batch.
+
+Run from the repo root: python -m tools.bench_actor_critic [--steps 60000] [--micro_batch 16384] [--autocast bfloat16]
+"""
+import argparse
+
+import numpy as np
+import torch
+from rocket_learn.agent.actor_critic_agent import ActorCriticAgent
+from rocket_learn.experience_buffer import ExperienceBuffer
+
+from agent import get_actor_critic, critic_only_parameters
+from env_config import SPLIT, STATE_DIM
+from ppo import StreamingPPO, make_optimizer
+
+
+def synthetic_buffers(steps: int, episode_length=300, seed=0):
+    rng = np.random.default_rng(seed)
+    buffers = []
+    for _ in range(-(-steps // episode_length)):
+        buffer = ExperienceBuffer()
+        buffer.observations = rng.normal(size=(episode_length, STATE_DIM)).astype(np.float32)
+        buffer.actions = rng.integers(0, sum(SPLIT), (episode_length, len(SPLIT)))
+        buffer.rewards = rng.normal(size=episode_length).astype(np.float32)
+        buffer.dones = np.arange(episode_length) == episode_length - 1
+        buffer.log_probs = np.full(episode_length, -np.log(sum(SPLIT)), dtype=np.float32)
+        buffers.append(buffer)
+    return buffers
+
+
+def make_agent(shared_trunk: bool):
+    actor, critic = get_actor_critic(SPLIT, STATE_DIM, shared_trunk=shared_trunk)
+    optim = make_optimizer([
+        {"params": actor.parameters(), "lr": 5e-5},
+        {"params": critic_only_parameters(actor, critic), "lr": 5e-5}
+    ])
+    return ActorCriticAgent(actor=actor, critic=critic, optimizer=optim)
+
+
+def activation_bytes(ppo: StreamingPPO, batch_size: int) -> int:
+    # Everything autograd keeps for the backward pass of one micro-batch
+    saved = []
+
+    def pack(tensor):
+        saved.append(tensor.numel() * tensor.element_size())
+        return tensor
+
+    obs = torch.randn(batch_size, STATE_DIM)
+    actions = torch.zeros(batch_size, len(SPLIT), dtype=torch.long)
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        log_prob, entropy, value = ppo._evaluate(obs, actions, torch.device("cpu"))
+    (log_prob.mean() + entropy.mean() + value.mean()).backward()
+    ppo.agent.optimizer.zero_grad(set_to_none=True)
+    return sum(saved)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Separate vs shared trunk actor-critic update cost")
+    parser.add_argument("--steps", type=int, default=60_000, help="samples in the synthetic batch")
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--micro_batch", type=int, default=16_384)
+    parser.add_argument("--autocast", default=None, choices=("bfloat16", "float16"))
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    buffers = synthetic_buffers(args.steps)
+
+    print(f"{'variant':>9} {'params':>10} {'params+adam MB':>15} {'activations MB':>15} {'samples/s':>10}")
+    for shared_trunk in (False, True):
+        torch.manual_seed(0)
+        agent = make_agent(shared_trunk)
+        ppo = StreamingPPO(None, agent, micro_batch_size=args.micro_batch, autocast=args.autocast,
+                           epochs=args.epochs, batch_size=args.steps, minibatch_size=args.steps // 2)
+        params = {id(p): p for p in list(agent.actor.parameters()) + list(agent.critic.parameters())}
+        n_params = sum(p.numel() for p in params.values())
+        ppo.calculate(iter(buffers), 0)  # Also fills the Adam state
+        adam = sum(t.numel() * t.element_size() for state in agent.optimizer.state.values()
+                   for t in state.values() if torch.is_tensor(t))
+        param_mb = (n_params * 4 + adam) / 2 ** 20
+        act_mb = activation_bytes(ppo, args.micro_batch) / 2 ** 20
+        print(f"{'shared' if shared_trunk else 'separate':>9} {n_params:>10,} {param_mb:>15.1f} {act_mb:>15.1f} "
+              f"{np.mean(ppo.epoch_samples_per_second):>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Headless benchmark of everything a worker does per step besides waiting on the game: observations, the actor's
+forward pass, action parsing, terminal conditions and rewards, plus the state setter and episode reset per episode.
+It drives an rlgym Match built from the env_config factories, the same calls in the same order as rlgym's Gym.
+
+States are random (tools/synthetic_states.py), or with --replay the resets come from ImmortalStateSetter and every
+step is a state of ssl_1v1.npy. Reports steps/sec and the mean and p99 latency of every stage, then repeats a
+shorter run under tracemalloc for the memory allocated (peak) and left allocated (net blocks) per call of each stage.
+
+For CI: --json writes the report, and --baseline fails (exit code 1) when a stage got slower than the baseline
+report by more than --tolerance.
+
+Run from the repo root: python -m tools.bench_pipeline [--steps 5000] [--replay] [--json report.json]
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+from rlgym.utils.state_setters import StateWrapper
+
+import env_config
+from agent import get_actor
+from state_arrays import ArrayMatch
+from tools.synthetic_states import random_state, state_from_wrapper
+
+STAGES = ("state_setter", "episode_reset", "obs", "actor", "parse", "terminal", "reward")
+
+
+class StageTimer:
+    def __init__(self, trace_alloc=False):
+        self.trace_alloc = trace_alloc
+        self.times = defaultdict(list)
+        self.peak_bytes = defaultdict(int)
+        self.net_blocks = defaultdict(int)
+
+    @contextmanager
+    def __call__(self, stage: str):
+        if self.trace_alloc:
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            start_blocks = sys.getallocatedblocks()
+        start = time.perf_counter_ns()
+        yield
+        self.times[stage].append(time.perf_counter_ns() - start)
+        if self.trace_alloc:
+            self.peak_bytes[stage] += tracemalloc.get_traced_memory()[1] - start_bytes
+            self.net_blocks[stage] += sys.getallocatedblocks() - start_blocks
+
+
+class SyntheticSource:
+    def __init__(self, seed, goal_prob=1 / 600):
+        self.rng = np.random.default_rng(seed)
+        self.goal_prob = goal_prob
+        self.scores = np.zeros(2, dtype=int)
+
+    def reset(self):
+        return None  # No state setter to time
+
+    def initial_state(self, wrapper):
+        return random_state(self.rng, scores=tuple(self.scores), kickoff=True)
+
+    def next_state(self):
+        if self.rng.random() < self.goal_prob:
+            self.scores[self.rng.integers(0, 2)] += 1
+        return random_state(self.rng, scores=tuple(self.scores))
+
+
+class ReplaySource:
+    def __init__(self, seed, file="ssl_1v1.npy"):
+        from state import MmapReplaySetter
+        self.setter = env_config.state_setter(seed=seed)
+        self.replay = MmapReplaySetter(file)
+        self.row = 0
+
+    def reset(self):
+        wrapper = StateWrapper(blue_count=1, orange_count=1)
+        self.setter.reset(wrapper)
+        return wrapper
+
+    def initial_state(self, wrapper):
+        return state_from_wrapper(wrapper)
+
+    def next_state(self):
+        wrapper = StateWrapper(blue_count=1, orange_count=1)
+        self.replay._set_cars(wrapper, self.replay.states[self.row % len(self.replay.states)])
+        self.replay._set_ball(wrapper, self.replay.states[self.row % len(self.replay.states)])
+        self.row += 1
+        return state_from_wrapper(wrapper)
+
+
+def make_match():
+    return ArrayMatch(
+        self_play=True,
+        team_size=env_config.TEAM_SIZE,
+        state_setter=None,  # Resets go through the source, to time them apart from the state conversion
+        obs_builder=env_config.obs(),
+        action_parser=env_config.act(),
+        terminal_conditions=env_config.terminals(),
+        reward_function=env_config.rew(env_config.TEAM_SIZE),
+        tick_skip=env_config.FRAME_SKIP,
+    )
+
+
+def run(source, match: ArrayMatch, actor, steps: int, timer: StageTimer):
+    step = 0
+    while step < steps:
+        with timer("state_setter"):
+            wrapper = source.reset()
+        state = source.initial_state(wrapper)
+        with timer("episode_reset"):
+            match.episode_reset(state)
+        done = False
+        while not done and step < steps:
+            with timer("obs"):
+                obs = match.build_observations(state)
+            with timer("actor"):
+                with torch.no_grad():
+                    actions = actor.get_action_distribution(np.stack(obs)).sample().numpy()
+            with timer("parse"):
+                match.format_actions(match.parse_actions(actions, state))
+            state = source.next_state()  # What the game would send back, not timed
+            with timer("terminal"):
+                done = match.is_done(state)
+            with timer("reward"):
+                match.get_rewards(state, done)
+            step += 1
+
+
+def report(timer: StageTimer, alloc_timer: StageTimer, steps: int) -> dict:
+    stages = {}
+    for stage in STAGES:
+        times = np.array(timer.times.get(stage, [0]), dtype=np.float64) / 1e3
+        calls = max(len(alloc_timer.times.get(stage, [])), 1)
+        stages[stage] = {
+            "calls": len(timer.times.get(stage, [])),
+            "mean_us": float(times.mean()),
+            "p99_us": float(np.percentile(times, 99)),
+            "peak_kb_per_call": alloc_timer.peak_bytes[stage] / calls / 1024,
+            "net_blocks_per_call": alloc_timer.net_blocks[stage] / calls,
+        }
+    total = sum(sum(timer.times.get(stage, [])) for stage in STAGES) / 1e9
+    return {"steps": steps, "steps_per_second": steps / total, "stages": stages}
+
+
+def compare(result: dict, baseline: dict, tolerance: float, min_us=5.) -> list:
+    regressions = []
+    for stage, stats in result["stages"].items():
+        before = baseline["stages"].get(stage, {}).get("mean_us")
+        # min_us keeps the stages that take next to nothing from failing on noise
+        if before and stats["mean_us"] > max(before * (1 + tolerance), before + min_us):
+            regressions.append(f"{stage}: {before:.1f}us -> {stats['mean_us']:.1f}us")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-step cost of the worker pipeline, no game needed")
+    parser.add_argument("--steps", type=int, default=5000)
+    parser.add_argument("--alloc_steps", type=int, default=500, help="steps of the tracemalloc run, 0 to skip")
+    parser.add_argument("--replay", action="store_true", help="ImmortalStateSetter resets and ssl_1v1.npy states")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=1, help="torch threads (workers use 1)")
+    parser.add_argument("--json", default=None, help="write the report here")
+    parser.add_argument("--baseline", default=None, help="report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown per stage vs the baseline")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    actor = get_actor(env_config.SPLIT, env_config.STATE_DIM)
+    make_source = (lambda: ReplaySource(args.seed)) if args.replay else (lambda: SyntheticSource(args.seed))
+
+    run(make_source(), make_match(), actor, min(200, args.steps), StageTimer())  # Warm up
+    timer = StageTimer()
+    run(make_source(), make_match(), actor, args.steps, timer)
+    alloc_timer = StageTimer(trace_alloc=True)
+    if args.alloc_steps:
+        tracemalloc.start()
+        run(make_source(), make_match(), actor, args.alloc_steps, alloc_timer)
+        tracemalloc.stop()
+
+    result = report(timer, alloc_timer, args.steps)
+    print(f"{result['steps_per_second']:.0f} steps/s ({'replay' if args.replay else 'synthetic'} states, "
+          f"{args.threads} thread(s))")
+    print(f"{'stage':>14} {'calls':>7} {'mean us':>9} {'p99 us':>9} {'peak KB':>9} {'net blocks':>11}")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:>14} {stats['calls']:>7} {stats['mean_us']:>9.1f} {stats['p99_us']:>9.1f} "
+              f"{stats['peak_kb_per_call']:>9.1f} {stats['net_blocks_per_call']:>11.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            raise SystemExit("Slower than the baseline:\n" + "\n".join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Checks BatchedCombinedReward gives the same rewards as CombinedReward over the per-player reward classes, then
+times both on random episodes.
+
+Run from the repo root: python -m tools.bench_rewards
+"""
+import importlib.util
+import os
+import time
+
+import numpy as np
+from rlgym.utils.reward_functions import CombinedReward
+from rlgym.utils.reward_functions.common_rewards import VelocityReward, EventReward
+
+from batched_rewards import BatchedCombinedReward, BatchedVelocityReward, BatchedKickoffReward, \
+    BatchedJumpTouchReward, BatchedEventReward, BatchedVelocityPlayerToBallReward, BatchedVelocityBallToGoalReward
+from rewards import JumpTouchReward, KickoffReward, TrackedCombinedReward, TrackedEventReward
+from tools.synthetic_states import random_episode
+
+
+def _load_vendored(name):
+    # The installed rlgym package shadows the vendored copies (which don't scale the velocity arrays in place)
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "rlgym", "utils", "reward_functions", "common_rewards", name + ".py")
+    spec = importlib.util.spec_from_file_location("vendored_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+VelocityPlayerToBallReward = _load_vendored("player_ball_rewards").VelocityPlayerToBallReward
+VelocityBallToGoalReward = _load_vendored("ball_goal_rewards").VelocityBallToGoalReward
+
+
+def reward_pairs():
+    event_kwargs = dict(team_goal=1200, demo=500, concede=-1200, goal=10, touch=1, shot=3, save=200)
+    return [
+        (VelocityReward(), BatchedVelocityReward(), 0.007),
+        (VelocityReward(negative=True), BatchedVelocityReward(negative=True), 0.001),
+        (KickoffReward(), BatchedKickoffReward(), 0.5),
+        (JumpTouchReward(), BatchedJumpTouchReward(), 4.0),
+        (EventReward(**event_kwargs), BatchedEventReward(**event_kwargs), 0.01),
+        (VelocityPlayerToBallReward(), BatchedVelocityPlayerToBallReward(), 0.004),
+        (VelocityPlayerToBallReward(use_scalar_projection=True),
+         BatchedVelocityPlayerToBallReward(use_scalar_projection=True), 0.0001),
+        (VelocityBallToGoalReward(), BatchedVelocityBallToGoalReward(), 0.02),
+        (VelocityBallToGoalReward(own_goal=True, use_scalar_projection=True),
+         BatchedVelocityBallToGoalReward(own_goal=True, use_scalar_projection=True), 0.0001),
+    ]
+
+
+def run_episode(reward_fn, episode):
+    # Mirrors Match.get_rewards, the last state of an episode is the terminal one
+    reward_fn.reset(episode[0])
+    rewards = []
+    for t, state in enumerate(episode[1:], start=1):
+        done = t == len(episode) - 1
+        get = reward_fn.get_final_reward if done else reward_fn.get_reward
+        rewards.append([get(player, state, np.zeros(8)) for player in state.players])
+    return np.array(rewards)
+
+
+def check_equivalence(rng, team_size, n_episodes=20, length=300):
+    for _ in range(n_episodes):
+        episode = random_episode(rng, length, team_size)
+        pairs = reward_pairs()
+        for scalar, batched, weight in pairs:
+            expected = run_episode(CombinedReward((scalar,), (weight,)), episode)
+            actual = run_episode(BatchedCombinedReward((batched,), (weight,)), episode)
+            np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12, err_msg=type(scalar).__name__)
+
+        expected = run_episode(CombinedReward.from_zipped(*((s, w) for s, _, w in pairs)), episode)
+        actual = run_episode(BatchedCombinedReward.from_zipped(*((b, w) for _, b, w in pairs)), episode)
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-9)
+
+        expected, actual = (run_episode(reward_fn, episode) for reward_fn in learner_rewards())
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-9)
+
+
+def learner_rewards():
+    # The terms env_config.rew() combines, per-player (1v1) and batched
+    scalar = TrackedCombinedReward.from_zipped(
+        (VelocityReward(), 0.007),
+        (KickoffReward(), 0.5),
+        (JumpTouchReward(), 4.0),
+        (TrackedEventReward(team_goal=1200, demo=500, concede=-1200), 0.01),
+    )
+    batched = BatchedCombinedReward.from_zipped(
+        (BatchedVelocityReward(), 0.007),
+        (BatchedKickoffReward(), 0.5),
+        (BatchedJumpTouchReward(), 4.0),
+        (BatchedEventReward(team_goal=1200, demo=500, concede=-1200), 0.01),
+    )
+    return scalar, batched
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    for team_size in (1, 2, 3):
+        check_equivalence(rng, team_size)
+    print("batched rewards match the per-player rewards")
+
+    for team_size in (1, 3):
+        episode = random_episode(rng, 5000, team_size)
+        for name, reward_fn in zip(("per-player", "batched"), learner_rewards()):
+            start = time.perf_counter()
+            run_episode(reward_fn, episode)
+            elapsed = time.perf_counter() - start
+            print(f"{team_size}v{team_size} {name:<10} {elapsed / len(episode) * 1e6:8.2f}us/step")
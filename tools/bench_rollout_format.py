@@ -0,0 +1,91 @@
+"""
+Compares the pickled rollouts rocket-learn sends by default with the columnar format of rollout_format.py: payload
+size, encode time on the worker and decode time on the learner, for every codec with and without float16
+observations. Also checks every decoded rollout matches what was sent.
+
+The rollout is shaped like what a 1v1 worker sends for one episode: per step observations of random states,
+action indices, rewards, dones, log-probs and the encoded game states.
+
+Run from the repo root: python -m tools.bench_rollout_format [--steps 1500]
+"""
+import argparse
+import pickle
+import time
+
+import numpy as np
+
+from env_config import STATE_DIM
+from rollout_format import CODECS, RolloutEncoder, decode
+from tools.model_maker import sample_observations
+
+
+def make_rollout(rng: np.random.Generator, steps: int, n_agents=2):
+    observations = sample_observations(steps * n_agents, seed=int(rng.integers(2 ** 31)))
+    buffers = []
+    for i in range(n_agents):
+        buffers.append((
+            list(observations[i * steps:(i + 1) * steps]),
+            rng.integers(0, 126, (steps, 1)),
+            rng.normal(0, 0.1, steps),
+            np.arange(steps) == steps - 1,
+            np.log(rng.uniform(0.01, 1, steps)).astype(np.float32),
+        ))
+    states = rng.normal(0, 1000, (steps, 9 + 3 * 3 + 2 * 39 + 34))
+    # Roughly (rollout_data, versions, uuid, name, result, has_obs, has_states, has_rewards)
+    return (states, buffers), [-1, 1234], "uuid", "worker", 0, True, True, True
+
+
+def _arrays(obj):
+    if isinstance(obj, np.ndarray):
+        yield obj
+    elif isinstance(obj, (list, tuple)):
+        for o in obj:
+            yield from _arrays(o)
+
+
+def max_error(sent, received) -> float:
+    sent, received = list(_arrays(sent)), list(_arrays(received))
+    assert len(sent) == len(received), "Decoded rollout has a different structure"
+    return max(float(np.abs(s.astype(np.float64) - r.astype(np.float64)).max(initial=0))
+               for s, r in zip(sent, received))
+
+
+def timed(fn, arg, repeats):
+    times = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        result = fn(arg)
+        times.append(time.perf_counter() - t)
+    return result, float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare rollout serialization formats")
+    parser.add_argument("--steps", type=int, default=1500, help="steps per agent in the rollout")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    rollout = make_rollout(np.random.default_rng(0), args.steps)
+    formats = {"pickle": (lambda obj: pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads)}
+    for codec in CODECS:
+        for fp16_obs in (False, True):
+            try:
+                encoder = RolloutEncoder(codec, fp16_obs=fp16_obs)
+                encoder(([np.zeros(STATE_DIM)],))
+            except ImportError as e:
+                print(f"skipping {codec}: {e}")
+                break
+            formats[f"{codec}{' fp16' if fp16_obs else ''}"] = (encoder, decode)
+
+    baseline = None
+    print(f"{'format':>12} {'MB':>8} {'ratio':>7} {'encode ms':>10} {'decode ms':>10} {'max error':>10}")
+    for name, (encode, decode_fn) in formats.items():
+        data, encode_time = timed(encode, rollout, args.repeats)
+        received, decode_time = timed(decode_fn, data, args.repeats)
+        baseline = baseline or len(data)
+        print(f"{name:>12} {len(data) / 2 ** 20:>8.2f} {baseline / len(data):>7.2f} {encode_time * 1e3:>10.2f} "
+              f"{decode_time * 1e3:>10.2f} {max_error(rollout, received):>10.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Reports how long a worker takes to get going: the cold import time of the env config, the worker and the learner
+modules, and the latency of the first step through the env factories (state setter, obs, actions, rewards)
+against a warm one. Every measurement runs in a fresh interpreter so nothing is already imported or cached.
+
+Run from the repo root: python -m tools.bench_startup [--repeats 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTS = ("env_config", "worker", "learner")
+
+_IMPORT_CODE = """
+import json, time
+t = time.perf_counter()
+import {module}
+print(json.dumps({{"import": time.perf_counter() - t}}))
+"""
+
+_STEP_CODE = """
+import json, os, time
+times = {}
+t = time.perf_counter()
+import env_config
+times["import"] = time.perf_counter() - t
+
+import numpy as np
+from tools.synthetic_states import random_state
+
+t = time.perf_counter()
+obs_builder, reward_fn, action_parser = env_config.obs(), env_config.rew(), env_config.act()
+times["factories"] = time.perf_counter() - t
+
+if os.path.exists("ssl_1v1.npy"):
+    from rlgym.utils.state_setters import StateWrapper
+    t = time.perf_counter()
+    setter = env_config.state_setter()
+    times["state_setter"] = time.perf_counter() - t
+    t = time.perf_counter()
+    setter.reset(StateWrapper(1, 1))
+    times["first_reset"] = time.perf_counter() - t
+
+rng = np.random.default_rng(0)
+states = [random_state(rng, team_size=1) for _ in range(2)]
+actions = rng.integers(0, action_parser.get_action_space().n, len(states[0].players))
+
+def step(state, prefix):
+    t = time.perf_counter()
+    obs_builder.reset(state)
+    reward_fn.reset(state)
+    times[prefix + "reset"] = time.perf_counter() - t
+    t = time.perf_counter()
+    parsed = action_parser.parse_actions(actions, state)
+    times[prefix + "parse"] = time.perf_counter() - t
+    t = time.perf_counter()
+    for player, action in zip(state.players, parsed):
+        obs_builder.build_obs(player, state, action)
+    times[prefix + "obs"] = time.perf_counter() - t
+    t = time.perf_counter()
+    for player, action in zip(state.players, parsed):
+        reward_fn.get_reward(player, state, action)
+    times[prefix + "reward"] = time.perf_counter() - t
+
+step(states[0], "first_")
+step(states[1], "warm_")
+print(json.dumps(times))
+"""
+
+
+def run(code: str) -> dict:
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        return {"error": error[-1] if error else f"exit code {result.returncode}"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def median_of(code: str, repeats: int) -> dict:
+    runs = [run(code) for _ in range(repeats)]
+    if any("error" in r for r in runs):
+        return next(r for r in runs if "error" in r)
+    return {key: float(np.median([r[key] for r in runs])) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time cold imports and the first env step")
+    parser.add_argument("--repeats", type=int, default=3, help="fresh interpreters per measurement, median reported")
+    args = parser.parse_args()
+
+    print("cold import, ms")
+    for module in IMPORTS:
+        result = median_of(_IMPORT_CODE.format(module=module), args.repeats)
+        if "error" in result:
+            print(f"{module:>14}  failed: {result['error']}")
+        else:
+            print(f"{module:>14} {result['import'] * 1e3:>9.1f}")
+
+    print("\nfirst step from a fresh env_config, ms")
+    result = median_of(_STEP_CODE, args.repeats)
+    if "error" in result:
+        raise SystemExit(f"failed: {result['error']}")
+    for key, value in result.items():
+        print(f"{key:>14} {value * 1e3:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
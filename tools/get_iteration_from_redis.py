@@ -1,23 +1,87 @@
-import sys
+"""
+Inspects the past versions of the actor stored in Redis, through the same OpponentCache the workers use.
 
+Usage:
+    python -m tools.get_iteration_from_redis <ip> <password> list
+    python -m tools.get_iteration_from_redis <ip> <password> dump <version> [--out model.pt]
+    python -m tools.get_iteration_from_redis <ip> <password> diff <version> <other_version>
+"""
+import argparse
+
+import torch
 from redis import Redis
-import cloudpickle as pickle
-import functools
 
-OPPONENT_MODELS = "opponent-models"
+from opponent_cache import OpponentCache
+
+
+def _state_dict(model) -> dict:
+    if isinstance(model, torch.nn.Module):
+        return model.state_dict()
+    if isinstance(model, dict):
+        for key in ("actor_state_dict", "state_dict"):
+            if key in model:
+                return model[key]
+        return {k: v for k, v in model.items() if isinstance(v, torch.Tensor)}
+    raise TypeError(f"Don't know how to get the weights of a {type(model).__name__}")
+
+
+def list_versions(cache: OpponentCache):
+    n = len(cache)
+    print(f"{n} versions in redis (0 to {n - 1})")
+    cached = cache.cached_versions()
+    if cached:
+        print(f"cached locally: {', '.join(map(str, cached))}")
 
-def _unserialize_model(buf):
-    agent = pickle.loads(buf)
-    return agent
 
-@functools.lru_cache(maxsize=8)
-def _get_past_model(redis, version):
-    assert isinstance(version, int)
-    return _unserialize_model(redis.lindex(OPPONENT_MODELS, version))
+def dump(cache: OpponentCache, version: int, out=None):
+    model = cache.get(version)
+    print(f"version {version}: {type(model).__name__}, {len(cache.get_bytes(version)) / 2 ** 20:.1f}MB pickled")
+    if isinstance(model, dict) and "epoch" in model:
+        print(f"epoch {model['epoch']}")
+    state_dict = _state_dict(model)
+    for name, tensor in state_dict.items():
+        print(f"  {name:<24} {tuple(tensor.shape)}")
+    print(f"{sum(t.numel() for t in state_dict.values()):,} parameters")
+    if out is not None:
+        torch.save(state_dict, out)
+        print(f"state dict saved to {out}")
+
+
+def diff(cache: OpponentCache, version: int, other: int):
+    a = _state_dict(cache.get(version))
+    b = _state_dict(cache.get(other))
+    if a.keys() != b.keys():
+        print(f"different layers, only in {version}: {sorted(a.keys() - b.keys())}, "
+              f"only in {other}: {sorted(b.keys() - a.keys())}")
+    print(f"{'layer':<24} {'|a|':>10} {'|b - a|':>10} {'relative':>10}")
+    for name in (k for k in a if k in b):
+        if a[name].shape != b[name].shape:
+            print(f"{name:<24} shape {tuple(a[name].shape)} vs {tuple(b[name].shape)}")
+            continue
+        norm = a[name].float().norm().item()
+        delta = (b[name].float() - a[name].float()).norm().item()
+        print(f"{name:<24} {norm:>10.4f} {delta:>10.4f} {delta / max(norm, 1e-12):>10.2%}")
+
 
 if __name__ == '__main__':
-    _, ip, password = sys.argv
-    redis = Redis(host=ip, password=password)
-    model = _get_past_model(redis, 898)
-    print(model['epoch'])
-    exit(0)
+    parser = argparse.ArgumentParser(description="Inspect past actor versions in redis")
+    parser.add_argument("ip")
+    parser.add_argument("password")
+    parser.add_argument("--cache_dir", default=None, help="local cache shared with the workers")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list")
+    dump_parser = commands.add_parser("dump")
+    dump_parser.add_argument("version", type=int)
+    dump_parser.add_argument("--out", default=None, help="save the state dict here")
+    diff_parser = commands.add_parser("diff")
+    diff_parser.add_argument("version", type=int)
+    diff_parser.add_argument("other", type=int)
+    args = parser.parse_args()
+
+    cache = OpponentCache(Redis(host=args.ip, password=args.password), cache_dir=args.cache_dir)
+    if args.command == "list":
+        list_versions(cache)
+    elif args.command == "dump":
+        dump(cache, args.version, args.out)
+    else:
+        diff(cache, args.version, args.other)
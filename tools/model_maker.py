@@ -1,20 +1,172 @@
-import torch
+"""
+Exports the actor of a learner checkpoint for inference on CPU-only machines (workers, streamer and human-match bots).
+
+The SplitLayer is folded away, so every exported model maps (batch, 107) observations to (batch, 126) logits.
+Variants are float32, bfloat16 and dynamically int8 quantized TorchScript, plus float32 ONNX on request. Each one
+is checked against the eager actor's action distributions and timed at batch sizes 1 to 256.
+
+Run from the repo root: python -m tools.model_maker <checkpoint.pt> [--out exported] [--onnx]
+"""
+import argparse
 import os
+import time
+
+import numpy as np
+import torch
+from torch import nn
 
-from agent import get_actor
-from rocket_learn.agent.actor_critic_agent import ActorCriticAgent
+from agent import get_actor, load_by_position
+from obs import BatchedAdvancedObs
+from tools.synthetic_states import random_state
 
 split = (126,)
 
 # TOTAL SIZE OF THE INPUT DATA
 state_dim = 107
 
-actor = get_actor(split, state_dim, True)
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+# Max absolute difference in action probabilities against the eager actor
+TOLERANCES = {"fp32": 1e-5, "bf16": 2e-2, "int8": 2e-2}
+
+
+class _Bfloat16(nn.Module):
+    def __init__(self, net: nn.Module):
+        super().__init__()
+        self.net = net.to(torch.bfloat16)
+
+    def forward(self, obs: torch.Tensor) -> torch.Tensor:
+        return self.net(obs.to(torch.bfloat16)).float()
+
+
+def load_actor(checkpoint_file: str):
+    checkpoint = torch.load(checkpoint_file, map_location="cpu")
+    actor = get_actor(split, state_dim, True)
+    # By position, so shared trunk actors load as well
+    load_by_position(actor, checkpoint.get("actor_state_dict", checkpoint))
+    return actor.eval()
+
+
+def fold_split(actor) -> nn.Sequential:
+    # With a single split the SplitLayer just wraps the logits in a tuple
+    assert len(split) == 1, "Only a single split can be folded"
+    return nn.Sequential(*list(actor.net)[:-1]).eval()
+
+
+def _copy_actor(actor):
+    # The bfloat16 and int8 variants convert their weights in place
+    copy = get_actor(split, state_dim, True)
+    copy.load_state_dict(actor.state_dict())
+    return copy.eval()
+
+
+def make_variants(actor) -> dict:
+    folded = fold_split(actor)
+    example = torch.zeros(1, state_dim)
+    variants = {"fp32": folded}
+    variants["bf16"] = _Bfloat16(fold_split(_copy_actor(actor)))
+    variants["int8"] = torch.quantization.quantize_dynamic(fold_split(_copy_actor(actor)), {nn.Linear},
+                                                           dtype=torch.qint8)
+    with torch.no_grad():
+        return {name: torch.jit.freeze(torch.jit.trace(model.eval(), example)) for name, model in variants.items()}
+
+
+def sample_observations(n=4096, seed=0) -> np.ndarray:
+    # Observations of random 1v1 states, closer to what the actor sees than gaussian noise
+    rng = np.random.default_rng(seed)
+    obs_builder = BatchedAdvancedObs()
+    observations = []
+    while len(observations) < n:
+        state = random_state(rng, team_size=1)
+        obs_builder.reset(state)
+        for player in state.players:
+            observations.append(obs_builder.build_obs(player, state, rng.integers(-1, 2, 8).astype(float))[0])
+    return np.array(observations[:n], dtype=np.float32)
+
+
+def verify(actor, model, observations: np.ndarray) -> dict:
+    obs = torch.from_numpy(observations)
+    with torch.no_grad():
+        expected = actor.get_action_distribution(obs).probs.reshape(len(obs), -1)
+        actual = torch.softmax(model(obs).float(), dim=-1)
+    kl = (expected * (torch.log(expected + 1e-12) - torch.log(actual + 1e-12))).sum(-1)
+    return {
+        "max_prob_diff": (expected - actual).abs().max().item(),
+        "mean_kl": kl.mean().item(),
+        "argmax_agreement": (expected.argmax(-1) == actual.argmax(-1)).float().mean().item(),
+    }
+
+
+def benchmark(model, observations: np.ndarray, min_time=0.2) -> dict:
+    """
+    :return: {batch_size: (median latency in ms, samples per second)}.
+    """
+    results = {}
+    with torch.no_grad():
+        for batch_size in BATCH_SIZES:
+            obs = torch.from_numpy(observations[:batch_size])
+            for _ in range(3):
+                model(obs)  # Warm up, the first calls of a TorchScript module are profiled
+            times = []
+            start = time.perf_counter()
+            while time.perf_counter() - start < min_time or len(times) < 10:
+                t = time.perf_counter()
+                model(obs)
+                times.append(time.perf_counter() - t)
+            latency = float(np.median(times))
+            results[batch_size] = (latency * 1e3, batch_size / latency)
+    return results
+
+
+def export_onnx(model: nn.Module, file: str):
+    torch.onnx.export(model, torch.zeros(1, state_dim), file, input_names=["obs"], output_names=["logits"],
+                      dynamic_axes={"obs": {0: "batch"}, "logits": {0: "batch"}}, opset_version=13)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the actor of a checkpoint for CPU inference")
+    parser.add_argument("checkpoint", help="checkpoint.pt written by the learner")
+    parser.add_argument("--out", default="exported", help="output directory")
+    parser.add_argument("--onnx", action="store_true", help="also export the float32 actor to ONNX")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads while benchmarking (workers use 1)")
+    parser.add_argument("--no_bench", action="store_true", help="skip the latency report")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    os.makedirs(args.out, exist_ok=True)
+
+    actor = load_actor(args.checkpoint)
+    observations = sample_observations()
+    variants = make_variants(actor)
+
+    failed = []
+    for name, model in variants.items():
+        file = os.path.join(args.out, f"actor_{name}.pt")
+        torch.jit.save(model, file)
+        check = verify(actor, torch.jit.load(file), observations)
+        ok = check["max_prob_diff"] <= TOLERANCES[name]
+        if not ok:
+            failed.append(name)
+        print(f"{file}: {os.path.getsize(file) / 2 ** 20:.1f}MB, max prob diff {check['max_prob_diff']:.2e}, "
+              f"mean KL {check['mean_kl']:.2e}, argmax agreement {check['argmax_agreement']:.2%}"
+              f"{'' if ok else ' OVER TOLERANCE'}")
+
+    if args.onnx:
+        file = os.path.join(args.out, "actor_fp32.onnx")
+        export_onnx(fold_split(actor), file)
+        print(f"{file}: {os.path.getsize(file) / 2 ** 20:.1f}MB")
+
+    if not args.no_bench:
+        models = {"eager": lambda obs: actor.get_action_distribution(obs).logits, **variants}
+        print(f"\nlatency ms / samples per second, {args.threads} thread(s)")
+        print("batch " + "".join(f"{name:>22}" for name in models))
+        reports = {name: benchmark(model, observations) for name, model in models.items()}
+        for batch_size in BATCH_SIZES:
+            row = (reports[name][batch_size] for name in models)
+            print(f"{batch_size:>5} " + "".join(f"{latency:>10.3f} /{throughput:>10.0f}" for latency, throughput in row))
+
+    if failed:
+        raise SystemExit(f"Variants over tolerance: {', '.join(failed)}")
+
 
-# PPO REQUIRES AN ACTOR/CRITIC AGENT
 if __name__ == '__main__':
-    cur_dir = os.path.dirname(os.path.realpath(__file__))
-    checkpoint = torch.load(os.path.join(cur_dir, "checkpoint25.pt"))
-    actor.load_state_dict(checkpoint['actor_state_dict'])
-    actor.eval()
-    torch.jit.save(torch.jit.script(actor), 'jit.pt')
\ No newline at end of file
+    main()
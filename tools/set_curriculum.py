@@ -0,0 +1,18 @@
+"""
+Publishes setter weights for ImmortalStateSetter by hand, workers pick them up within a poll interval.
+The learner overrides them again when its curriculum is adaptive.
+
+Usage: python -m tools.set_curriculum <ip> <password> <replay> <random> <kickoff> <hoops> <walls> <goalie>
+"""
+import sys
+
+from redis import Redis
+
+from curriculum import publish_weights
+
+if __name__ == '__main__':
+    _, ip, password, *weights = sys.argv
+    assert len(weights) == 6, "Need one weight per setter"
+    redis = Redis(host=ip, password=password)
+    publish_weights(redis, [float(w) for w in weights])
+    print("published", weights)
@@ -0,0 +1,96 @@
+"""
+Random GameStates in the same float layout the RLGym plugin sends, decoded as ArrayMatch does, for the benchmarks in
+tools/ (no game needed).
+"""
+import numpy as np
+from rlgym.utils.common_values import BLUE_TEAM, ORANGE_TEAM, SIDE_WALL_X, BACK_WALL_Y, CEILING_Z, BALL_RADIUS, \
+    BALL_MAX_SPEED, CAR_MAX_SPEED, CAR_MAX_ANG_VEL
+from rlgym.utils.math import euler_to_rotation, rotation_to_quaternion
+from rlgym.utils.state_setters import StateWrapper
+
+from state_arrays import ArrayGameState
+
+INVERT = np.array([-1, -1, 1])
+
+
+def _invert_quaternion(q):
+    # Rotated half a turn around z, which is how the plugin builds the inverted car
+    w, x, y, z = q
+    return np.array([-z, -y, x, w])
+
+
+def random_state_floats(rng: np.random.Generator, team_size=1, scores=(0, 0), kickoff=False) -> list:
+    floats = [0., scores[0], scores[1]]
+    floats += (rng.random(34) < 0.7).astype(float).tolist()
+
+    ball_pos = rng.uniform([-SIDE_WALL_X, -BACK_WALL_Y, BALL_RADIUS], [SIDE_WALL_X, BACK_WALL_Y, CEILING_Z / 2])
+    if kickoff:
+        ball_pos[:2] = 0
+    ball_vel = rng.uniform(-1, 1, 3) * BALL_MAX_SPEED / 3
+    ball_ang_vel = rng.uniform(-1, 1, 3) * CAR_MAX_ANG_VEL
+    for sign in (1, INVERT):
+        floats += np.concatenate([ball_pos * sign, ball_vel * sign, ball_ang_vel * sign]).tolist()
+
+    for i in range(2 * team_size):
+        team = BLUE_TEAM if i < team_size else ORANGE_TEAM
+        car_id = (StateWrapper.BLUE_ID1 + i) if team == BLUE_TEAM else (StateWrapper.ORANGE_ID1 + i - team_size)
+        pos = rng.uniform([-SIDE_WALL_X, -BACK_WALL_Y, 17], [SIDE_WALL_X, BACK_WALL_Y, CEILING_Z / 2])
+        quat = rng.normal(size=4)
+        quat /= np.linalg.norm(quat)
+        vel = rng.uniform(-1, 1, 3) * CAR_MAX_SPEED / 2
+        ang_vel = rng.uniform(-1, 1, 3) * CAR_MAX_ANG_VEL
+
+        floats += [car_id, team]
+        floats += np.concatenate([pos, quat, vel, ang_vel]).tolist()
+        floats += np.concatenate([pos * INVERT, _invert_quaternion(quat), vel * INVERT, ang_vel * INVERT]).tolist()
+        floats += [
+            rng.integers(0, 3),  # goals
+            rng.integers(0, 3),  # saves
+            rng.integers(0, 3),  # shots
+            rng.integers(0, 3),  # demos
+            rng.integers(0, 10),  # boost pickups
+            rng.random() < 0.02,  # demoed
+            rng.random() < 0.6,  # on ground
+            rng.random() < 0.2,  # ball touched
+            rng.random() < 0.5,  # has flip
+            rng.random(),  # boost
+        ]
+    return [float(f) for f in floats]
+
+
+def random_state(rng: np.random.Generator, team_size=1, scores=(0, 0), kickoff=False) -> ArrayGameState:
+    return ArrayGameState(random_state_floats(rng, team_size, scores, kickoff))
+
+
+def random_episode(rng: np.random.Generator, length, team_size=1, kickoff_prob=0.1, goal_prob=0.01):
+    """
+    A list of unrelated random states, with scores that only go up as they would during an episode.
+    """
+    scores = np.zeros(2, dtype=int)
+    states = []
+    for _ in range(length):
+        if rng.random() < goal_prob:
+            scores[rng.integers(0, 2)] += 1
+        states.append(random_state(rng, team_size, tuple(scores), kickoff=rng.random() < kickoff_prob))
+    return states
+
+
+def state_from_wrapper(wrapper: StateWrapper, scores=(0, 0)) -> ArrayGameState:
+    """
+    The GameState the game would send right after a state setter filled wrapper, for benchmarking with real
+    positions (e.g. replay states). Match stats are zero and every boost pad is up.
+    """
+    floats = [0., scores[0], scores[1]] + [1.] * 34
+    ball = wrapper.ball
+    for sign in (1, INVERT):
+        floats += np.concatenate([ball.position * sign, ball.linear_velocity * sign,
+                                  ball.angular_velocity * sign]).tolist()
+    for car in wrapper.cars:
+        quat = rotation_to_quaternion(euler_to_rotation(np.asarray(car.rotation, dtype=float)))
+        pos, vel, ang_vel = (np.asarray(v, dtype=float) for v in (car.position, car.linear_velocity,
+                                                                  car.angular_velocity))
+        floats += [car.id, car.team_num]
+        floats += np.concatenate([pos, quat, vel, ang_vel]).tolist()
+        floats += np.concatenate([pos * INVERT, _invert_quaternion(quat), vel * INVERT, ang_vel * INVERT]).tolist()
+        floats += [0, 0, 0, 0, 0, 0, pos[2] < 20, 0, 1, car.boost]
+    return ArrayGameState([float(f) for f in floats])
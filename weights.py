@@ -0,0 +1,136 @@
+"""
+Versioned actor weight broadcast.
+
+RedisRolloutGenerator publishes every new actor as a cloudpickled module. Instead, the learner publishes the
+parameters once per version as one raw contiguous float32 (or float16) buffer first, and a small ActorHandle as the
+latest model (see ImmortalRolloutGenerator.update_parameters). When a worker unpickles the handle it only downloads
+the buffer if it doesn't have that version yet, and copies it straight into preallocated parameters, no cloudpickle
+involved.
+
+Worker processes on the learner's host (local training) get the parameters from SharedActor instead, shared memory
+tensors the learner copies every new version into.
+"""
+import threading
+import time
+
+import numpy as np
+import torch
+
+from agent import get_actor
+
+ACTOR_WEIGHTS = "actor-weights"
+
+
+def flatten_parameters(actor, dtype=np.float32) -> bytes:
+    return np.concatenate([t.detach().cpu().numpy().ravel() for t in actor.state_dict().values()]).astype(dtype).tobytes()
+
+
+def publish_weights(redis, actor, dtype=np.float32) -> int:
+    # Versioned by time, so a restarted learner never reuses a version a worker has cached
+    version = time.time_ns()
+    redis.hset(ACTOR_WEIGHTS, mapping={
+        "version": version,
+        "dtype": np.dtype(dtype).str,
+        "data": flatten_parameters(actor, dtype),
+    })
+    return version
+
+
+class ActorHandle:
+    """
+    What the learner publishes as the latest model. Unpickled on the worker it becomes the actor itself, see
+    WeightReceiver.load.
+    """
+
+    def __init__(self, version: int, split, state_dim: int):
+        self.version = version
+        self.split = tuple(split)
+        self.state_dim = state_dim
+
+    def __reduce__(self):
+        return _load_handle, (self.version, self.split, self.state_dim)
+
+
+def _load_handle(version, split, state_dim):
+    if _receiver is None:
+        raise RuntimeError("No WeightReceiver set in this process, call weights.set_receiver first")
+    return _receiver.load(version, split, state_dim)
+
+
+class WeightReceiver:
+    """
+    Worker side. Keeps two preallocated actors and writes every new version into the one that isn't current, so
+    a forward pass on the current actor (from another match thread) never sees half written weights.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.version = None
+        self._actors = []
+        self._current = 0
+        self._lock = threading.Lock()
+
+    def load(self, version: int, split, state_dim: int):
+        with self._lock:
+            if self.version is not None and version <= self.version:
+                return self._actors[self._current]  # Another match of this process already fetched it
+
+            published_version, dtype, data = self.redis.hmget(ACTOR_WEIGHTS, ["version", "dtype", "data"])
+            if data is None:
+                raise RuntimeError("The learner hasn't published any actor weights")
+            if not self._actors:
+                self._actors = [get_actor(split, state_dim) for _ in range(2)]
+                self._current = 1
+
+            actor = self._actors[1 - self._current]
+            flat = np.frombuffer(data, dtype=np.dtype(dtype.decode()))
+            params = actor.state_dict()
+            assert len(flat) == sum(t.numel() for t in params.values()), "Published weights don't fit the actor"
+            offset = 0
+            with torch.no_grad():
+                for tensor in params.values():
+                    # Writes (and casts) straight into the parameter memory
+                    np.copyto(tensor.numpy(), flat[offset:offset + tensor.numel()].reshape(tensor.shape))
+                    offset += tensor.numel()
+
+            self._current = 1 - self._current
+            self.version = int(published_version)  # May be newer than the handle, which is fine
+            return actor
+
+
+_receiver = None
+
+
+def set_receiver(receiver: WeightReceiver):
+    global _receiver
+    _receiver = receiver
+
+
+class SharedActor:
+    """
+    The latest actor's parameters in shared memory tensors, passed to worker processes when they are started.
+    """
+
+    def __init__(self, actor, ctx):
+        self.tensors = [t.detach().cpu().clone().share_memory_() for t in actor.state_dict().values()]
+        self.version = ctx.Value("q", 1)
+        self.lock = ctx.Lock()
+
+    def publish(self, actor):
+        with self.lock, torch.no_grad():
+            for shared, tensor in zip(self.tensors, actor.state_dict().values()):
+                shared.copy_(tensor)
+            self.version.value += 1
+
+    def load(self, actor, version: int) -> int:
+        """
+        Copies the parameters into actor if there is a version newer than version.
+
+        :return: the version actor has now.
+        """
+        if self.version.value == version:
+            return version
+        with self.lock, torch.no_grad():
+            for tensor, shared in zip(actor.state_dict().values(), self.tensors):
+                tensor.copy_(shared)
+            return self.version.value
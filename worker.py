@@ -3,22 +3,26 @@ import sys
 
 import torch
 from redis import Redis
-from rlgym.envs import Match
 from rlgym.utils.terminal_conditions.common_conditions import TimeoutCondition, NoTouchTimeoutCondition, \
     GoalScoredCondition
 
-import learner
-from learner import WORKER_COUNTER
-from rocket_learn.agent.pretrained_agents.human_agent import HumanAgent
+import env_config
+from curriculum import RedisCurriculumSource
+from env_config import WORKER_COUNTER, FRAME_SKIP
+from inference_server import RemoteActor, remote_loading
+from multi_worker import MultiMatchWorker
+from pretrained import lazy_agent
+from rollout_format import CODECS, RolloutEncoder, install as install_rollout_format
 from rocket_learn.agent.pretrained_agents.necto.necto_v1 import NectoV1
 from rocket_learn.agent.pretrained_agents.nexto.nexto import Nexto
 from rocket_learn.rollout_generator.redis_rollout_generator import RedisRolloutWorker
-from state import ImmortalStateSetter
+from telemetry import RedisTelemetrySink, set_sink
+from opponent_cache import OpponentCache, install as install_opponent_cache
+from weights import WeightReceiver, set_receiver
 
 
-def get_match(game_speed=100, human_match=False):
-    frame_skip = 6  # Number of ticks to repeat an action
-    fps = 120 / frame_skip
+def get_match(game_speed=100, human_match=False, curriculum_source=None):
+    fps = 120 / FRAME_SKIP
 
     terminals = [TimeoutCondition(round(fps * 30)),
                  NoTouchTimeoutCondition(round(fps * 20)),
@@ -27,32 +31,30 @@ def get_match(game_speed=100, human_match=False):
         terminals = [TimeoutCondition(round(fps * 180)),
                      GoalScoredCondition()],
 
-    return Match(
-        game_speed=game_speed,
-        self_play=True,
-        team_size=1,
-        state_setter=ImmortalStateSetter(),
-        obs_builder=learner.obs(),
-        action_parser=learner.act(),
-        terminal_conditions=[TimeoutCondition(round(fps * 30)),
-                             NoTouchTimeoutCondition(round(fps * 20)),
-                             GoalScoredCondition()],
-        reward_function=learner.rew(),
-        tick_skip=frame_skip,
-    )
+    return env_config.match(game_speed=game_speed, curriculum_source=curriculum_source)
 
 
 def make_worker(host, name, password, limit_threads=True, send_gamestates=False,
-                is_streamer=False, human_match=False):
+                is_streamer=False, human_match=False, n_matches=1, batch_timeout=0.005,
+                opponent_cache_dir=None, inference_server=None, rollout_codec=None, fp16_obs=False):
     if limit_threads:
         torch.set_num_threads(1)
     r = Redis(host=host, password=password)
     w = r.incr(WORKER_COUNTER) - 1
+    set_sink(RedisTelemetrySink(r))  # Flushed by the reward function between episodes
+    set_receiver(WeightReceiver(r))  # Loads the actor handles the learner publishes
+    if rollout_codec is not None or fp16_obs:
+        install_rollout_format(RolloutEncoder(rollout_codec or "none", fp16_obs=fp16_obs))
 
     model_name1 = "necto-model-30Y.pt"
     model_name2 = "nexto-model.pt"
-    nectov1 = NectoV1(model_string=model_name1, n_players=2)
-    nexto = Nexto(model_string=model_name2, n_players=2)
+    # LOADED THE FIRST TIME THEY ARE PICKED, FROM THE HOST'S INFERENCE SERVER IF THERE IS ONE
+    necto_loading = nexto_loading = None
+    if inference_server is not None:
+        necto_loading = lambda: remote_loading(inference_server, "necto")
+        nexto_loading = lambda: remote_loading(inference_server, "nexto")
+    nectov1 = lazy_agent(NectoV1, necto_loading, model_string=model_name1, n_players=2)
+    nexto = lazy_agent(Nexto, nexto_loading, model_string=model_name2, n_players=2)
 
     # EACH AGENT AND THEIR PROBABILITY OF OCCURRENCE
     agents = {nectov1: .10, nexto: .30}
@@ -72,11 +74,33 @@ def make_worker(host, name, password, limit_threads=True, send_gamestates=False,
         past_prob = 0
         eval_prob = 0
         game_speed = 1
+        from rocket_learn.agent.pretrained_agents.human_agent import HumanAgent
         human = HumanAgent()
 
+    if past_prob > 0:
+        # PAST VERSIONS ARE SHARED BY ALL MATCHES OF THE PROCESS, LATEST ONES PREFETCHED IN THE BACKGROUND
+        opponents = OpponentCache(r, cache_dir=opponent_cache_dir)
+        opponents.start_prefetch()
+        install_opponent_cache(opponents)
+
+    if n_matches > 1 or inference_server is not None:
+        # ONE BATCHED ACTOR FORWARD FOR ALL THE MATCHES OF THIS PROCESS (OR HOST, WITH AN INFERENCE SERVER)
+        return MultiMatchWorker(r, name,
+                                lambda i: get_match(game_speed=game_speed,
+                                                    curriculum_source=RedisCurriculumSource(r)),
+                                n_matches=n_matches,
+                                batch_timeout=batch_timeout,
+                                batcher=RemoteActor(inference_server) if inference_server is not None else None,
+                                past_version_prob=past_prob,
+                                evaluation_prob=eval_prob,
+                                send_gamestates=send_gamestates,
+                                streamer_mode=False,
+                                pretrained_agents=agents)
+
     return RedisRolloutWorker(r, name,
                               match=get_match(game_speed=game_speed,
-                                              human_match=human_match),
+                                              human_match=human_match,
+                                              curriculum_source=RedisCurriculumSource(r)),
                               past_version_prob=past_prob,
                               evaluation_prob=eval_prob,
                               send_gamestates=send_gamestates,
@@ -105,6 +129,19 @@ def main():
                         help='Start a streamer match, dont learn with this instance')
     parser.add_argument('--human_match', action='store_true',
                         help='Play a human match against Necto')
+    parser.add_argument('--matches', type=int, default=1,
+                        help='Number of matches to run in this process, sharing one batched actor')
+    parser.add_argument('--batch_timeout', type=float, default=5,
+                        help='Milliseconds to wait for the other matches before running the actor on a partial batch')
+    parser.add_argument('--opponent_cache', type=str, default=None,
+                        help='Directory to keep downloaded past versions in, shared by the workers of a host')
+    parser.add_argument('--rollout_codec', choices=CODECS, default=None,
+                        help='Send rollouts in the columnar format, compressed with this codec (lz4 and zstd need '
+                             'the lz4 / zstandard packages)')
+    parser.add_argument('--fp16_obs', action='store_true',
+                        help='Send the observations of columnar rollouts as float16')
+    parser.add_argument('--inference_server', type=str, default=None,
+                        help='Socket of the host inference server (python -m inference_server) to run the models in')
 
     args = parser.parse_args()
 
@@ -114,13 +151,20 @@ def main():
     compress = args.compress
     stream_state = args.streamer_mode
     human_match = args.human_match
+    n_matches = 1 if human_match else args.matches
 
     try:
         worker = make_worker(ip, name, password,
                              limit_threads=True,
                              send_gamestates=compress,
                              is_streamer=stream_state,
-                             human_match=human_match)
+                             human_match=human_match,
+                             n_matches=n_matches,
+                             batch_timeout=args.batch_timeout / 1000,
+                             opponent_cache_dir=args.opponent_cache,
+                             inference_server=None if human_match else args.inference_server,
+                             rollout_codec=args.rollout_codec,
+                             fp16_obs=args.fp16_obs)
         worker.run()
     finally:
         print("Problem Detected. Killing Worker...")